@@ -0,0 +1,293 @@
+import http.client
+import json
+import math
+import random
+import sys
+import threading
+import time
+from collections import namedtuple
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# latency: seconds every response is delayed by.
+# error_rate: share of document requests that fail (503, or an empty result for aramalist, which is how that endpoint fails).
+# doc_size: size of every document body in bytes.
+# doc_count: number of documents each site lists.
+SiteConfig = namedtuple("SiteConfig", ["latency", "error_rate", "doc_size", "doc_count"])
+SiteConfig.__new__.__defaults__ = (0.0, 0.0, 20000, 500)
+
+UYUSMAZLIK_PAGE_SIZE = 10
+# Navigation, scripts and footer around the Uyusmazlik grid, so that the pages are about as large as the real ones.
+UYUSMAZLIK_CHROME = (
+    "".join('<script src="/js/s%d.js"></script><link rel="stylesheet" href="/css/c%d.css">' % (i, i) for i in range(20)),
+    "<nav>" + "".join('<ul class="menu"><li><a href="/m%d">Menü %d</a><span>Açıklama</span></li></ul>' % (i, i) for i in range(300)) + "</nav>",
+    "<footer>" + "<p>Uyuşmazlık Mahkemesi</p>" * 500 + "</footer>",
+)
+
+
+def doc_body(number, size):
+    """Returns the deterministic body of a document, so that repeated downloads have the same hash."""
+    pattern = ("Belge %d. " % number).encode()
+    return (pattern * (size // len(pattern) + 1))[:size]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """Base handler of the stand-in sites. Every response is delayed by config.latency and uses keep-alive connections."""
+    protocol_version = "HTTP/1.1"
+    config = SiteConfig()
+    random = random.Random(0)
+
+    def log_message(self, format, *args):
+        pass
+
+    def fails(self):
+        return self.random.random() < self.config.error_rate
+
+    def read_json(self):
+        return json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+
+    def respond(self, status, body=b"", content_type="text/html; charset=utf-8", headers={}):
+        time.sleep(self.config.latency)
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def respond_json(self, data):
+        self.respond(200, json.dumps(data, ensure_ascii=False).encode(), "application/json; charset=utf-8")
+
+    def respond_doc(self, number, content_type):
+        if self.fails():
+            self.respond(503, b"Service Unavailable")
+            return
+
+        body = doc_body(number, self.config.doc_size)
+        self.respond(200, body, content_type, {"ETag": '"%d-%d"' % (number, len(body))})
+
+
+class MevzuatHandler(MockHandler):
+    """Stand-in for www.mevzuat.gov.tr: the anasayfa/MevzuatDatatable listing and the MevzuatMetin/*.doc downloads."""
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/anasayfa/MevzuatDatatable":
+            return self.respond(404)
+
+        body = self.read_json()
+        start = body["start"]
+        numbers = range(start, min(start + body["length"], self.config.doc_count))
+        self.respond_json({
+            "draw": body["draw"],
+            "recordsTotal": self.config.doc_count,
+            "recordsFiltered": self.config.doc_count,
+            "data": [{
+                "mevzuatNo": str(number),
+                "mevzuatTur": 1,
+                "mevzuatTertip": 5,
+                "mevzuatAdi": "Kanun " + str(number),
+                "resmiGazeteTarihi": "01.01.2020",
+                "url": "mevzuat?MevzuatNo=%d&MevzuatTur=1&MevzuatTertip=5" % number,
+            } for number in numbers],
+        })
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if not (path.startswith("/MevzuatMetin/") and path.endswith(".doc")):
+            return self.respond(404)
+
+        self.respond_doc(int(path[len("/MevzuatMetin/"):-len(".doc")].split(".")[2]), "application/msword")
+
+    do_HEAD = do_GET
+
+
+class UyusmazlikHandler(MockHandler):
+    """Stand-in for kararlar.uyusmazlik.gov.tr: the home page with the page count, the Arama/_Grid pages and the decisions."""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+
+        if url.path == "/":
+            page_count = math.ceil(self.config.doc_count / UYUSMAZLIK_PAGE_SIZE)
+            self.respond(200, self.page('<input class="pageInput" type="text" value="1" data-max="%d"/>' % page_count))
+        elif url.path == "/Arama/_Grid":
+            self.respond(200, self.page(self.grid(int(query["page"][0]))))
+        elif url.path == "/Karar/Getir":
+            self.respond_doc(int(query["id"][0]), "text/html; charset=utf-8")
+        else:
+            self.respond(404)
+
+    do_HEAD = do_GET
+
+    def page(self, content):
+        scripts, nav, footer = UYUSMAZLIK_CHROME
+        return ("<html><head><title>Kararlar</title>" + scripts + "</head><body>" + nav + content + footer + "</body></html>").encode()
+
+    def grid(self, page):
+        start = (page - 1) * UYUSMAZLIK_PAGE_SIZE
+        rows = []
+        for number in range(start, min(start + UYUSMAZLIK_PAGE_SIZE, self.config.doc_count)):
+            href = "Karar/Getir?id=%d" % number
+            cells = ["%d/%d" % (2020, number), "%d/%d" % (2019, number), "Hukuk Bölümü", "Görev", "Kabul"]
+            rows.append('<div class="row">' + "".join(
+                '<div class="col" data-content="Karar %d"><a href="%s">%s</a></div>' % (number, href, cell) for cell in cells
+            ) + "</div>")
+        return '<div class="grid">' + "".join(rows) + "</div>"
+
+
+class CommonXHandler(MockHandler):
+    """Stand-in for the aramalist JSON endpoint of emsal.uyap.gov.tr and karararama.*.gov.tr."""
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/aramalist":
+            return self.respond(404)
+
+        body = self.read_json()["data"]
+        if self.fails():
+            # The endpoint answers with 200 and no data when it throttles.
+            return self.respond_json({"data": None, "metadata": {"FMTY": "ERROR"}})
+
+        start = (body["pageNumber"] - 1) * body["pageSize"]
+        numbers = range(start, min(start + body["pageSize"], self.config.doc_count))
+        self.respond_json({"data": {
+            "recordsTotal": self.config.doc_count,
+            "recordsFiltered": self.config.doc_count,
+            "data": [{
+                "id": str(number),
+                "daire": "1. Hukuk Dairesi",
+                "esasNo": "2019/%d" % number,
+                "kararNo": "2020/%d" % number,
+                "kararTarihi": "01.01.2020",
+                "arananKelime": "***",
+            } for number in numbers],
+        }})
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Scrapers close streamed responses of failed requests without reading them.
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+HANDLERS = {"mevzuat": MevzuatHandler, "uyusmazlik": UyusmazlikHandler, "commonx": CommonXHandler}
+
+
+# latency: seconds every forwarded request is delayed by.
+# error_rate: share of requests answered with 502 instead of being forwarded.
+# throttle_rate: requests per second the proxy forwards; beyond that it answers 429 with Retry-After, like a site that throttles each IP.
+ProxyConfig = namedtuple("ProxyConfig", ["latency", "error_rate", "throttle_rate"])
+ProxyConfig.__new__.__defaults__ = (0.0, 0.0, None)
+
+
+class ProxyHandler(BaseHTTPRequestHandler):
+    """A forward HTTP proxy for plain http:// URLs, standing in for the proxies of a ProxyPool."""
+    protocol_version = "HTTP/1.1"
+    config = ProxyConfig()
+    random = random.Random(0)
+    bucket = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self, status, headers={}):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def throttled(self):
+        if self.config.throttle_rate is None:
+            return False
+
+        with self.bucket["lock"]:
+            now = time.monotonic()
+            self.bucket["tokens"] = min(self.config.throttle_rate, self.bucket["tokens"] + (now - self.bucket["last"]) * self.config.throttle_rate)
+            self.bucket["last"] = now
+            if self.bucket["tokens"] < 1:
+                return True
+            self.bucket["tokens"] -= 1
+            return False
+
+    def forward(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.config.latency)
+
+        if self.random.random() < self.config.error_rate:
+            return self.respond(502)
+        if self.throttled():
+            return self.respond(429, {"Retry-After": "1"})
+
+        url = urlparse(self.path)
+        connection = http.client.HTTPConnection(url.hostname, url.port, timeout=30)
+        try:
+            headers = {name: value for name, value in self.headers.items() if name.lower() not in ("proxy-connection", "connection")}
+            connection.request(self.command, url.path + ("?" + url.query if url.query else ""), body or None, headers)
+            response = connection.getresponse()
+            content = response.read()
+        finally:
+            connection.close()
+
+        self.send_response(response.status)
+        for name, value in response.getheaders():
+            if name.lower() not in ("connection", "transfer-encoding", "content-length"):
+                self.send_header(name, value)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(content)
+
+    do_GET = do_POST = do_HEAD = forward
+
+
+class MockProxy:
+    """
+    Serves a forward proxy on a local port, on a background thread. Use .url as a proxy URL.
+
+    :param config: ProxyConfig with the latency, error rate and throttle rate of the proxy.
+    """
+
+    def __init__(self, config=ProxyConfig(), seed=0):
+        bucket = {"lock": threading.Lock(), "tokens": config.throttle_rate or 0, "last": time.monotonic()}
+        handler = type("ProxyHandler", (ProxyHandler,), {"config": config, "random": random.Random(seed), "bucket": bucket})
+        self.server = MockServer(("127.0.0.1", 0), handler)
+        self.url = "http://127.0.0.1:%d" % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class MockSite:
+    """
+    Serves a stand-in site on a local port, on a background thread.
+
+    :param site: "mevzuat", "uyusmazlik" or "commonx".
+    :param config: SiteConfig with the latency, error rate, document size and document count.
+    """
+
+    def __init__(self, site, config=SiteConfig(), seed=0):
+        handler = type(HANDLERS[site].__name__, (HANDLERS[site],), {"config": config, "random": random.Random(seed)})
+        self.server = MockServer(("127.0.0.1", 0), handler)
+        self.url = "http://127.0.0.1:%d/" % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
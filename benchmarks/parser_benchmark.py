@@ -0,0 +1,68 @@
+import os
+import sys
+import time
+from bs4 import BeautifulSoup
+from scrapers.html_parser import get_parser, lxml, SelectolaxTree
+from scrapers.uyusmazlik_scraper import UyusmazlikScaper
+
+SEARCH_URL = "Arama/_Grid?ExcludeGerekce=False&OrderCol=KararSayisi&OrderAsc=False&WordsOnly=False&page="
+
+
+def save_pages(page_dir, page_count):
+    """Downloads the first page_count Uyusmazlik grid pages into page_dir."""
+    import requests
+
+    os.makedirs(page_dir, exist_ok=True)
+    for page in range(1, page_count + 1):
+        response = requests.get("https://kararlar.uyusmazlik.gov.tr/" + SEARCH_URL + str(page), verify=False)
+        with open(os.path.join(page_dir, "grid-" + str(page) + ".html"), "wb") as f:
+            f.write(response.content)
+
+
+def load_pages(page_dir):
+    pages = []
+    for file_name in sorted(os.listdir(page_dir)):
+        if file_name.endswith(".html"):
+            with open(os.path.join(page_dir, file_name), "rb") as f:
+                pages.append(f.read())
+    return pages
+
+
+def run(pages, repeat):
+    # parse_page does not use the scraper state, and creating a scraper would request the site.
+    scraper = UyusmazlikScaper.__new__(UyusmazlikScaper)
+
+    def parse_all(parse):
+        return [scraper.parse_page(parse(page)) for page in pages]
+
+    candidates = [("html.parser, full tree (before)", lambda page: BeautifulSoup(page, 'html.parser'))]
+    for name in ["html.parser"] + (["lxml"] if lxml is not None else []) + (["selectolax"] if SelectolaxTree is not None else []):
+        parser = get_parser(name)
+        candidates.append((name + ", grid cells only", lambda page, parser=parser: parser.soup(page, UyusmazlikScaper.GRID_CELLS)))
+
+    expected = parse_all(candidates[0][1])
+    baseline = None
+
+    print(str(len(pages)) + " pages, " + str(sum(len(docs) for docs in expected)) + " docs, best of " + str(repeat))
+    for name, parse in candidates:
+        if parse_all(parse) != expected:
+            print(name + ": parse_page output differs!")
+            continue
+
+        best = float("inf")
+        for i in range(repeat):
+            start = time.perf_counter()
+            parse_all(parse)
+            best = min(best, time.perf_counter() - start)
+
+        baseline = baseline or best
+        print("%-36s %8.1f pages/s  %5.1fx" % (name, len(pages) / best, baseline / best))
+
+
+if __name__ == "__main__":
+    # Usage: python -m benchmarks.parser_benchmark <page_dir> [repeat]
+    #        python -m benchmarks.parser_benchmark --save <page_dir> <page_count>
+    if sys.argv[1] == "--save":
+        save_pages(sys.argv[2], int(sys.argv[3]))
+    else:
+        run(load_pages(sys.argv[1]), int(sys.argv[2]) if len(sys.argv) > 2 else 5)
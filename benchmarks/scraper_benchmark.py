@@ -0,0 +1,268 @@
+import argparse
+import logging
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from functools import partial
+from benchmarks.mock_sites import MockSite, SiteConfig
+from benchmarks.parser_benchmark import SEARCH_URL
+from scrapers.logs import LOGGER_NAME
+from scrapers.metrics import METRICS
+from scrapers.parse_pool import ParsePool
+from scrapers.rate_limiter import RateLimiter
+from scrapers.session_pool import SessionPool
+from scrapers.writer import WriteBehind
+
+# Scenario name: (mock site, scraper)
+SCENARIOS = {
+    "mevzuat": ("mevzuat", "scrapers.abstract_scaper.AbstractScraper (MevzuatScraper)"),
+    "uyusmazlik": ("uyusmazlik", "scrapers.abstract_scaper.AbstractScraper (UyusmazlikScaper)"),
+    "async": ("uyusmazlik", "scrapers.abstract_async_scraper.AbstractAsyncScraper"),
+    "async-stream": ("uyusmazlik", "scrapers.abstract_async_scraper.AbstractAsyncScraper (streaming=True)"),
+    "commonx": ("commonx", "scraper.CommonXScraper"),
+}
+RESULTS_FILE = os.path.join(os.path.dirname(__file__), "results.jsonl")
+
+
+class LatencyRecordingPool(SessionPool):
+    """A SessionPool that records the latency (time until the response headers arrived) of every response."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies = []
+
+    def session(self, url):
+        session = super().session(url)
+        if self.record not in session.hooks["response"]:
+            session.hooks["response"].append(self.record)
+        return session
+
+    def record(self, response, *args, **kwargs):
+        self.latencies.append(response.elapsed.total_seconds())
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def directory_size(path):
+    size = 0
+    for directory, _, file_names in os.walk(path):
+        for file_name in file_names:
+            size += os.path.getsize(os.path.join(directory, file_name))
+    return size
+
+
+def parse_async_grid_page(html_parser, base_url, content):
+    """Page parser of the async Uyusmazlik stand-in: the grid docs, with absolute hrefs."""
+    from scrapers.uyusmazlik_scraper import parse_grid_page
+
+    docs = parse_grid_page(html_parser, content)
+    for doc in docs:
+        doc["href"] = base_url + doc["href"]
+    return docs
+
+
+def make_async_scraper(url, output_dir, session_pool, concurrency, streaming=False, **kwargs):
+    """Returns an AbstractAsyncScraper for the Uyusmazlik stand-in. grequests is imported here since it monkey patches with gevent."""
+    import grequests
+    from scrapers.abstract_async_scraper import AbstractAsyncScraper
+    from scrapers.uyusmazlik_scraper import UyusmazlikScaper
+
+    class UyusmazlikAsyncScraper(AbstractAsyncScraper):
+        CONCURRENCY = concurrency
+        PAGE_FILTER = UyusmazlikScaper.GRID_CELLS
+        LISTS_NEWEST_FIRST = UyusmazlikScaper.LISTS_NEWEST_FIRST
+
+        def get_max_page_count(self):
+            page = self.sessions.get(self.base_url)
+            return int(self.html_parser.select_attributes(page.content, UyusmazlikScaper.PAGE_INPUT, "data-max")[0])
+
+        def get_all_pages(self):
+            urls = [self.base_url + SEARCH_URL + str(page) for page in range(1, self.get_max_page_count() + 1)]
+            return [grequests.get(url, session=self.sessions.session(url)) for url in urls]
+
+        def parse_page(self, page):
+            docs = UyusmazlikScaper.parse_page(self, page)
+            for doc in docs:
+                doc["href"] = self.base_url + doc["href"]
+            return docs
+
+        def page_parser(self):
+            return partial(parse_async_grid_page, self.html_parser, self.base_url)
+
+        def doc_name(self, doc):
+            return UyusmazlikScaper.parse_doc_name(self, doc)
+
+    return UyusmazlikAsyncScraper(url, 1, output_dir, session_pool=session_pool, streaming=streaming, **kwargs)
+
+
+def count_docs(scenario, scraper, output_dir):
+    if scenario.startswith("async"):
+        return len(os.listdir(os.path.join(output_dir, "json")))
+    if scenario == "commonx":
+        count = 0
+        for file_name in os.listdir(output_dir):
+            if file_name.endswith(".txt"):
+                with open(os.path.join(output_dir, file_name), encoding="utf-8") as f:
+                    count += len(json.load(f))
+        return count
+    return len(scraper.manifest)
+
+
+def run_scenario(scenario, url, output_dir, concurrency, rate, parse_workers=0, fsync_interval=None):
+    """Runs one scraper against the stand-in site at url and returns its measurements. Runs in its own process."""
+    parse_pool = ParsePool(parse_workers) if parse_workers else None
+    writer = WriteBehind(fsync_interval=fsync_interval) if fsync_interval is not None else None
+    rate_limiter = RateLimiter(rate=rate, max_rate=max(rate, 50.0), concurrency=concurrency, max_concurrency=concurrency)
+    pool = LatencyRecordingPool(pool_size=concurrency, rate_limiter=rate_limiter)
+    start = time.perf_counter()
+
+    # Scrapers log a line per page, which would only measure the terminal.
+    logging.getLogger(LOGGER_NAME).addHandler(logging.NullHandler())
+    logging.getLogger(LOGGER_NAME).propagate = False
+
+    if scenario == "mevzuat":
+        from scrapers.mevzuat_scraper import MevzuatScraper
+        scraper = MevzuatScraper(output_dir, base_url=url, concurrency=concurrency, session_pool=pool, parse_pool=parse_pool, writer=writer)
+    elif scenario == "uyusmazlik":
+        from scrapers.uyusmazlik_scraper import UyusmazlikScaper
+        scraper = UyusmazlikScaper(output_dir, base_url=url, concurrency=concurrency, session_pool=pool, parse_pool=parse_pool, writer=writer)
+    elif scenario.startswith("async"):
+        scraper = make_async_scraper(url, output_dir, pool, concurrency, streaming=scenario == "async-stream", parse_pool=parse_pool, writer=writer)
+    else:
+        from scraper import CommonXScraper
+        scraper = CommonXScraper(url + "aramalist", output_dir, session_pool=pool, concurrency=concurrency, writer=writer)
+
+    scraper.scrape()
+    if parse_pool is not None:
+        parse_pool.close()
+    if writer is not None:
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    docs = count_docs(scenario, scraper, output_dir)
+
+    stage_seconds = {}
+    for timer in METRICS.snapshot()["timers"]:
+        if timer["name"] == "stage_seconds":
+            stage = timer["labels"]["stage"]
+            stage_seconds[stage] = round(stage_seconds.get(stage, 0) + timer["total_seconds"], 3)
+
+    return {
+        "docs": docs,
+        "seconds": round(elapsed, 3),
+        "docs_per_second": round(docs / elapsed, 1),
+        "requests": len(pool.latencies),
+        "p50_ms": round(percentile(pool.latencies, 50) * 1000, 1),
+        "p99_ms": round(percentile(pool.latencies, 99) * 1000, 1),
+        # ru_maxrss is in kilobytes on Linux.
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "bytes_written": directory_size(output_dir),
+        # Time spent in each stage, summed over threads, so it can exceed the wall time.
+        "stage_seconds": stage_seconds,
+    }
+
+
+def run_in_subprocess(scenario, config, concurrency, rate, parse_workers=0, fsync_interval=None):
+    """Serves the stand-in site in this process and runs the scraper in a child process, so that the peak RSS is the scraper's own."""
+    site, _ = SCENARIOS[scenario]
+    output_dir = tempfile.mkdtemp(prefix="benchmark-" + scenario + "-")
+
+    try:
+        with MockSite(site, config) as mock:
+            child = subprocess.run(
+                [sys.executable, "-m", "benchmarks.scraper_benchmark", "--child", scenario, mock.url, output_dir, "--concurrency", str(concurrency), "--rate", str(rate),
+                 "--parse-workers", str(parse_workers)] + (["--fsync-interval", str(fsync_interval)] if fsync_interval is not None else []),
+                capture_output=True, text=True,
+            )
+        if child.returncode != 0:
+            return {"error": child.stderr.strip().splitlines()[-1] if child.stderr.strip() else "exit code " + str(child.returncode)}
+        return json.loads(child.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def load_previous_results(path):
+    """Returns the last result of every (scenario, settings) pair in the results file."""
+    previous = {}
+    if not os.path.exists(path):
+        return previous
+
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            result = json.loads(line)
+            previous[(result["scenario"], json.dumps(result["settings"], sort_keys=True))] = result
+    return previous
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(__file__)).stdout.strip()
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the scrapers against local stand-ins of the target sites.")
+    parser.add_argument("scenarios", nargs="*", default=list(SCENARIOS), help="Any of " + ", ".join(SCENARIOS) + ". All by default.")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds every response is delayed by.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of document requests that fail.")
+    parser.add_argument("--doc-size", type=int, default=20000, help="Size of every document in bytes.")
+    parser.add_argument("--docs", type=int, default=500, help="Number of documents each site lists.")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=1000.0,
+                        help="Initial requests per second of the host rate limiter. The default is high enough to measure the scrapers rather than the limiter.")
+    parser.add_argument("--parse-workers", type=int, default=0,
+                        help="Parse listing pages in this many worker processes (ParsePool). CommonX does not parse listing pages. 0 parses them on a thread.")
+    parser.add_argument("--fsync-interval", type=float, default=None,
+                        help="Save through a WriteBehind writer that fsyncs every this many seconds (0: whenever its queue runs empty). By default, files are saved on the crawl threads without fsync.")
+    parser.add_argument("--results", default=RESULTS_FILE, help="JSON lines file the results are appended to and compared with.")
+    parser.add_argument("--child", nargs=3, metavar=("SCENARIO", "URL", "OUTPUT_DIR"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_scenario(*args.child, concurrency=args.concurrency, rate=args.rate, parse_workers=args.parse_workers, fsync_interval=args.fsync_interval)))
+        return
+
+    config = SiteConfig(args.latency, args.error_rate, args.doc_size, args.docs)
+    settings = dict(config._asdict(), concurrency=args.concurrency, rate=args.rate)
+    if args.parse_workers:
+        # Only set when used, so that earlier results stay comparable.
+        settings["parse_workers"] = args.parse_workers
+    if args.fsync_interval is not None:
+        settings["fsync_interval"] = args.fsync_interval
+    previous = load_previous_results(args.results)
+    revision = git_revision()
+
+    print("Settings: " + json.dumps(settings))
+    print("%-11s %6s %8s %9s %8s %8s %8s %10s %12s" % ("scenario", "docs", "seconds", "docs/s", "p50 ms", "p99 ms", "RSS MB", "written", "vs. last run"))
+
+    for scenario in args.scenarios:
+        result = run_in_subprocess(scenario, config, args.concurrency, args.rate, args.parse_workers, args.fsync_interval)
+        if "error" in result:
+            print("%-11s failed: %s" % (scenario, result["error"]))
+            continue
+
+        last = previous.get((scenario, json.dumps(settings, sort_keys=True)))
+        change = "%+.1f%%" % ((result["docs_per_second"] / last["docs_per_second"] - 1) * 100) if last else "-"
+        print("%-11s %6d %8.2f %9.1f %8.1f %8.1f %8.1f %10d %12s" % (
+            scenario, result["docs"], result["seconds"], result["docs_per_second"], result["p50_ms"], result["p99_ms"],
+            result["peak_rss_mb"], result["bytes_written"], change))
+
+        with open(args.results, "a", encoding="utf-8") as f:
+            f.write(json.dumps(dict(result, scenario=scenario, settings=settings, revision=revision, time=datetime.now().isoformat())) + "\n")
+
+
+if __name__ == "__main__":
+    # Usage: python -m benchmarks.scraper_benchmark [scenario ...] [--latency 0.02] [--error-rate 0.01] [--doc-size 20000] [--docs 500] [--rate 5] [--parse-workers 4] [--fsync-interval 1]
+    main()
@@ -1,28 +1,34 @@
 from scraper import KararAramaDanistayScraper, KararAramaYargitayScraper, EmsalTuyapScraper
 from scrapers.mevzuat_scraper import MevzuatScraper
 from scrapers.uyusmazlik_scraper import UyusmazlikScaper
-from threading import Thread
-from util import partition
+from master_fetcher import Master
+from scrapers.catalog import Catalog
+from scrapers.writer import WriteBehind
 
 if __name__ == '__main__':
-	# num_thread_for_each = 10
+	# Several workers (threads here, or processes / machines sharing the file) claim small page ranges
+	# from the queue, and idle workers take over the ranges of slow or crashed ones.
+	# from scrapers.work_queue import PageRangeQueue
+	#
+	# num_workers_for_each = 10
+	# page_ranges = PageRangeQueue("output/page-ranges.sqlite")
+	#
+	# master = Master(max_concurrency=32)
+	# master.add_fetcher([
+	# 	*[KararAramaDanistayScraper(work_queue=page_ranges) for i in range(num_workers_for_each)],
+	# 	*[KararAramaYargitayScraper(work_queue=page_ranges) for i in range(num_workers_for_each)],
+	# ])
+	# master.run()
 	
-	# # Get ranges for each thread to scrape
-	# yargitay_range = partition(44203, 58937, num_thread_for_each)
-	# danistay_range = partition(913, 1217, num_thread_for_each)
-	# emsal_tuyap_range = partition(2518, 3357, num_thread_for_each)
-	
-	# scrapers = [
-	# 	*[KararAramaDanistayScraper(r) for r in danistay_range], 
-	# 	*[KararAramaYargitayScraper(r) for r in yargitay_range], 
-	# 	#*[EmsalTuyapScraper(r) for emsal_tuyap_range in emsal_tuyap_range]
-	# ]
+	master = Master(max_concurrency=32, metrics_dir="output", metrics_port=9101)
 
-	# threads = [Thread(target=scraper.scrape) for scraper in scrapers]
+	catalog = Catalog("output/catalog.sqlite")
+	# One thread writes the files of all scrapers, and fsyncs them together every second.
+	writer = WriteBehind(fsync_interval=1.0)
+	master.add_fetcher(MevzuatScraper("output/mevzuat", log_file="output/mevzuat.log", resume=True, catalog=catalog, writer=writer), priority=1)
+	# Uyusmazlik lists the newest decisions first, so a daily run stops after 100 decisions in a row that are already saved.
+	master.add_fetcher(UyusmazlikScaper("output/uyusmazlik", resume=True, catalog=catalog, stop_after_known=100, writer=writer))
+	master.add_fetcher([KararAramaYargitayScraper(writer=writer), KararAramaDanistayScraper(writer=writer)])
 
-	# for thread in threads:
-	# 	thread.start()
-	
-	scraper = MevzuatScraper("output/mevzuat", log_file="output/mevzuat.log")
-	#scraper = UyusmazlikScaper("output/uyusmazlik")
-	scraper.scrape()
\ No newline at end of file
+	master.run()
+	writer.close()
\ No newline at end of file
@@ -1,36 +1,143 @@
-from scapers.abstract_scaper import AbstractScraper
+import signal
+import threading
+from scrapers.abstract_scaper import AbstractScraper
+from scrapers.budget import ConcurrencyBudget
+from scrapers.logs import get_logger, flush_logs
+from scrapers.metrics import METRICS, MetricsExporter
+from scrapers.proxy_pool import ProxyPool
+from scrapers.rate_limiter import RateLimiter
+from scrapers.session_pool import SessionPool
+import scraper
 
-class Master(): 
-    """ Master class to start and control fetching of URLs. 
-        Supports IP rotating if a list of IP proxies is given
-        :param ip_proxies: List of proxy IPs for IP rotating
-        :param fetcherrs: List of Fetcher objects
+FETCHER_TYPES = (AbstractScraper, scraper.AbstractScraper)
+
+class Master():
+    """ Master class to start and control fetching of URLs.
+        Runs all fetchers at the same time, each in its own thread. Their requests share
+        * a global budget of max_concurrency requests in flight, handed out by priority and fairly across hosts,
+        * one rate limiter per host, so fetchers scraping the same site do not overload it together.
+        Supports IP rotating if a list of IP proxies is given: requests are spread over the healthy proxies of a ProxyPool
+        (scrapers/proxy_pool.py), failing or throttled proxies are quarantined for a while, and each proxy gets its own
+        rate limit per host. Proxies can also be added while running, with add_proxy. See proxy_stats for their throughput.
+        While running, the metrics of all fetchers are exported to metrics_dir/metrics.json and metrics_dir/metrics.prom,
+        and served at http://127.0.0.1:metrics_port/metrics, if these are given.
+        :param ip_proxies: List of proxy URLs for IP rotating, e.g. "http://10.0.0.1:3128"
+        :param fetchers: List of Fetcher objects
+        :param max_concurrency: Maximum number of requests in flight across all fetchers
+        :param metrics_dir: Directory to export the metrics to, every metrics_interval seconds
+        :param metrics_port: Port to serve the metrics in the Prometheus text format on
     """
-    def __init__(self, ip_proxies=None, fetchers=None, *args, **kwargs):
+    def __init__(self, ip_proxies=None, fetchers=None, max_concurrency=32, metrics_dir=None, metrics_port=None, metrics_interval=10, *args, **kwargs):
 
         self.ip_proxies = ip_proxies or []
-        self.fetchers = fetchers or []
+        self.proxy_pool = ProxyPool(self.ip_proxies)
+        self.fetchers = []
+        self.threads = []
+        self.errors = {}
+        self.budget = ConcurrencyBudget(max_concurrency)
+        self.rate_limiter = RateLimiter(max_concurrency=max_concurrency)
+        self.logger = get_logger("Master")
+        self.exporter = None
+        if metrics_dir is not None or metrics_port is not None:
+            self.exporter = MetricsExporter(METRICS, metrics_dir, metrics_port, metrics_interval)
+        METRICS.set_gauge("budget_in_use", lambda: self.budget.in_use)
+        METRICS.set_gauge("budget_waiting", lambda: len(self.budget.waiting))
+
+        if fetchers:
+            self.add_fetcher(fetchers)
 
-    def add_fetcher(self, fetchers, *args, **kwargs):
+    def add_fetcher(self, fetchers, priority=0, *args, **kwargs):
         """
             Adding new fetchers to master fetcher
             :param fetcher: An object or a list of objects to add to the fetchers list
+            :param priority: Priority of the fetchers' requests for the global budget. Higher goes first.
         """
         if (type(fetchers) == list):
             for fetcher in fetchers:
-                if not isinstance(fetcher, AbstractScraper):
-                    raise ValueError("Added fetchers should be of type AbstractFetcher.")
-                else:
-                    self.fetchers.append(fetcher)
-        elif isinstance(fetchers, AbstractScraper):
-            self.fetchers.append(fetcher)
+                if not isinstance(fetcher, FETCHER_TYPES):
+                    raise ValueError("Added fetchers should be of type AbstractScraper.")
+            for fetcher in fetchers:
+                self._add_fetcher(fetcher, priority)
+        elif isinstance(fetchers, FETCHER_TYPES):
+            self._add_fetcher(fetchers, priority)
         else:
             raise ValueError("Unrecognized value type for fetchers")
-    
+
+    def _add_fetcher(self, fetcher, priority):
+        # From now on, the fetcher's requests go through the shared budget and rate limiter.
+        fetcher.sessions = SessionPool(pool_size=fetcher.sessions.pool_size, rate_limiter=self.rate_limiter, budget=self.budget, priority=priority,
+                                       cache=fetcher.sessions.cache, proxy_pool=self.proxy_pool)
+        self.fetchers.append(fetcher)
+
     def add_proxy(self, proxies, *args, **kwargs):
         """
             Adding new proxy IPs for IP rotating
-            :param proxies: Single 
+            :param proxies: Single proxy URL or a list of them
+        """
+        if type(proxies) == list:
+            self.ip_proxies.extend(proxies)
+        else:
+            self.ip_proxies.append(proxies)
+        self.proxy_pool.add(proxies)
+
+    def proxy_stats(self):
+        """Returns the requests, success rate, latency, throughput and quarantine state of every proxy."""
+        return self.proxy_pool.stats()
+
+    def start(self):
+        """Starts every fetcher that is not running yet in its own thread."""
+        running = len(self.threads)
+
+        for fetcher in self.fetchers[running:]:
+            thread = threading.Thread(target=self._run_fetcher, args=(fetcher,), name=fetcher.__class__.__name__)
+            thread.start()
+            self.threads.append(thread)
+
+    def _run_fetcher(self, fetcher):
+        try:
+            fetcher.scrape()
+        except Exception as e:
+            # One failing fetcher should not stop the others.
+            self.errors[fetcher] = e
+            self.logger.error(fetcher.__class__.__name__ + ' failed: ' + repr(e), fetcher=fetcher.__class__.__name__, exc_info=e)
+
+    def shutdown(self, timeout=None):
         """
+            Stops all fetchers gracefully: they stop fetching new pages, finish what is already in flight,
+            save their checkpoints and return.
+            :param timeout: Seconds to wait for them to drain. None waits until they are done.
+        """
+        for fetcher in self.fetchers:
+            fetcher.stop()
+        self.join(timeout)
+
+    def join(self, timeout=None):
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def run(self):
+        """Runs all fetchers until they are done. SIGINT and SIGTERM shut them down gracefully."""
+        def on_signal(signum, frame):
+            self.logger.info('Shutting down, waiting for fetchers to drain...')
+            for fetcher in self.fetchers:
+                fetcher.stop()
+
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGINT, on_signal)
+            signal.signal(signal.SIGTERM, on_signal)
+
+        if self.exporter is not None:
+            self.exporter.start()
+        self.start()
+
+        # Joining with a timeout keeps the main thread responsive to signals.
+        while any(thread.is_alive() for thread in self.threads):
+            for thread in self.threads:
+                thread.join(1)
 
-    
+        if self.exporter is not None:
+            self.exporter.stop()
+        self.logger.info('Done. Budget: ' + str(self.budget.stats()))
+        if self.ip_proxies:
+            self.logger.info('Proxies: ' + str(self.proxy_stats()))
+        flush_logs()
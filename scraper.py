@@ -1,31 +1,58 @@
 from abc import ABC, abstractmethod
-from time import sleep
 import requests, os, json
 import urllib.parse
-
-ERROR_WAIT_TIME = 10
+import threading
+import math
+from concurrent.futures import ThreadPoolExecutor
+from scrapers.session_pool import SessionPool
+from scrapers.pipeline import unordered_map
+from scrapers.download import write_atomically
+from scrapers.manifest import Manifest, content_hash
+from scrapers.work_queue import default_worker_id
+from scrapers.logs import get_logger, flush_logs
+from scrapers.metrics import METRICS
+
+MAX_RETRIES = 5
+# Seconds before a range with pages that failed MAX_RETRIES times is claimed again.
+SKIPPED_RANGE_DELAY = 60
+DEFAULT_CONCURRENCY = 8
 
 class AbstractScraper(ABC):
+	# Pages are fetched by `concurrency` worker threads, with at most `concurrency` pages in flight. Each page is written to
+	# page_path/page-N-<url>.txt as soon as it arrives, so pages complete out of order. send_request and save_page therefore
+	# take the page number as an argument and must be thread-safe.
+	# With writer=WriteBehind(...) (scrapers/writer.py), pages are written on the writer thread instead, and recorded in the
+	# manifest once they are on disk. scrape_pages flushes the writer before it returns, so a completed range is saved.
 
-	def __init__(self, url, page_size, page_path, headers={}, page_range=None):
+	def __init__(self, url, page_size, page_path, headers={}, page_range=None, session_pool=None, work_queue=None, concurrency=None, writer=None):
 		self.url = url
+		self.logger = get_logger(self.__class__.__name__)
+		self.metrics = METRICS.scope(scraper=self.__class__.__name__, host=urllib.parse.urlparse(url).netloc)
+		self.work_queue = work_queue
+		self.concurrency = concurrency or DEFAULT_CONCURRENCY
+		self.sessions = session_pool or SessionPool(pool_size=self.concurrency)
 		self.page_size = page_size
 		self.page_path = page_path
+		self.writer = writer
 		self.current_page = 1
 
 		self.headers = headers
+		self.stopped = threading.Event()
 
 		self._encoded_url = urllib.parse.quote(self.url, safe='')
 
 		if not os.path.exists(self.page_path):
 			os.makedirs(self.page_path)
 
+		self.manifest = Manifest.open(self.page_path, ".txt")
+
 		if page_range != None:
 			self.current_page = page_range[0]
 			self.page_count = page_range[1]
 
 	@abstractmethod
-	def send_request(self):
+	def send_request(self, page):
+		# Returns the data of the page, or None if the request failed.
 		pass
 
 	@abstractmethod
@@ -33,58 +60,144 @@ class AbstractScraper(ABC):
 		pass
 
 	def print_message(self, message):
-		print('[' + self.__class__.__name__  + '] ' + message)
+		self.logger.info(message)
+
+	def page_name(self, page_index):
+		return "page-" + str(page_index) + "-" + self._encoded_url
 
 	def does_page_exist(self, page_index):
-		return os.path.exists(self.page_path + "/page-" + str(page_index) + "-"+self._encoded_url + ".txt")
+		return self.page_name(page_index) in self.manifest
 
-	def on_error(self):
-		self.print_message("error at page: " + str(self.current_page))
+	def on_error(self, page):
+		# The rate limiter of the host waits before each retry, backing off longer after each failure.
+		self.logger.warning("error at page: " + str(page), page=page)
 
-		res = self.send_request()
+		for attempt in range(1, MAX_RETRIES + 1):
+			self.sessions.report_failure(self.url)
+			self.logger.info("Retrying... (" + str(attempt) + "/" + str(MAX_RETRIES) + ")", page=page, attempt=attempt)
+			self.metrics.inc("retries_total")
 
-		while res == None:
-			self.print_message("Retrying... Wait "+str(ERROR_WAIT_TIME)+" seconds")
-			sleep(ERROR_WAIT_TIME)
+			res = self.send_request(page)
 
-			res = self.send_request()
+			if res != None: return res
 
-		return res
+		self.logger.error("giving up page: " + str(page), page=page)
+		self.metrics.inc("errors_total")
+		return None
 
-	def save_page(self, data):
-		self.print_message("at page: " + str(self.current_page))
+	def stop(self):
+		# scrape returns after the pages that are being fetched are saved.
+		self.stopped.set()
 
-		page_file = open( self.page_path + "/page-" + str(self.current_page) +
-						"-"+self._encoded_url + ".txt", "w")
+	def save_page(self, data, page):
+		self.logger.info("at page: " + str(page), page=page)
 
-		json_data = json.dumps(data, ensure_ascii=False)
-		page_file.write(json_data)
-		
-		page_file.close()
+		with self.metrics.timer("stage_seconds", stage="encode"):
+			encoded_data = json.dumps(data, ensure_ascii=False).encode()
 
-	def scrape(self):
-		
-		if not hasattr(self, 'page_count'): self.page_count = self.get_page_count()
+		with self.metrics.timer("stage_seconds", stage="save"):
+			page_name = self.page_name(page)
+			path = self.page_path + "/" + page_name + ".txt"
+			saved = lambda: self.manifest.put(page_name, content_hash(encoded_data), len(encoded_data), self.url)
 
-		self.print_message("total page count: " + str(self.page_count))
+			# The page is renamed into place when complete, so a crash never leaves a partial page behind.
+			if self.writer != None:
+				self.writer.write(path, lambda f: f.write(encoded_data), mode="wb", on_commit=saved)
+			else:
+				write_atomically(path, lambda f: f.write(encoded_data), mode="wb")
+				saved()
 
-		while self.current_page < self.page_count:
-			if self.does_page_exist(self.current_page):
-				self.current_page += 1
-				self.print_message("page " + str(self.current_page) + " already exists.")
-				continue
+		self.metrics.inc("pages_total")
+		self.metrics.inc("bytes_saved_total", len(encoded_data))
+
+	def fetch_page(self, page):
+		# Runs on the worker threads. Returns whether the page was saved.
+		with self.metrics.timer("stage_seconds", stage="list_fetch"):
+			res = self.send_request(page)
 
-			res = self.send_request()
+		if res == None: res = self.on_error(page)
 
-			if res == None: res = self.on_error()
-			
-			self.save_page(res)
+		if res == None: return False
 
+		self.save_page(res, page)
+		return True
+
+	def pages_to_fetch(self):
+		# current_page is the first page that was not handed out yet.
+		while self.current_page < self.page_count and not self.stopped.is_set():
+			page = self.current_page
 			self.current_page += 1
 
+			if self.does_page_exist(page):
+				self.print_message("page " + str(page) + " already exists.")
+				continue
+
+			yield page
+
+	def scrape(self):
+		
+		if self.work_queue != None:
+			self.scrape_queue()
+		else:
+			if not hasattr(self, 'page_count'): self.page_count = self.get_page_count()
+
+			self.print_message("total page count: " + str(self.page_count))
+
+			self.scrape_pages()
+
+		self.print_message("connections: " + str(self.sessions.connection_stats()))
+		flush_logs()
+
+	def scrape_pages(self, on_page=None):
+		# Scrapes pages from current_page up to (excluding) page_count, `concurrency` pages at a time.
+		# on_page is called after each page; returning False stops handing out pages. The pages in flight are still saved.
+		# Returns whether every page of the range was handed out. Pages that failed MAX_RETRIES times are skipped,
+		# and collected in skipped_pages.
+		pages = self.pages_to_fetch()
+		cancelled = False
+		self.skipped_pages = []
+
+		with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+			for page, saved in unordered_map(executor, self.fetch_page, pages, self.concurrency):
+				if not saved: self.skipped_pages.append(page)
+				if not cancelled and on_page != None and not on_page():
+					cancelled = True
+					pages.close()
+
+		if self.writer != None: self.writer.flush()
+
+		return not cancelled and self.current_page >= self.page_count
+
+	def scrape_queue(self):
+		# Claims page ranges from the shared work queue until none is left. Workers that finish early take over
+		# pending ranges and ranges whose lease expired, instead of sitting idle.
+		# A range with skipped pages is not completed: it is released, and claimed again after SKIPPED_RANGE_DELAY seconds
+		# (by this run, or a later one), when only its missing pages are fetched.
+		worker = default_worker_id()
+		self.work_queue.add_ranges(self.url, 1, self.get_page_count())
+
+		while not self.stopped.is_set():
+			lease = self.work_queue.claim(self.url, worker)
+			if lease == None: break
+
+			self.print_message("claimed pages " + str(lease.start) + "-" + str(lease.end - 1))
+			self.current_page = lease.start
+			self.page_count = lease.end
+
+			if self.scrape_pages(on_page=lambda: self.work_queue.renew(lease, worker)):
+				if len(self.skipped_pages) > 0:
+					self.print_message("pages " + str(sorted(self.skipped_pages)) + " failed, pages " + str(lease.start) + "-" + str(lease.end - 1) + " will be retried")
+					self.work_queue.release(lease, worker, delay=SKIPPED_RANGE_DELAY)
+				else:
+					self.work_queue.complete(lease, worker)
+			elif self.stopped.is_set():
+				self.work_queue.release(lease, worker)
+			else:
+				self.print_message("lease of pages " + str(lease.start) + "-" + str(lease.end - 1) + " was taken over")
+
 class CommonXScraper(AbstractScraper):
 	
-	def __init__(self, url, page_path, page_range=None):
+	def __init__(self, url, page_path, page_range=None, session_pool=None, work_queue=None, concurrency=None, writer=None):
 		super().__init__(url, 100, page_path, headers = {
 			"accept": "application/json, text/javascript, */*; q=0.01",
 			"accept-language": "en-US,en;q=0.9,pt;q=0.8,tr;q=0.7,it;q=0.6",
@@ -98,42 +211,58 @@ class CommonXScraper(AbstractScraper):
 			"sec-fetch-mode": "cors",
 			"sec-fetch-site": "same-origin",
 			"x-requested-with": "XMLHttpRequest"
-		}, page_range=page_range)
+		}, page_range=page_range, session_pool=session_pool, work_queue=work_queue, concurrency=concurrency, writer=writer)
 
-	def send_request(self):
-		body = {"data":{"aranan":"***","arananKelime":"***","pageSize": self.page_size, "pageNumber": self.current_page}}
+	def post_page(self, page):
+		# Returns the JSON response of the page, or None if the request failed or the response is not JSON.
+		body = {"data":{"aranan":"***","arananKelime":"***","pageSize": self.page_size, "pageNumber": page}}
 
-		res = requests.post(self.url, headers=self.headers, data=json.dumps(body))
-		
-		dct = json.loads(res.content)
+		try:
+			res = self.sessions.post(self.url, headers=self.headers, data=json.dumps(body))
+		except requests.RequestException as e:
+			self.logger.warning("request failed: " + repr(e), page=page)
+			return None
+
+		if res.status_code != 200: return None
+
+		try:
+			return json.loads(res.content)
+		except ValueError:
+			return None
+
+	def send_request(self, page):
+		dct = self.post_page(page)
 		
 		if (dct == None) or (dct["data"] == None) or (dct["data"]["data"] == None): return None
         
 		return dct["data"]["data"]
 
 	def get_page_count(self):
-		body = {"data":{"aranan":"***","arananKelime":"***","pageSize": self.page_size, "pageNumber": 1}}
+		json_data = self.post_page(1)
 
-		res = requests.post(self.url, headers=self.headers, data=json.dumps(body))
-		json_data = json.loads(res.content)
+		attempts = 1
+		while json_data == None or json_data["data"] == None or json_data["data"]["recordsFiltered"] == None:
+			if attempts == MAX_RETRIES: raise RuntimeError("could not get the page count of " + self.url)
 
-		while json_data["data"] == None or json_data["data"]["recordsFiltered"] == None:
-			res = requests.post(self.url, headers=self.headers, data=json.dumps(body))
-			json_data = json.loads(res.content)
+			# The rate limiter waits before the next request, backing off longer after each failure.
+			self.sessions.report_failure(self.url)
+			json_data = self.post_page(1)
+			attempts += 1
 
-		return json_data["data"]["recordsFiltered"]
+		# Pages are numbered from 1, and page_count is the exclusive end of the page range.
+		return math.ceil(json_data["data"]["recordsFiltered"] / self.page_size) + 1
 
 class EmsalTuyapScraper(CommonXScraper):
 	
-	def __init__(self, page_range=None):
-		super().__init__('https://emsal.uyap.gov.tr/aramalist', 'emsal-tuyap-pages', page_range=page_range)
+	def __init__(self, page_range=None, **kwargs):
+		super().__init__('https://emsal.uyap.gov.tr/aramalist', 'emsal-tuyap-pages', page_range=page_range, **kwargs)
 
 class KararAramaYargitayScraper(CommonXScraper):
 
-	def __init__(self, page_range=None):
-		super().__init__('https://karararama.yargitay.gov.tr/aramalist', 'karararama-yargitay-pages', page_range=page_range)
+	def __init__(self, page_range=None, **kwargs):
+		super().__init__('https://karararama.yargitay.gov.tr/aramalist', 'karararama-yargitay-pages', page_range=page_range, **kwargs)
 
 class KararAramaDanistayScraper(CommonXScraper):
 
-	def __init__(self, page_range=None):
-		super().__init__('https://karararama.danistay.gov.tr/aramalist', 'karararama-danistay-pages', page_range=page_range)
\ No newline at end of file
+	def __init__(self, page_range=None, **kwargs):
+		super().__init__('https://karararama.danistay.gov.tr/aramalist', 'karararama-danistay-pages', page_range=page_range, **kwargs)
\ No newline at end of file
@@ -1,11 +1,54 @@
 from abc import ABC, abstractmethod
-from time import sleep
 import grequests
+import gevent
+from gevent.event import Event
 import requests, os, json
 import urllib.parse
-import random
+from itertools import islice
 from pathlib import Path
-from bs4 import BeautifulSoup
+from scrapers.catalog import source_name
+from scrapers.download import write_atomically
+from scrapers.dead_letter import DeadLetterQueue, DeadLetterRetrier
+from scrapers.html_parser import get_parser
+from scrapers.logs import get_logger, flush_logs
+from scrapers.metrics import METRICS
+from scrapers.session_pool import SessionPool
+
+
+def imap_unordered(requests, size, exception_handler=None):
+    """
+    Like grequests.imap: sends the GRequests requests `size` at a time and yields the responses as they arrive.
+    Unlike it, at most `size` finished requests are buffered ahead of the consumer, and the requests are pulled lazily,
+    so memory stays bounded however many requests there are.
+
+    :param exception_handler: Called with the request and the exception when a request fails. Its result is yielded unless it is None.
+    """
+    pool = grequests.Pool(size)
+
+    try:
+        for request in pool.imap_unordered(lambda request: request.send(), requests, maxsize=size):
+            if request.response is not None:
+                yield request.response
+            elif exception_handler is not None:
+                result = exception_handler(request, request.exception)
+                if result is not None:
+                    yield result
+
+        pool.join()
+    finally:
+        # The consumer stopped early: the requests still in flight are not needed.
+        pool.kill()
+
+
+def wait_cooperatively(future):
+    """Returns the result of a concurrent.futures future. It is waited for on the thread pool of the gevent hub, so other greenlets run meanwhile."""
+    return gevent.get_hub().threadpool.apply(future.result)
+
+
+def requested_url(response):
+    """Returns the URL that was requested, before any redirects."""
+    return response.history[0].url if response.history else response.url
+
 
 class AbstractAsyncScraper(ABC):
     """
@@ -14,6 +57,7 @@ class AbstractAsyncScraper(ABC):
     get_max_page_count: Returns the maximum number of pages to scrape. It is usually specified same place in the website html.
     get_all_pages: Returns a list of page requests.
                    The list consits of GRequests request objects.
+                   Pass session=self.sessions.session(url) to them so that connections are reused.
     doc_name: Expects a dictionary including "href" as a key.
               Returns the name of the file that will be used to save the document.
     parse_page: Expects a BeatifulSoup object.
@@ -21,19 +65,68 @@ class AbstractAsyncScraper(ABC):
                 Each dict in the list stores metadata about the document.
                 Each dict must have  "href" as a key.
                 The returned list is used to create GRequests request objects in get_all_urls method.
+    PAGE_FILTER: An ElementFilter (scrapers/html_parser.py) of the elements parse_page needs.
+                 If set, only those elements are parsed, which is much faster on large pages.
+
+    With streaming=True, scrape does not collect every doc and response first. Listing pages and documents are requested
+    CONCURRENCY at a time, each document is saved as soon as it arrives, and its entry in self.dict is evicted once it is saved.
+    Memory then stays flat however large the crawl is. get_all_pages may return a generator in that mode.
+
+    With catalog=Catalog(...) (scrapers/catalog.py), the metadata of every saved JSON document is also upserted into the catalog.
+
+    Documents that fail (error responses, connection errors) go to a dead-letter queue (scrapers/dead_letter.py) at
+    output_dir/.dead_letters.sqlite and are retried in a greenlet next to the crawl, with exponential backoff, up to MAX_RETRIES times.
+    scrape waits for the pending retries at the end and writes a summary of the failed documents to output_dir/.dead_letters.json.
+
+    With stop_after_known=N (frontier mode), documents that are already saved are not requested, and the crawl stops once
+    N of them come in a row. The listing must be sorted newest first (LISTS_NEWEST_FIRST). Listing pages are then requested
+    CONCURRENCY at a time and handled in page order, also in streaming mode, so that the older pages are never requested.
+
+    Listing pages are parsed on the gevent hub, between the requests. With parse_pool=ParsePool(workers) (scrapers/parse_pool.py)
+    and a page_parser, they are parsed in worker processes instead, so that parsing scales with the cores and never holds up the requests.
+
+    Files are written atomically (to a temporary file that is renamed into place). With writer=WriteBehind(...) (scrapers/writer.py),
+    they are written on a background thread with group-committed fsyncs instead of on the gevent hub, and scrape flushes the writer
+    before it returns.
     """
     #Constants
-    INITIAL_ERROR_WAIT_TIME = 15
+    MAX_RETRIES = 10
+    CONCURRENCY = 10
+    PAGE_FILTER = None
+    DEAD_LETTER_REPORT_FILE_NAME = ".dead_letters.json"
+    RETRY_BASE_DELAY = 5.0
+    RETRY_MAX_DELAY = 600.0
+    LISTS_NEWEST_FIRST = False
+
 
+    def __init__(self, base_url, starting_page_count, output_dir, headers={}, session_pool=None, html_parser=None, streaming=False, catalog=None, stop_after_known=None, parse_pool=None, writer=None):
+        if stop_after_known is not None and not self.LISTS_NEWEST_FIRST:
+            raise ValueError(self.__class__.__name__ + " does not list docs newest first, so it cannot stop at the first known docs")
 
-    def __init__(self, base_url, starting_page_count, output_dir, headers={}):
         self.base_url = base_url
+        self.logger = get_logger(self.__class__.__name__)
+        self.metrics = METRICS.scope(scraper=self.__class__.__name__)
+        self.html_parser = get_parser(html_parser)
         self.current_page_count = starting_page_count
         self.consec_up_to_date_docs = 0
+        self.stop_after_known = stop_after_known
         self.output_dir = output_dir
         self.headers = headers
         self.urls_list = []
         self.dict = {}
+        self.streaming = streaming
+        self.catalog = catalog
+        self.parse_pool = parse_pool
+        self.writer = writer
+        self.sessions = session_pool or SessionPool(pool_size=self.CONCURRENCY)
+        self.html_dir = os.path.join(output_dir, "html")
+        self.json_dir = os.path.join(output_dir, "json")
+        # Created once here rather than on every save.
+        Path(self.html_dir).mkdir(parents=True, exist_ok=True)
+        Path(self.json_dir).mkdir(parents=True, exist_ok=True)
+        self.dead_letters = DeadLetterQueue(os.path.join(output_dir, DeadLetterQueue.FILE_NAME), self.MAX_RETRIES + 1,
+                                            self.RETRY_BASE_DELAY, self.RETRY_MAX_DELAY)
+        self.dead_letters.clear()
 
     @abstractmethod
     def get_max_page_count(self):
@@ -83,32 +176,58 @@ class AbstractAsyncScraper(ABC):
         """
         self.dict[doc["href"]] = doc
 
-    def on_error(self, url):
+    def on_error(self, url, error):
         """
-        This method is called when an error occurs. It waits for a while and then tries again.
+        This method is called when a document request fails. The document is evicted from self.dict and put into the
+        dead-letter queue, which retries it in the background.
         :param url: URL string that caused the error
+        :param error: Why the request failed, e.g. "HTTP 503". It is shown in the dead-letter report.
         """
-        self.print_message("error at page: " + str(self.current_page_count))
-        sleep_time = self.INITIAL_ERROR_WAIT_TIME + random.random()*5
-        self.print_message("Retrying... Wait "+str(sleep_time)+" seconds")
-        sleep(sleep_time)
+        self.logger.warning("Couldn't download: " + url + " (" + error + ")", url=url, error=error)
+        self.metrics.inc("errors_total", host=urllib.parse.urlparse(url).netloc)
+        self.metrics.inc("docs_total", result="failed")
+        doc = self.dict.pop(url, None)
+        if doc is not None:
+            self.dead_letters.add(url, doc, error)
+
+    def retry_doc(self, url, doc):
+        """Requests a dead-lettered document again and saves it if it arrives. Returns None if it was saved, or why it failed."""
+        self.metrics.inc("retries_total", host=urllib.parse.urlparse(url).netloc)
+        response = self.sessions.get(url, verify=False)
+        if response.status_code != 200:
+            response.close()
+            return "HTTP " + str(response.status_code)
 
-        consecutive_errors = 1
+        doc["html"] = response.text
+        self.save_html(doc)
+        self.save_json(doc)
+        self.metrics.inc("docs_total", result="saved")
+        return None
 
+    def retry_dead_letters(self, crawl_done):
+        """
+        Runs in a greenlet next to the crawl and retries the due dead letters. Returns once crawl_done is set and no letter is pending.
+        The rate limiter of the host decides how long to wait between the requests.
+        """
+        retrier = DeadLetterRetrier(self.dead_letters, self.retry_doc, metrics=self.metrics, logger=self.logger)
         while True:
-            result = requests.get(self.base_url + url, verify=False)
-            if result.status_code == 200:
-                return result.text
-            else:
-                consecutive_errors += 1
-                if consecutive_errors == 10:
-                    break
-                sleep_time = (self.INITIAL_ERROR_WAIT_TIME*consecutive_errors) + random.random()*5
-                self.print_message("Retrying... Wait "+str(sleep_time)+" seconds")
-                sleep(sleep_time)
-        log_file_name = url.replace("/", "_") + "_error_log.txt"
-        with open(os.path.join(self.output_dir, log_file_name), "w") as f:
-            f.write("Error at page: " + url)
+            retrier.retry_due()
+            next_due_in = self.dead_letters.next_due_in()
+            if next_due_in is None and crawl_done.is_set():
+                return
+            crawl_done.wait(retrier.interval if next_due_in is None else min(retrier.interval, next_due_in))
+
+    def start_retrying(self):
+        """Starts the dead-letter greenlet. Returns the event to set when the crawl is done, and the greenlet to join."""
+        crawl_done = Event()
+        return crawl_done, gevent.spawn(self.retry_dead_letters, crawl_done)
+
+    def finish_retrying(self, crawl_done, greenlet):
+        """Waits for the pending dead letters to be retried and writes the dead-letter report."""
+        crawl_done.set()
+        greenlet.get()
+        report = self.dead_letters.write_report(os.path.join(self.output_dir, self.DEAD_LETTER_REPORT_FILE_NAME))
+        self.logger.info("Dead letters: " + str(report["counts"]), **report["counts"])
 
     def save_html(self, doc):
         """
@@ -118,10 +237,10 @@ class AbstractAsyncScraper(ABC):
         :param doc dictionary with metadata about the document. "html" is a must-to-have key in the dictionary.
         """
         doc_name = self.doc_name(doc)
-        html_folder_dir = self.output_dir + "/html"
-        Path(html_folder_dir).mkdir(parents=True, exist_ok=True)
-        with open(os.path.join(html_folder_dir, doc_name) + ".html", "w") as f:
-            f.write(doc["html"])
+        html = doc["html"]
+        with self.metrics.timer("stage_seconds", stage="save"):
+            self.write_file(os.path.join(self.html_dir, doc_name) + ".html", lambda f: f.write(html))
+        self.metrics.inc("bytes_saved_total", len(html))
 
     def save_json(self, doc):
         """
@@ -131,27 +250,45 @@ class AbstractAsyncScraper(ABC):
         :param doc dictionary with metadata about the document.
         """
         doc_name = self.doc_name(doc)
-        json_folder_dir = self.output_dir + "/json"
-        Path(json_folder_dir).mkdir(parents=True, exist_ok=True)
-        with open(os.path.join(json_folder_dir, doc_name) + ".json", "w") as f:
-            json.dump(doc, f)
+        data = json.dumps(doc)
+
+        def saved():
+            if self.catalog is not None:
+                self.catalog.put(source_name(self.output_dir), doc_name, doc, doc.get("href"))
+
+        self.write_file(os.path.join(self.json_dir, doc_name) + ".json", lambda f: f.write(data), saved)
+
+    def write_file(self, path, write, on_saved=None):
+        """Writes the file atomically, with the writer if there is one. on_saved is called once the file is in place."""
+        if self.writer is not None:
+            self.writer.write(path, write, on_commit=on_saved)
+            return
+
+        write_atomically(path, write)
+        if on_saved is not None:
+            on_saved()
+
+    def flush_writes(self):
+        """Waits until the files written so far are committed to disk, if they are written by a writer."""
+        if self.writer is not None:
+            self.writer.flush()
 
     def json_file_exists(self, doc):
         """
-        Checks if the file with the JSON extension for the given doc exists in the output directory.
+        Checks if the file with the JSON extension for the given doc exists in the json folder under the output directory.
         """
         doc_name = self.doc_name(doc)
-        return os.path.exists(os.path.join(self.output_dir, doc_name) + ".json")
+        return os.path.exists(os.path.join(self.json_dir, doc_name) + ".json")
 
     def html_file_exists(self, doc):
         """
-        Checks if the file with the HTML extension for the given doc exists in the output directory.
+        Checks if the file with the HTML extension for the given doc exists in the html folder under the output directory.
         """
         doc_name = self.doc_name(doc)
-        return os.path.exists(os.path.join(self.output_dir, doc_name) + ".html")
+        return os.path.exists(os.path.join(self.html_dir, doc_name) + ".html")
 
     def print_message(self, message):
-        print('[' + self.__class__.__name__  + '] ' + message)
+        self.logger.info(message)
 
 
     def get_all_urls(self):
@@ -160,32 +297,170 @@ class AbstractAsyncScraper(ABC):
         Stores them in self.urls_list.
         To carry the information of the page, the important information is stored in self.dict.
         """
-        page_requests = self.get_all_pages()
-        page_responses = grequests.map(page_requests, size=10)
-        for page_response in page_responses:
-            soup = BeautifulSoup(page_response.content, 'html.parser')
-            docs = self.parse_page(soup)
-            for doc in docs:
-                self.add_url(doc["href"])
-                self.add_to_dict(doc)
+        for doc in self.until_frontier(self.iter_page_docs(self.get_all_pages())):
+            self.add_url(doc["href"])
+            self.add_to_dict(doc)
+
+    def iter_page_docs(self, page_requests):
+        """
+        Yields the docs of the listing pages in page order. In frontier mode, pages are requested CONCURRENCY at a time,
+        so that no more pages are requested once the crawl stops.
+        """
+        page_requests = iter(page_requests)
+        batch_size = self.CONCURRENCY if self.stop_after_known is not None else None
+
+        while True:
+            batch = list(islice(page_requests, batch_size))
+            if not batch:
+                return
+            with self.metrics.timer("stage_seconds", stage="list_fetch"):
+                page_responses = grequests.map(batch, size=self.CONCURRENCY, exception_handler=self.on_request_exception)
+            # grequests.map returns None for the requests that failed.
+            yield from self.parse_page_responses(page_response for page_response in page_responses if page_response is not None)
+
+    def page_parser(self):
+        """
+        Returns the function that parses a page in the worker processes of parse_pool, or None to parse pages with parse_page.
+        It takes the raw body of a listing page and returns its docs. It must be picklable: a module level function, or a functools.partial of one.
+        """
+        return None
+
+    def parse_page_responses(self, page_responses):
+        """
+        Yields the docs of the listing page responses. With a parse_pool and a page_parser, several pages are parsed at once
+        in the worker processes, and the hub goes on with the requests meanwhile. Otherwise, parse_page runs on the hub.
+        """
+        parser = self.page_parser() if self.parse_pool is not None else None
+        if parser is None:
+            for page_response in page_responses:
+                with self.metrics.timer("stage_seconds", stage="parse"):
+                    soup = self.html_parser.soup(page_response.content, self.PAGE_FILTER)
+                    docs = self.parse_page(soup)
+                self.metrics.inc("pages_total")
+                yield from docs
+            return
+
+        pages = ((page_response.url, page_response.content) for page_response in page_responses)
+        for _, docs in self.parse_pool.map(parser, pages, self.metrics, wait_cooperatively):
+            self.metrics.inc("pages_total")
+            yield from docs
+
+    def until_frontier(self, docs):
+        """
+        Yields the docs, except for the ones that are already saved in frontier mode.
+        Stops once stop_after_known docs in a row are already saved: the rest of the listing is older.
+        """
+        for doc in docs:
+            if self.stop_after_known is None:
+                yield doc
+            elif self.json_file_exists(doc):
+                self.metrics.inc("docs_total", result="known")
+                self.consec_up_to_date_docs += 1
+                if self.check_if_up_to_date():
+                    self.logger.info("Stopping: " + str(self.consec_up_to_date_docs) + " docs in a row are already saved", known_docs=self.consec_up_to_date_docs)
+                    return
+            else:
+                self.consec_up_to_date_docs = 0
+                yield doc
 
     def scrape(self):
         """
         Scrapes all documents from the base url by iterating through URL requests.
         """
+        if self.streaming:
+            return self.scrape_streaming()
+
+        crawl_done, retrier = self.start_retrying()
         self.get_all_urls()
         request_list = []
         for url in self.urls_list:
-            request = grequests.get(url)
+            request = grequests.get(url, session=self.sessions.session(url))
             request_list.append(request)
-        response_list = grequests.map(request_list, size=10)
-        for response in response_list:
-            url = response.url
+        with self.metrics.timer("stage_seconds", stage="doc_fetch"):
+            response_list = grequests.map(request_list, size=self.CONCURRENCY, exception_handler=self.on_request_exception)
+        for url, response in zip(self.urls_list, response_list):
+            if response is None or url not in self.dict:
+                continue
+            if response.status_code != 200:
+                response.close()
+                self.on_error(url, "HTTP " + str(response.status_code))
+                continue
+
             doc = self.dict[url]
             doc["html"] = response.text
-            self.save_html(self.dict[url])
-            self.save_json(self.dict[url])
+            self.save_html(doc)
+            self.save_json(doc)
+            self.metrics.inc("docs_total", result="saved")
+
+        self.finish_retrying(crawl_done, retrier)
+        self.flush_writes()
+        flush_logs()
+
+    def iter_docs(self):
+        """Yields the docs of the listing pages, page by page as the pages arrive. At most CONCURRENCY pages are requested or buffered at a time.
+        In frontier mode, the pages are handled in page order instead."""
+        if self.stop_after_known is not None:
+            yield from self.iter_page_docs(self.get_all_pages())
+            return
+
+        yield from self.parse_page_responses(self.observe_list_fetch(imap_unordered(self.get_all_pages(), self.CONCURRENCY, self.on_request_exception)))
+
+    def observe_list_fetch(self, page_responses):
+        """Yields the page responses, and counts their response times as list_fetch time."""
+        for page_response in page_responses:
+            self.metrics.observe("stage_seconds", page_response.elapsed.total_seconds(), stage="list_fetch")
+            yield page_response
+
+    def iter_doc_requests(self):
+        docs = self.iter_docs()
+        try:
+            for doc in self.until_frontier(docs):
+                self.add_to_dict(doc)
+                yield grequests.get(doc["href"], session=self.sessions.session(doc["href"]))
+        finally:
+            # Stops requesting listing pages at the frontier.
+            docs.close()
+
+    def on_request_exception(self, request, exception):
+        if request.url in self.dict:
+            # Failed docs are evicted and dead-lettered.
+            self.on_error(request.url, repr(exception))
+            return
+        self.logger.warning("Request failed: " + request.url + " " + repr(exception), url=request.url)
+        self.metrics.inc("errors_total", host=urllib.parse.urlparse(request.url).netloc)
+
+    def scrape_streaming(self):
+        """
+        Scrapes all documents like scrape, but saves each document as soon as its response arrives,
+        with at most CONCURRENCY documents in flight, and forgets it once it is saved.
+        """
+        crawl_done, retrier = self.start_retrying()
+        for response in imap_unordered(self.iter_doc_requests(), self.CONCURRENCY, self.on_request_exception):
+            url = requested_url(response)
+            self.metrics.observe("stage_seconds", response.elapsed.total_seconds(), stage="doc_fetch", host=urllib.parse.urlparse(response.url).netloc)
+
+            if url not in self.dict:
+                response.close()
+                continue
+
+            if response.status_code != 200:
+                response.close()
+                self.on_error(url, "HTTP " + str(response.status_code))
+                continue
+
+            doc = self.dict.pop(url)
+
+            doc["html"] = response.text
+            response.close()
+            self.save_html(doc)
+            self.save_json(doc)
+            self.metrics.inc("docs_total", result="saved")
+
+        self.finish_retrying(crawl_done, retrier)
+        self.flush_writes()
+        flush_logs()
 
 
     def check_if_up_to_date(self):
-        return self.consec_up_to_date_docs >= float("inf") #Since we are scraping from scratch, we can set this to infinity. Later, it should be set to a smaller number.
+        """In frontier mode, checks whether enough docs in a row were already saved to stop the crawl."""
+        return self.stop_after_known is not None and self.consec_up_to_date_docs >= self.stop_after_known
@@ -1,10 +1,33 @@
 from abc import ABC, abstractmethod
-from time import sleep
 import requests, os, json
+import queue
+import threading
 import urllib.parse
-import random
 from datetime import datetime
-from base64 import b64encode
+from base64 import b64decode
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from scrapers.pipeline import ordered_map, prefetch
+from scrapers.session_pool import SessionPool
+from scrapers.manifest import content_hash
+from scrapers.storage import JsonFileStorage
+from scrapers.download import Download
+from scrapers.checkpoint import Checkpoint
+from scrapers.html_parser import get_parser
+from scrapers.logs import get_logger, flush_logs
+from scrapers.metrics import METRICS
+from scrapers.catalog import source_name
+from scrapers.dedup import SeenSet, IN_FLIGHT_DOWNLOADS, IN_FLIGHT, SEEN
+from scrapers.dead_letter import DeadLetterQueue, DeadLetterRetrier, PENDING
+
+# Returned by request_doc when the document did not change since it was last saved.
+NOT_MODIFIED = object()
+# Used instead of the content of docs that were saved before a resumed crawl was interrupted.
+ALREADY_SAVED = object()
+# Used instead of the content of docs whose href was already fetched by this crawl, or is being fetched by another scraper.
+DUPLICATE = object()
+# Used instead of the content of docs that are already saved, in frontier mode. Their bodies are not requested.
+KNOWN = object()
 
 class AbstractScraper(ABC):
     """Abstract class for scraping documents from a website. The child class must implement the following methods:
@@ -18,22 +41,131 @@ class AbstractScraper(ABC):
     -page is the html of a page, returned by the pagination method of the website. For parsing, we use the BeautifulSoup library.
     -doc is a python dictionary with metadata about the document. The 'href' is a must-to-have key.
     -doc_name is the name of the file that will be saved. Due to variation in naming convention (e.g karar sayisi, esas sayisi, etc.), this method is not implemented in the abstract class. The child class must implement this method.
-    -content is the text of the document. Don't worry about the different structures and encodings (like .docs and .pdfs). We will handle them in the preprocessing step.
+    -content is the text of the document. Don't worry about the different structures and encodings (like .docs and .pdfs). We will handle them in the preprocessing step:
+     with postprocessor=PostProcessor(output_dir) (scrapers/postprocess.py), the text of new and changed documents is extracted
+     in worker processes while crawling, and written next to them as doc_name.txt.
+    -With catalog=Catalog("output/catalog.sqlite") (scrapers/catalog.py), the metadata of every saved document is upserted into a
+     corpus-wide SQLite catalog with a full-text index, under the name of the output directory. Share one catalog between scrapers.
     -The child class can override the request_doc method if the default approach does not work.
+    -Documents are downloaded concurrently by `concurrency` worker threads, so request_doc must be thread-safe.
+     Checking and saving still happen one by one, in the order get_next_doc yields the docs.
+    -All HTTP requests should go through self.sessions, which keeps connections to each host alive between requests
+     and rate limits them per host (see scrapers/rate_limiter.py).
+    -Scraping runs as a pipeline of stages connected by bounded queues: listing pages are fetched up to `prefetch_pages` pages ahead
+     on one thread, parsed into docs on another, downloaded by the worker pool and saved on the calling thread.
+     get_next_page is therefore iterated on a background thread.
+    -Saved documents are indexed in a manifest (scrapers/manifest.py) in the output directory. Existence and change checks
+     only look at the manifest, so files should not be added to or removed from the output directory by hand.
+    -In incremental mode, documents are requested with the validators (ETag, Last-Modified) of their last download.
+     request_doc returns NOT_MODIFIED instead of the content if the server reports that the document did not change.
+     Servers that ignore conditional requests are detected, and validators are then checked with a HEAD request first.
+    -Document bodies are streamed into temporary files (scrapers/download.py) while their hash is computed, so a document
+     is never held in memory as a whole. request_doc returns such a Download; overrides returning bytes still work.
+    -Documents are written by a storage backend (scrapers/storage.py). By default, each one is a JSON file in the format of README.md.
+     Pass storage=BlobStorage(output_dir) to store raw, deduplicated content blobs with an append-only metadata index instead.
+    -With writer=WriteBehind(...) (scrapers/writer.py), the JSON files are written on a background thread with group-committed
+     fsyncs, so that the calling thread does not wait for the disk. Docs are recorded in the manifest (and catalog) once their
+     file is committed, and the writer is flushed before every checkpoint. Share one writer between scrapers.
+    -The crawl state is checkpointed to output_dir/.checkpoint.json (see scrapers/checkpoint.py). With resume=True, an interrupted
+     crawl continues after the last page whose docs were all saved, retries the docs that failed, and skips docs that are
+     already saved without requesting them. Child classes whose pagination keeps more state than current_page_count
+     (e.g. request body offsets) should override get_cursor and seek_page.
+    -Messages go through self.logger (scrapers/logs.py): to stdout, and as buffered JSON lines to log_file if it is given.
+     Per-document messages are DEBUG level. Pass structured fields as keyword arguments, e.g. self.logger.info("...", page=page_number).
+    -Time per crawl stage (list_fetch, parse, doc_fetch, encode, save), bytes, docs, retries, errors and queue depths are counted
+     in self.metrics (scrapers/metrics.py), labeled with the scraper and, where it applies, the host. See MetricsExporter to export them.
+    -Listing pages should be parsed with self.html_parser (scrapers/html_parser.py), restricted to the elements parse_page needs.
+     It uses the fastest installed backend (selectolax, lxml, html.parser) and still returns BeautifulSoup objects.
+     Pass html_parser="bs4", "lxml", "html.parser" or "selectolax" to choose one.
+    -With parse_pool=ParsePool(workers) (scrapers/parse_pool.py), listing pages are parsed in worker processes instead of on the
+     parse thread, so that parsing scales with the cores and the download threads keep the GIL. This needs a page_parser.
+     get_next_page should then yield the raw response body, which is cheap to send to the workers, and leave parsing to them.
+    -Each href is fetched once per crawl (scrapers/dedup.py), even if it is listed on several pages because the pagination
+     shifted while crawling. Scrapers of the same output directory share downloads that are in flight, and the hrefs fetched
+     so far are kept in a Bloom filter at output_dir/.seen.bloom, confirmed with the manifest. Pass dedup=False to turn it off.
+     The filter is sized for max_page_count * DOCS_PER_PAGE hrefs, or for seen_capacity hrefs if it is given.
+    -A failed download does not hold up the crawl: the doc goes to a dead-letter queue (scrapers/dead_letter.py) at
+     output_dir/.dead_letters.sqlite and is retried on a background thread with exponential backoff, up to MAX_RETRIES times.
+     Recovered docs are saved like the others. scrape waits for the pending retries at the end, then writes a summary of the
+     docs that could not be downloaded to output_dir/.dead_letters.json.
+    -With stop_after_known=N (frontier mode), the crawl stops once N docs in a row are already saved, and is marked complete:
+     on a listing that is sorted newest first (LISTS_NEWEST_FIRST), everything after them was saved by an earlier crawl.
+     Saved docs are recognized by their name in the manifest and not requested, or, with incremental=True, requested
+     conditionally, so that changed ones are still updated. Either way, no body is downloaded for a doc that did not change.
     
     
     """
     #Constants
-    INITIAL_ERROR_WAIT_TIME = 15
+    MAX_RETRIES = 5
+    DEFAULT_CONCURRENCY = 8
+    DEFAULT_PREFETCH_PAGES = 2
+    DOWNLOAD_DIR_NAME = ".downloads"
+    CHECKPOINT_INTERVAL = 10
+    SEEN_SET_FILE_NAME = ".seen.bloom"
+    DEAD_LETTER_REPORT_FILE_NAME = ".dead_letters.json"
+    RETRY_BASE_DELAY = 5.0
+    RETRY_MAX_DELAY = 600.0
+    LISTS_NEWEST_FIRST = False
+    # Docs listed per page, to size the seen set.
+    DOCS_PER_PAGE = 100
+
+    def __init__(self, base_url, starting_page_count, output_dir, headers={}, log_file=None, concurrency=None, session_pool=None, prefetch_pages=None, incremental=False, storage=None, resume=False, html_parser=None, dedup=True, postprocessor=None, catalog=None, stop_after_known=None, parse_pool=None, writer=None, seen_capacity=None):
+        if stop_after_known is not None and not self.LISTS_NEWEST_FIRST:
+            raise ValueError(self.__class__.__name__ + " does not list docs newest first, so it cannot stop at the first known docs")
 
-    def __init__(self, base_url, starting_page_count, output_dir, headers={}, log_file=None):
         self.base_url = base_url
+        self.logger = get_logger(self.__class__.__name__, log_file)
+        self.metrics = METRICS.scope(scraper=self.__class__.__name__)
+        self.html_parser = get_parser(html_parser)
+        self.concurrency = concurrency or self.DEFAULT_CONCURRENCY
+        self.sessions = session_pool or SessionPool(pool_size=self.concurrency)
         self.max_page_count = int(self.get_max_page_count())
         self.current_page_count = starting_page_count
         self.consec_up_to_date_docs = 0
+        self.stop_after_known = stop_after_known
+        self.frontier_page = None
         self.output_dir = output_dir
+        self.storage = storage or JsonFileStorage(output_dir, writer)
+        self.writer = writer if writer is not None else getattr(self.storage, "writer", None)
+        self.storage.metrics = self.metrics
+        self.manifest = self.storage.open_manifest()
+        self.download_dir = os.path.join(output_dir, self.DOWNLOAD_DIR_NAME)
+        self.remove_partial_downloads()
         self.headers = headers
         self.log_file = log_file
+        self.prefetch_pages = prefetch_pages or self.DEFAULT_PREFETCH_PAGES
+        self.incremental = incremental
+        self.postprocessor = postprocessor
+        self.catalog = catalog
+        self.parse_pool = parse_pool
+        self.head_first = False
+        self.validators = {}
+        self.stopped = threading.Event()
+
+        checkpoint_path = os.path.join(output_dir, Checkpoint.FILE_NAME)
+        if resume:
+            self.checkpoint = Checkpoint.load(checkpoint_path, self.CHECKPOINT_INTERVAL, self.flush_writes)
+        else:
+            self.checkpoint = Checkpoint(checkpoint_path, self.CHECKPOINT_INTERVAL, self.flush_writes)
+        self.resuming = self.checkpoint.can_resume()
+        if self.resuming:
+            self.logger.info("Resuming after page " + str(self.checkpoint.committed_page) + ", retrying " + str(len(self.checkpoint.failed)) + " failed docs",
+                             page=self.checkpoint.committed_page, failed_docs=len(self.checkpoint.failed))
+            self.seek_page(self.checkpoint.cursor)
+
+        # A new crawl fetches every href again. A resumed one keeps the hrefs fetched before the interruption.
+        seen_capacity = seen_capacity or self.max_page_count * self.DOCS_PER_PAGE
+        self.seen = SeenSet(os.path.join(output_dir, self.SEEN_SET_FILE_NAME), seen_capacity) if dedup else None
+        if self.seen is not None and not self.resuming:
+            self.seen.clear(seen_capacity)
+
+        # Failed docs of a resumed crawl that are still pending are retried by the dead-letter retrier, not fetched again.
+        self.dead_letters = DeadLetterQueue(os.path.join(output_dir, DeadLetterQueue.FILE_NAME), self.MAX_RETRIES + 1,
+                                            self.RETRY_BASE_DELAY, self.RETRY_MAX_DELAY)
+        if not self.resuming:
+            self.dead_letters.clear()
+        self.fetch_errors = {}
+        self.recovered_docs = queue.Queue()
 
     @abstractmethod
     def get_max_page_count(self):
@@ -51,113 +183,453 @@ class AbstractScraper(ABC):
     def get_next_page(self):
         pass
 
-    def on_error(self, url):
-        """This method is called when an error occurs. It waits for a while and then tries again."""
-        self.print_message("error at page: " + str(self.current_page_count))
-        sleep_time = self.INITIAL_ERROR_WAIT_TIME + random.random()*5
-        self.print_message("Retrying... Wait "+str(sleep_time)+" seconds")
-        sleep(sleep_time)
-
-        consecutive_errors = 1
-
-        while True:
-            result = requests.get(self.base_url + url, verify=False)
-            if result.status_code == 200:
-                return result.content
-            else:
-                consecutive_errors += 1
-                sleep_time = (self.INITIAL_ERROR_WAIT_TIME*consecutive_errors) + random.random()*5
-                self.print_message("Retrying... Wait "+str(sleep_time)+" seconds")
-                sleep(sleep_time)
+    def on_error(self, url, error=None):
+        """This method is called when a document request fails. It returns None right away: scrape puts the doc into the
+        dead-letter queue, which retries it in the background, up to MAX_RETRIES times.
+        :param error: Why the request failed, e.g. "HTTP 503". It is shown in the dead-letter report."""
+        host = urllib.parse.urlparse(self.base_url + url).netloc
+        self.logger.warning("Couldn't download: " + url + (" (" + error + ")" if error else ""), url=url, error=error)
+        self.metrics.inc("errors_total", host=host)
+        if error is not None:
+            self.fetch_errors[url] = error
+        return None
     
-    def update_doc(self, doc):
+    def update_doc(self, doc, download=None):
         """
-        Currently, save_doc is not implemented!!!
-        It should not override the contents of the file, but rather, change the doc 
-        content, and the updatedAt field only.
+        Overrides the saved document with the new doc content. Only the updatedAt field changes,
+        createdAt is kept from the manifest.
         """
-        return self.save_doc(doc)
+        entry = self.manifest.get(self.parse_doc_name(doc))
+        created_at = entry["createdAt"] if entry is not None else None
 
-    def save_doc(self, doc):
-        """Saves the document to the output directory. The naming convention is specified by the child class."""
+        return self.save_doc(doc, download, created_at=created_at)
+
+    def save_doc(self, doc, download=None, created_at=None):
+        """Saves the document with the storage backend and records it in the manifest, along with the validators of its download,
+        once it is saved. The naming convention is specified by the child class.
+        :param download: Download with the document content. If not given, the content is decoded from the base64 string in doc["content"].
+        :param created_at: createdAt of the document, if it was saved before."""
         doc_name = self.parse_doc_name(doc)
+        now = datetime.now().isoformat()
+
+        if download is None:
+            download = Download.from_bytes(b64decode(doc.pop("content")), self.download_dir)
         
         wrapped_doc = {
-           "createdAt" : datetime.now().isoformat(),
-           "updatedAt" : datetime.now().isoformat(),
+           "createdAt" : created_at or now,
+           "updatedAt" : now,
            "href": doc["href"],
            "doc_name": doc_name,
            "doc": doc
         }
         
-        with open(os.path.join(self.output_dir, doc_name) + ".json", "w", encoding="utf-8") as f:
-            json.dump(wrapped_doc, f, ensure_ascii=False)
+        if self.postprocessor is not None:
+            self.postprocessor.submit(doc_name, download)
+
+        validators = self.validators.pop(doc["href"], None)
+
+        def saved():
+            # With a writer, this runs on the writer thread.
+            self.manifest.put(doc_name, download.content_hash, download.size, doc["href"], wrapped_doc["createdAt"], now)
+            if validators is not None:
+                self.manifest.put_validators(doc_name, **validators)
+            if self.catalog is not None:
+                self.catalog.put(source_name(self.output_dir), doc_name, doc, doc["href"], wrapped_doc["createdAt"], now)
+
+        with self.metrics.timer("stage_seconds", stage="save"):
+            self.storage.save(wrapped_doc, download, saved)
+        self.metrics.inc("bytes_saved_total", download.size)
+
+    def flush_writes(self):
+        """Waits until the docs saved so far are committed to disk, if they are written by a writer."""
+        if self.writer is not None:
+            self.writer.flush()
 
     def request_doc(self, url):
         """Sends a request to get the document. Note that this approach might not work for all websites. In this case, the child class should override this method."""
-        result = requests.get(self.base_url + url, verify=False)
+        result = self.send_doc_request(url, verify=False, stream=True)
 
-        if result.status_code == 200:
-            return result.content
+        if result is NOT_MODIFIED:
+            return NOT_MODIFIED
+        elif result.status_code == 200:
+            return self.download(result)
         else:
-            return self.on_error(url)
+            result.close()
+            return self.on_error(url, "HTTP " + str(result.status_code))
 
-    def check_if_doc_exists(self, doc):
-        """Since we parse_doc_name is an abstract method, we can exactly know how the file is named. This function checks if the file exists."""
-        doc_name = self.parse_doc_name(doc)
+    def download(self, response):
+        """Streams the body of a response sent with stream=True into a temporary file and returns it as a Download."""
+        download = Download.from_response(response, self.download_dir)
+        self.metrics.inc("bytes_downloaded_total", download.size, host=urllib.parse.urlparse(response.url).netloc)
+        return download
 
-        path = os.path.join(self.output_dir, doc_name) + ".json"
-        
-        return os.path.exists(path)
+    def remove_partial_downloads(self):
+        """Removes the temporary files of downloads that were interrupted by a crash."""
+        if not os.path.isdir(self.download_dir):
+            return
 
-    def check_if_up_to_date(self, doc):
-        doc_name = self.parse_doc_name(doc)
-        path = os.path.join(self.output_dir, doc_name) + ".json"
+        for file_name in os.listdir(self.download_dir):
+            os.remove(os.path.join(self.download_dir, file_name))
 
-        try:
-            with open(path) as f:
-                file_dict = json.loads(f.read())
-                old_doc = file_dict["doc"]
-
-                # Compare base64 string of doc content to check if there is a change in doc.
-                return old_doc["content"] == doc["content"]
-        except:
-            self.print_message('File structure is corrupted for the file `'+path+'`. Overriding with new content.')
+    def send_doc_request(self, url, **kwargs):
+        """
+        GETs the document and remembers its validators. In incremental mode, the validators of the last download are sent
+        along (or checked with a HEAD request first, if the server ignores them) and NOT_MODIFIED is returned if they still match.
+        Child classes overriding request_doc should send their requests through this method.
+        """
+        entry = self.manifest.get_by_href(url) if self.incremental else None
+        headers = {}
+
+        if entry is not None and self.head_first:
+            head = self.sessions.head(self.base_url + url, allow_redirects=True, **kwargs)
+            # With stream=True, the connection goes back to the pool only once the response is closed.
+            head.close()
+            if head.status_code == 200 and self.validators_match(entry, head.headers):
+                return NOT_MODIFIED
+        elif entry is not None:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        result = self.sessions.get(self.base_url + url, headers=headers, **kwargs)
+
+        if result.status_code == 304:
+            result.close()
+            return NOT_MODIFIED
+
+        if result.status_code == 200:
+            if headers and self.validators_match(entry, result.headers):
+                # The server sent the whole document although it did not change, so it ignores conditional requests.
+                self.head_first = True
+                result.close()
+                return NOT_MODIFIED
+
+            self.validators[url] = {
+                "etag": result.headers.get("ETag"),
+                "last_modified": result.headers.get("Last-Modified"),
+                "content_length": result.headers.get("Content-Length"),
+            }
+
+        return result
+
+    def validators_match(self, entry, response_headers):
+        """Checks whether the validators in the response headers are the same as the validators in the manifest entry."""
+        if entry["etag"] and response_headers.get("ETag"):
+            return entry["etag"] == response_headers.get("ETag")
+
+        if entry["last_modified"] and response_headers.get("Last-Modified"):
+            content_length = response_headers.get("Content-Length")
+            return (entry["last_modified"] == response_headers.get("Last-Modified")
+                    and (not entry["content_length"] or not content_length or entry["content_length"] == content_length))
+
+        return False
+
+    def check_if_doc_exists(self, doc):
+        """Since we parse_doc_name is an abstract method, we can exactly know how the file is named. This function checks if the doc is in the manifest."""
+        return self.parse_doc_name(doc) in self.manifest
+
+    def check_if_up_to_date(self, doc, content_hash=None):
+        """Compares the hash of the doc content with the hash in the manifest. The saved file is not read.
+        :param content_hash: Hash of the raw document content. It is computed from doc["content"] if not given."""
+        entry = self.manifest.get(self.parse_doc_name(doc))
+        if entry is None:
             return False
 
+        return entry["content_hash"] == (content_hash or self.hash_content(b64decode(doc["content"])))
+
+    def hash_content(self, content):
+        return content_hash(content)
+
     def print_message(self, *message):
-        print('[' + self.__class__.__name__  + '] ', *message)
+        self.logger.info(' '.join(str(part) for part in message))
 
     def log(self, *message):
-        if self.log_file is not None:
-            with open(self.log_file, 'a') as f:
-                # log with date time
-                f.write(datetime.now().isoformat()+ '[' + self.__class__.__name__  + '] ' + ' '.join(message) + '\n')                        
+        """Logs a problem. It goes to the log file as well, if there is one."""
+        self.logger.warning(' '.join(str(part) for part in message))
+
+    def get_numbered_pages(self):
+        """Yields (page number, page) pairs from get_next_page."""
+        for page in self.metrics.timed_iter(self.get_next_page(), "stage_seconds", stage="list_fetch"):
+            if self.stopped.is_set():
+                return
+            # get_next_page increments the counter only after the page is consumed.
+            yield self.current_page_count, page
+
+    def stop(self):
+        """Stops fetching new pages. scrape returns once the rest of the current page, and the docs that are already in flight, are processed.
+        The crawl is not marked complete, so it can be resumed later."""
+        self.stopped.set()
+
+    def page_parser(self):
+        """Returns the function that parses a page in the worker processes of parse_pool, or None to parse pages with parse_page.
+        It takes a page as get_next_page yields it, and must be picklable: a module level function, or a functools.partial of one."""
+        return None
+
+    def parse_pages(self, pages):
+        """Yields (page number, doc) pairs for the docs of the given (page number, page) pairs.
+        With a parse_pool and a page_parser, several pages are parsed at once in the worker processes."""
+        parser = self.page_parser() if self.parse_pool is not None else None
+        if parser is not None:
+            parsed_pages = self.parse_pool.map(parser, pages, self.metrics)
+        else:
+            parsed_pages = ((page_number, self.metrics.timed_iter(self.parse_page(page), "stage_seconds", total=True, stage="parse"))
+                            for page_number, page in pages)
+
+        for page_number, docs in parsed_pages:
+            # A page is handed off whole, even if the crawl is stopped in the middle of it, since scrape commits
+            # every page it has seen docs of to the checkpoint, and a resumed crawl starts after the committed page.
+            if self.stopped.is_set():
+                return
+            self.logger.info("Current page: " + str(page_number), page=page_number)
+            self.metrics.inc("pages_total")
+            for doc in docs:
+                yield page_number, doc
+
+    def get_numbered_docs(self):
+        """Yields (page number, doc) pairs. Pages are fetched and parsed ahead on background threads, up to `prefetch_pages` pages and `concurrency` docs at a time.
+        When resuming, the docs that failed before the interruption come first."""
+        pages = prefetch(self.get_numbered_pages(), self.prefetch_pages, self.metrics, "pages")
+        docs = prefetch(self.parse_pages(pages), self.concurrency, self.metrics, "docs")
+
+        if self.resuming:
+            failed_docs = [(self.checkpoint.committed_page, doc) for doc in self.checkpoint.failed.values()
+                           if self.dead_letters.status(doc["href"]) != PENDING]
+            docs = chain(failed_docs, docs)
+        return docs
 
     def get_next_doc(self):
         """"Yields the next document by iterating pages and documents. Here, doc is a python dictionary with metadata about the document. The 'href' is a must-to-have key."""
-        for page in self.get_next_page():
-            self.print_message("Current page: " + str(self.current_page_count))
-            for doc in self.parse_page(page):
-                yield doc
+        for _, doc in self.get_numbered_docs():
+            yield doc
+
+    def get_cursor(self, page):
+        """Returns what is needed to continue the crawl from the given page. It is stored in the checkpoint."""
+        return {"page": page}
+
+    def seek_page(self, cursor):
+        """Makes get_next_page continue from the cursor returned by get_cursor."""
+        self.current_page_count = cursor["page"]
+
+    def fetch_doc(self, numbered_doc):
+        """Runs on the download threads. Requests the doc unless it was already saved by the interrupted crawl that is resumed,
+        or its href was already fetched by this crawl."""
+        _, doc = numbered_doc
+        if self.resuming and self.check_if_doc_exists(doc):
+            return ALREADY_SAVED
+
+        if self.stop_after_known is not None and not self.incremental and self.check_if_doc_exists(doc):
+            return KNOWN
+
+        if self.seen is not None and not self.claim_doc(doc["href"]):
+            return DUPLICATE
+
+        self.checkpoint.start(doc["href"])
+        content = None
+        try:
+            with self.metrics.timer("stage_seconds", stage="doc_fetch", host=urllib.parse.urlparse(self.base_url + doc["href"]).netloc):
+                content = self.request_doc(doc["href"])
+            return content
+        except requests.RequestException as e:
+            # Connection errors and timeouts go to the dead-letter queue like error responses, instead of ending the crawl.
+            return self.on_error(doc["href"], repr(e))
+        finally:
+            if self.seen is not None:
+                if content is not None:
+                    self.seen.add(doc["href"])
+                IN_FLIGHT_DOWNLOADS.finish(self.dedup_key(doc["href"]), fetched=content is not None)
+
+    def dedup_key(self, href):
+        # Downloads are only shared by scrapers that save into the same directory, the others need their own copy.
+        return os.path.abspath(self.output_dir), self.base_url + href
+
+    def was_fetched(self, href):
+        """Checks whether the href was fetched by this crawl. The Bloom filter has false positives, so hits are confirmed in the manifest."""
+        return href in self.seen and self.manifest.get_by_href(href) is not None
+
+    def claim_doc(self, href):
+        """
+        Returns True if the href should be downloaded, or False if it was already fetched by this crawl.
+        If another download thread or scraper is fetching it right now, waits for that download first: if it fails, the href is claimed again.
+        """
+        waited = False
+        while True:
+            state, event = IN_FLIGHT_DOWNLOADS.claim(self.dedup_key(href), lambda key: self.was_fetched(href))
+            if state != IN_FLIGHT:
+                break
+            waited = True
+            event.wait()
+
+        if state == SEEN:
+            self.metrics.inc("duplicates_avoided_total", reason="in_flight" if waited else "seen")
+            return False
+        return True
+
+    def retry_doc(self, href, doc):
+        """Runs on the dead-letter retrier thread. Requests the doc again, and hands it over to scrape if it was downloaded.
+        Returns None if it was, or why it failed."""
+        self.metrics.inc("retries_total", host=urllib.parse.urlparse(self.base_url + href).netloc)
+        try:
+            content = self.request_doc(href)
+        except requests.RequestException as e:
+            content = self.on_error(href, repr(e))
+
+        if content is None:
+            return self.fetch_errors.pop(href, "download failed")
+
+        if self.seen is not None:
+            self.seen.add(href)
+        self.recovered_docs.put((doc, content))
+        return None
+
+    def process_recovered_docs(self, timeout=None):
+        """Processes the docs that the dead-letter retrier downloaded. Waits up to timeout seconds for the first one if there is none yet."""
+        while True:
+            try:
+                doc, content = self.recovered_docs.get(timeout=timeout) if timeout else self.recovered_docs.get_nowait()
+            except queue.Empty:
+                return
+            timeout = None
+
+            self.logger.info("Recovered: " + doc["href"], url=doc["href"])
+            self.process_doc(doc, content)
+            self.checkpoint.finish(doc["href"])
 
     def scrape(self):
-        """Scrapes all documents from the base url by iterating through docs. """
-        for doc in self.get_next_doc():
-            content = self.request_doc(doc["href"])
-            if content is None:
-                continue
-            
-            content_b64 = b64encode(content).decode('ascii')
-                
-            doc["content"] = content_b64
-
-            if not self.check_if_doc_exists(doc) :
-                self.save_doc(doc)
-                self.consec_up_to_date_docs = 0
-            else:
-                if self.check_if_up_to_date(doc):
-                    self.print_message("Doc exists: ", self.parse_doc_name(doc))
-                    self.consec_up_to_date_docs += 1
-                else:
-                    self.update_doc(doc)
+        """Scrapes all documents from the base url by iterating through docs. Up to `concurrency` docs are downloaded at once.
+        Docs are processed in page order, so a page is committed to the checkpoint when the first doc of a later page is processed.
+        Docs that fail are retried in the background, and saved as they are recovered."""
+        last_page = None
+        retrier = DeadLetterRetrier(self.dead_letters, self.retry_doc, metrics=self.metrics, logger=self.logger).start()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            downloads = ordered_map(executor, self.fetch_doc, self.get_numbered_docs(), self.concurrency)
+
+            try:
+                for (page_number, doc), content in downloads:
+                    if last_page is not None and page_number > last_page:
+                        self.checkpoint.commit_page(last_page, self.get_cursor(last_page + 1))
+                    last_page = page_number if last_page is None else max(last_page, page_number)
+
+                    try:
+                        self.process_doc(doc, content)
+                    finally:
+                        if self.seen is not None and content is not None and content is not DUPLICATE and content is not KNOWN:
+                            IN_FLIGHT_DOWNLOADS.release(self.dedup_key(doc["href"]))
+
+                    if self.frontier_page is None and self.frontier_reached():
+                        self.frontier_page = page_number
+                        self.logger.info("Stopping at page " + str(page_number) + ": " + str(self.consec_up_to_date_docs) + " docs in a row are already saved",
+                                         page=page_number, known_docs=self.consec_up_to_date_docs)
+                        self.stop()
+
+                    if content is None:
+                        self.checkpoint.fail(doc)
+                        self.dead_letters.add(doc["href"], self.checkpoint.failed[doc["href"]], self.fetch_errors.pop(doc["href"], "download failed"))
+                    else:
+                        self.checkpoint.finish(doc["href"])
+
+                    self.process_recovered_docs()
+
+                # The crawl is done, but the pending dead letters still have retries left.
+                while not self.interrupted() and self.dead_letters.next_due_in() is not None:
+                    self.process_recovered_docs(timeout=retrier.interval)
+            finally:
+                retrier.stop()
+                self.process_recovered_docs()
+                self.checkpoint.flush()
+                if self.seen is not None:
+                    self.seen.flush()
+
+        if last_page is not None:
+            self.checkpoint.commit_page(last_page, self.get_cursor(last_page + 1))
+
+        report = self.dead_letters.write_report(os.path.join(self.output_dir, self.DEAD_LETTER_REPORT_FILE_NAME))
+        self.logger.info("Dead letters: " + str(report["counts"]), **report["counts"])
+
+        if self.postprocessor is not None:
+            self.postprocessor.join()
+
+        if self.interrupted():
+            self.checkpoint.flush()
+        else:
+            self.checkpoint.mark_complete()
+
+        self.logger.info("Connections: " + str(self.sessions.connection_stats()))
+        self.logger.info("Rate limits: " + str(self.sessions.rate_limiter.stats()))
+        if self.seen is not None:
+            self.logger.info("Duplicate fetches avoided: " + str(self.duplicates_avoided()), hrefs_seen=len(self.seen))
+        flush_logs()
+
+    def frontier_reached(self):
+        """In frontier mode, checks whether enough docs in a row were already saved to stop the crawl."""
+        return self.stop_after_known is not None and self.consec_up_to_date_docs >= self.stop_after_known
+
+    def interrupted(self):
+        """Whether the crawl was stopped before the end of the listing, other than at the frontier of known docs."""
+        return self.stopped.is_set() and self.frontier_page is None
+
+    def duplicates_avoided(self):
+        """Returns the number of duplicate fetches avoided by the scrapers of this class, by reason."""
+        avoided = {}
+        for counter in self.metrics.metrics.snapshot()["counters"]:
+            if counter["name"] == "duplicates_avoided_total" and counter["labels"].get("scraper") == self.__class__.__name__:
+                avoided[counter["labels"]["reason"]] = counter["value"]
+        return avoided
+
+    def process_doc(self, doc, content):
+        """Saves the downloaded content of the doc, unless the saved copy is already up to date.
+        :param content: Download returned by request_doc, or the content as bytes, NOT_MODIFIED or None."""
+        if content is None:
+            self.validators.pop(doc["href"], None)
+            self.metrics.inc("docs_total", result="failed")
+            return
+
+        if content is ALREADY_SAVED:
+            self.logger.debug("Doc already saved: " + self.parse_doc_name(doc))
+            self.metrics.inc("docs_total", result="already_saved")
+            return
+
+        if content is KNOWN:
+            self.logger.debug("Doc known: " + self.parse_doc_name(doc))
+            self.metrics.inc("docs_total", result="known")
+            self.consec_up_to_date_docs += 1
+            return
+
+        if content is DUPLICATE:
+            self.logger.debug("Doc already fetched: " + self.parse_doc_name(doc))
+            self.metrics.inc("docs_total", result="duplicate")
+            return
+
+        if content is NOT_MODIFIED:
+            self.logger.debug("Doc not modified: " + self.parse_doc_name(doc))
+            self.metrics.inc("docs_total", result="not_modified")
+            self.consec_up_to_date_docs += 1
+            return
+
+        download = content if isinstance(content, Download) else Download.from_bytes(content, self.download_dir)
+        doc_exists = self.check_if_doc_exists(doc)
+
+        # The hash is enough to tell that a doc is up to date, so unchanged docs are never encoded or stored.
+        if doc_exists and self.check_if_up_to_date(doc, download.content_hash):
+            self.logger.debug("Doc exists: " + self.parse_doc_name(doc))
+            self.metrics.inc("docs_total", result="unchanged")
+            self.consec_up_to_date_docs += 1
+            self.save_validators(doc)
+            download.discard()
+            return
+
+        if not doc_exists:
+            self.save_doc(doc, download)
+            self.consec_up_to_date_docs = 0
+            self.metrics.inc("docs_total", result="saved")
+        else:
+            self.update_doc(doc, download)
+            self.consec_up_to_date_docs = 0
+            self.metrics.inc("docs_total", result="updated")
+
+    def save_validators(self, doc):
+        """Moves the validators of the last download of the doc into the manifest."""
+        validators = self.validators.pop(doc["href"], None)
+        if validators is not None:
+            self.manifest.put_validators(self.parse_doc_name(doc), **validators)
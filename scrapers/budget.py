@@ -0,0 +1,59 @@
+import itertools
+import threading
+import time
+
+
+class ConcurrencyBudget:
+    """
+    A global limit on the number of requests in flight, shared by all scrapers of a Master.
+
+    When requests are waiting for a free slot, the slot goes to the request with the highest priority. Among equal
+    priorities it goes to the host that has the fewest requests in flight, so every host gets a fair share of the
+    budget, and then to the request that waited longest.
+
+    Like HostLimiter, it waits with time.sleep so that it also works under gevent monkey patching.
+
+    :param size: Maximum number of requests in flight.
+    """
+    POLL_INTERVAL = 0.01
+
+    def __init__(self, size):
+        self.size = size
+        self.in_use = 0
+        self.in_flight = {}
+        self.waiting = {}
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def acquire(self, host, priority=0):
+        """Blocks until a slot is free and this request is the next one to get it."""
+        ticket = next(self.counter)
+
+        with self.lock:
+            self.waiting[ticket] = (host, priority)
+
+        try:
+            while True:
+                with self.lock:
+                    if self.in_use < self.size and self._next_ticket() == ticket:
+                        del self.waiting[ticket]
+                        self.in_use += 1
+                        self.in_flight[host] = self.in_flight.get(host, 0) + 1
+                        return
+                time.sleep(self.POLL_INTERVAL)
+        except BaseException:
+            with self.lock:
+                self.waiting.pop(ticket, None)
+            raise
+
+    def _next_ticket(self):
+        return min(self.waiting, key=lambda ticket: (-self.waiting[ticket][1], self.in_flight.get(self.waiting[ticket][0], 0), ticket))
+
+    def release(self, host):
+        with self.lock:
+            self.in_use -= 1
+            self.in_flight[host] -= 1
+
+    def stats(self):
+        with self.lock:
+            return {"size": self.size, "in_use": self.in_use, "waiting": len(self.waiting), "in_flight": dict(self.in_flight)}
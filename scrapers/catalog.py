@@ -0,0 +1,257 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+# Keys that hold the document content rather than metadata.
+CONTENT_KEYS = ("content", "html")
+DATE_FORMATS = ("%d.%m.%Y", "%d/%m/%Y", "%Y-%m-%d")
+
+
+def source_name(output_dir):
+    """Returns the name documents of the output directory are cataloged under, e.g. "mevzuat" for output/mevzuat."""
+    return os.path.basename(os.path.normpath(os.path.abspath(output_dir)))
+
+
+def normalize_date(value):
+    """Returns the date in a string such as 01.02.2020, 01/02/2020 or 2020-02-01T00:00:00 as 2020-02-01, or None."""
+    if not isinstance(value, str):
+        return None
+
+    value = value.strip()[:10]
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def document_date(doc):
+    """Returns the first date found in a field of the doc whose name mentions a date (e.g. resmiGazeteTarihi, kararTarihi)."""
+    for key, value in doc.items():
+        if "tarih" in key.lower() or "date" in key.lower():
+            date = normalize_date(value)
+            if date is not None:
+                return date
+    return None
+
+
+class Catalog:
+    """
+    SQLite catalog of the metadata of every scraped document, with an FTS5 full-text index, shared by all scrapers.
+
+    Scrapers upsert a document when they save it, so the catalog is always up to date without scanning the output
+    directories. Each document is identified by its source (the name of its output directory, see source_name)
+    and doc_name, and has:
+    * its metadata fields, indexed for exact lookups, e.g. find(mevzuatTur=1) or find(bolum="Hukuk Bölümü"),
+    * a date, taken from the first date field of the metadata, for date ranges,
+    * a full-text index of its metadata and, once it is extracted (scrapers/postprocess.py), its text, for search.
+
+    :param path: Path of the SQLite file, e.g. output/catalog.sqlite.
+    """
+    FILE_NAME = "catalog.sqlite"
+    FIELDS = ("source", "doc_name", "href", "date", "createdAt", "updatedAt", "metadata")
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            "id INTEGER PRIMARY KEY, source TEXT, doc_name TEXT, href TEXT, date TEXT, createdAt TEXT, updatedAt TEXT, metadata TEXT,"
+            " UNIQUE (source, doc_name))"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS docs_date ON docs (date)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS fields (doc_id INTEGER, key TEXT, value TEXT, PRIMARY KEY (doc_id, key)) WITHOUT ROWID")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS fields_key_value ON fields (key, value)")
+        # remove_diacritics folds ş, ç, ğ, ö, ü into s, c, g, o, u, so that queries typed without Turkish characters match as well.
+        self.connection.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts USING fts5(doc_name, metadata, text, tokenize='unicode61 remove_diacritics 2')"
+        )
+
+    def _doc_id(self, source, doc_name):
+        row = self.connection.execute("SELECT id FROM docs WHERE source = ? AND doc_name = ?", (source, doc_name)).fetchone()
+        if row is not None:
+            return row[0]
+        return self.connection.execute("INSERT INTO docs (source, doc_name) VALUES (?, ?)", (source, doc_name)).lastrowid
+
+    def _put_fts(self, doc_id, doc_name, metadata=None, text=None):
+        """Replaces the full-text entry of the doc, keeping the metadata or text that is not given."""
+        row = self.connection.execute("SELECT metadata, text FROM docs_fts WHERE rowid = ?", (doc_id,)).fetchone()
+        if row is not None:
+            metadata = row[0] if metadata is None else metadata
+            text = row[1] if text is None else text
+            self.connection.execute("DELETE FROM docs_fts WHERE rowid = ?", (doc_id,))
+        self.connection.execute("INSERT INTO docs_fts (rowid, doc_name, metadata, text) VALUES (?, ?, ?, ?)", (doc_id, doc_name, metadata or "", text or ""))
+
+    def put(self, source, doc_name, doc, href=None, created_at=None, updated_at=None):
+        """Inserts or updates the metadata of a document. Its extracted text, if any, is kept."""
+        metadata = {key: value for key, value in doc.items() if key not in CONTENT_KEYS}
+        fields = [(key, str(value)) for key, value in metadata.items() if value is not None and not isinstance(value, (dict, list))]
+
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                doc_id = self._doc_id(source, doc_name)
+                self.connection.execute(
+                    "UPDATE docs SET href = ?, date = ?, createdAt = COALESCE(createdAt, ?), updatedAt = ?, metadata = ? WHERE id = ?",
+                    (href or metadata.get("href"), document_date(metadata), created_at, updated_at,
+                     json.dumps(metadata, ensure_ascii=False, default=str), doc_id),
+                )
+                self.connection.execute("DELETE FROM fields WHERE doc_id = ?", (doc_id,))
+                self.connection.executemany("INSERT INTO fields (doc_id, key, value) VALUES (?, ?, ?)", [(doc_id, key, value) for key, value in fields])
+                self._put_fts(doc_id, doc_name, metadata=" ".join(value for _, value in fields))
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def put_text(self, source, doc_name, text):
+        """Indexes the extracted text of a document. The document does not have to be cataloged yet."""
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                self._put_fts(self._doc_id(source, doc_name), doc_name, text=text)
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def _select(self, joins, conditions, parameters, order, limit, columns=""):
+        query = ("SELECT " + ", ".join("docs." + field for field in self.FIELDS) + columns + " FROM docs " + " ".join(joins)
+                 + (" WHERE " + " AND ".join(conditions) if conditions else "") + " ORDER BY " + order + " LIMIT ?")
+        with self.lock:
+            rows = self.connection.execute(query, parameters + [limit]).fetchall()
+
+        results = []
+        for row in rows:
+            result = dict(zip(self.FIELDS, row))
+            result["doc"] = json.loads(result.pop("metadata") or "{}")
+            if columns:
+                result["snippet"] = row[len(self.FIELDS)]
+            results.append(result)
+        return results
+
+    @staticmethod
+    def _filters(source, date_from, date_to, fields):
+        joins, conditions, parameters = [], [], []
+        for i, (key, value) in enumerate(fields.items()):
+            joins.append("JOIN fields f%d ON f%d.doc_id = docs.id AND f%d.key = ? AND f%d.value = ?" % (i, i, i, i))
+            parameters += [key, str(value)]
+        if source is not None:
+            conditions.append("docs.source = ?")
+            parameters.append(source)
+        if date_from is not None:
+            conditions.append("docs.date >= ?")
+            parameters.append(date_from)
+        if date_to is not None:
+            conditions.append("docs.date <= ?")
+            parameters.append(date_to)
+        return joins, conditions, parameters
+
+    def get(self, source, doc_name):
+        """Returns the catalog entry of the document, or None."""
+        results = self._select([], ["docs.source = ?", "docs.doc_name = ?"], [source, doc_name], "docs.id", 1)
+        return results[0] if results else None
+
+    def find(self, source=None, date_from=None, date_to=None, limit=100, **fields):
+        """
+        Returns the documents whose metadata fields have the given values, newest first, e.g. find(source="mevzuat", mevzuatTur=1).
+        Dates are ISO dates (2020-01-31); date_from and date_to are inclusive.
+        """
+        joins, conditions, parameters = self._filters(source, date_from, date_to, fields)
+        conditions.append("docs.metadata IS NOT NULL")
+        return self._select(joins, conditions, parameters, "docs.date DESC, docs.id", limit)
+
+    def search(self, query, source=None, date_from=None, date_to=None, limit=20, **fields):
+        """
+        Returns the documents matching an FTS5 query (e.g. 'kira', '"kira sözleşmesi"', 'kira AND tahliye') in their metadata
+        or text, best match first, with a snippet of the match. The filters are the same as for find.
+        """
+        joins, conditions, parameters = self._filters(source, date_from, date_to, fields)
+        joins.insert(0, "JOIN docs_fts ON docs_fts.rowid = docs.id")
+        conditions.insert(0, "docs_fts MATCH ?")
+        # The join parameters come first in the query.
+        parameters = parameters[:2 * len(fields)] + [query] + parameters[2 * len(fields):]
+        return self._select(joins, conditions, parameters, "bm25(docs_fts)", limit, columns=", snippet(docs_fts, -1, '[', ']', '…', 12)")
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM docs WHERE metadata IS NOT NULL").fetchone()[0]
+
+    def index_output_dir(self, output_dir):
+        """
+        Catalogs the JSON documents (and their extracted .txt files) of an output directory, e.g. one crawled before the
+        catalog existed. Returns the number of documents cataloged.
+        """
+        source = source_name(output_dir)
+        count = 0
+        for file_name in os.listdir(output_dir):
+            if not file_name.endswith(".json") or file_name.startswith("."):
+                continue
+
+            with open(os.path.join(output_dir, file_name), encoding="utf-8") as f:
+                wrapped_doc = json.load(f)
+            if not isinstance(wrapped_doc.get("doc"), dict):
+                continue
+
+            doc_name = wrapped_doc.get("doc_name", file_name[:-len(".json")])
+            self.put(source, doc_name, wrapped_doc["doc"], wrapped_doc.get("href"), wrapped_doc.get("createdAt"), wrapped_doc.get("updatedAt"))
+
+            text_path = os.path.join(output_dir, doc_name) + ".txt"
+            if os.path.exists(text_path):
+                with open(text_path, encoding="utf-8") as f:
+                    self.put_text(source, doc_name, f.read())
+            count += 1
+        return count
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Queries the catalog of scraped documents.")
+    parser.add_argument("catalog", help="Path of the catalog, e.g. output/catalog.sqlite.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    search = commands.add_parser("search", help="Full-text search in the metadata and text.")
+    search.add_argument("query", help="FTS5 query, e.g. '\"kira sözleşmesi\" AND tahliye'.")
+    find = commands.add_parser("find", help="Exact lookup by metadata fields.")
+    find.add_argument("fields", nargs="*", metavar="KEY=VALUE")
+    for command in (search, find):
+        command.add_argument("--source", help="Only this source, e.g. mevzuat.")
+        command.add_argument("--from", dest="date_from", help="Earliest date, e.g. 2020-01-01.")
+        command.add_argument("--to", dest="date_to", help="Latest date.")
+        command.add_argument("--limit", type=int, default=20)
+    index = commands.add_parser("index", help="Catalog the documents of output directories crawled before.")
+    index.add_argument("output_dirs", nargs="+")
+    args = parser.parse_args()
+
+    catalog = Catalog(args.catalog)
+    if args.command == "index":
+        for output_dir in args.output_dirs:
+            print(output_dir + ": " + str(catalog.index_output_dir(output_dir)) + " documents cataloged")
+        return
+
+    filters = dict(source=args.source, date_from=args.date_from, date_to=args.date_to, limit=args.limit)
+    if args.command == "search":
+        results = catalog.search(args.query, **filters)
+    else:
+        results = catalog.find(**filters, **dict(field.split("=", 1) for field in args.fields))
+
+    for result in results:
+        print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    # Usage: python -m scrapers.catalog output/catalog.sqlite search "kira" [--source mevzuat] [--from 2020-01-01] [--to 2020-12-31]
+    #        python -m scrapers.catalog output/catalog.sqlite find mevzuatTur=1 [--source mevzuat]
+    #        python -m scrapers.catalog output/catalog.sqlite index output/mevzuat output/uyusmazlik
+    main()
@@ -0,0 +1,105 @@
+import json
+import os
+import threading
+import time
+from scrapers.download import write_atomically
+
+
+class Checkpoint:
+    """
+    Crawl state of a scraper, flushed periodically to a JSON file so that a crawl can be resumed after a crash.
+
+    * committed_page: the last page whose docs are all saved (or failed), and the cursor to continue after it.
+    * in_flight: hrefs that were being downloaded at the time of the flush.
+    * failed: docs (metadata dicts) whose download failed. They are retried first when the crawl is resumed.
+
+    The file is replaced atomically and fsync'ed, so it always holds a complete state.
+
+    :param path: Path of the checkpoint file.
+    :param flush_interval: Minimum number of seconds between two periodic flushes.
+    :param barrier: Called before each flush, e.g. to wait until the saved docs are on disk.
+    """
+    FILE_NAME = ".checkpoint.json"
+
+    def __init__(self, path, flush_interval=10, barrier=None):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.barrier = barrier
+        self.lock = threading.Lock()
+        self.last_flush = 0.0
+        self.committed_page = None
+        self.cursor = {}
+        self.complete = False
+        self.in_flight = set()
+        self.failed = {}
+
+    @classmethod
+    def load(cls, path, flush_interval=10, barrier=None):
+        """Returns the checkpoint saved at the path, or an empty one if there is none."""
+        checkpoint = cls(path, flush_interval, barrier)
+        if not os.path.exists(path):
+            return checkpoint
+
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+
+        checkpoint.committed_page = state["committed_page"]
+        checkpoint.cursor = state["cursor"]
+        checkpoint.complete = state["complete"]
+        checkpoint.failed = {doc["href"]: doc for doc in state["failed"]}
+        # Downloads that were in flight at the time of the crash are repeated from the cursor on.
+        return checkpoint
+
+    def can_resume(self):
+        return self.committed_page is not None and not self.complete
+
+    def start(self, href):
+        with self.lock:
+            self.in_flight.add(href)
+
+    def finish(self, href):
+        with self.lock:
+            self.in_flight.discard(href)
+            self.failed.pop(href, None)
+
+    def fail(self, doc):
+        with self.lock:
+            self.in_flight.discard(doc["href"])
+            self.failed[doc["href"]] = {key: value for key, value in doc.items() if key != "content"}
+
+    def commit_page(self, page, cursor):
+        """Records that every doc up to and including the page is done. Flushes if flush_interval has passed."""
+        with self.lock:
+            if self.committed_page is not None and page <= self.committed_page:
+                return
+            self.committed_page = page
+            self.cursor = cursor
+
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def mark_complete(self):
+        with self.lock:
+            self.complete = True
+        self.flush()
+
+    def flush(self):
+        if self.barrier is not None:
+            self.barrier()
+
+        with self.lock:
+            state = {
+                "committed_page": self.committed_page,
+                "cursor": self.cursor,
+                "complete": self.complete,
+                "in_flight": sorted(self.in_flight),
+                "failed": list(self.failed.values()),
+            }
+            self.last_flush = time.monotonic()
+
+        def write(f):
+            json.dump(state, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+
+        write_atomically(self.path, write)
@@ -0,0 +1,204 @@
+import json
+import random
+import sqlite3
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from scrapers.download import write_atomically
+
+PENDING = "pending"
+DEAD = "dead"
+RECOVERED = "recovered"
+
+
+class DeadLetterQueue:
+    """
+    Persistent queue of failed fetches, stored in a SQLite file, so that a crawl can go on at full speed and retry them later.
+
+    Each letter is keyed (e.g. by href) and carries a JSON payload (e.g. the doc metadata) and the last error.
+    After its n-th failure, a letter is due again after base_delay * 2 ** (n - 1) seconds (with jitter, up to max_delay).
+    After max_attempts failures it is dead and no longer retried. Use a DeadLetterRetrier to retry due letters in the
+    background, and report or write_report for a summary of the run.
+
+    :param path: Path of the SQLite file.
+    :param max_attempts: Number of failed attempts, including the first fetch, after which a letter is dead.
+    :param base_delay: Seconds before the first retry.
+    :param max_delay: Maximum seconds between two retries.
+    """
+    FILE_NAME = ".dead_letters.sqlite"
+
+    def __init__(self, path, max_attempts=5, base_delay=5.0, max_delay=600.0):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS letters ("
+            "key TEXT PRIMARY KEY, payload TEXT, status TEXT, attempts INTEGER, last_error TEXT, "
+            "first_failed REAL, last_failed REAL, next_attempt REAL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS letters_due ON letters (status, next_attempt)")
+
+    def delay(self, attempts):
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay * (1 + random.random() / 2)
+
+    def add(self, key, payload, error):
+        """Records a failed attempt of the key. Returns the status of the letter afterwards: PENDING or DEAD."""
+        now = time.time()
+
+        with self.lock:
+            row = self.connection.execute("SELECT attempts, status FROM letters WHERE key = ?", (key,)).fetchone()
+            # A letter that was recovered or declared dead in an earlier run starts over when it fails again.
+            attempts = row[0] + 1 if row is not None and row[1] == PENDING else 1
+            status = DEAD if attempts >= self.max_attempts else PENDING
+
+            self.connection.execute(
+                "INSERT INTO letters (key, payload, status, attempts, last_error, first_failed, last_failed, next_attempt) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET "
+                "payload = excluded.payload, status = excluded.status, attempts = excluded.attempts, last_error = excluded.last_error, "
+                "first_failed = CASE WHEN letters.status = 'pending' THEN letters.first_failed ELSE excluded.first_failed END, "
+                "last_failed = excluded.last_failed, next_attempt = excluded.next_attempt",
+                (key, json.dumps(payload, ensure_ascii=False), status, attempts, error, now, now, now + self.delay(attempts)),
+            )
+        return status
+
+    def fail(self, key, error):
+        """Records another failed attempt of a letter that is in the queue."""
+        with self.lock:
+            row = self.connection.execute("SELECT payload FROM letters WHERE key = ?", (key,)).fetchone()
+        return self.add(key, json.loads(row[0]) if row is not None else None, error)
+
+    def recover(self, key):
+        """Marks the letter as recovered, i.e. its retry succeeded."""
+        with self.lock:
+            self.connection.execute("UPDATE letters SET status = ?, next_attempt = NULL WHERE key = ?", (RECOVERED, key))
+
+    def due(self, limit=100):
+        """Returns (key, payload) pairs of the pending letters that are due for a retry, the longest overdue first."""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT key, payload FROM letters WHERE status = ? AND next_attempt <= ? ORDER BY next_attempt LIMIT ?",
+                (PENDING, time.time(), limit),
+            ).fetchall()
+        return [(key, json.loads(payload)) for key, payload in rows]
+
+    def next_due_in(self):
+        """Returns the seconds until the next pending letter is due (0 if one is due), or None if none is pending."""
+        with self.lock:
+            row = self.connection.execute("SELECT MIN(next_attempt) FROM letters WHERE status = ?", (PENDING,)).fetchone()
+        return None if row[0] is None else max(0.0, row[0] - time.time())
+
+    def status(self, key):
+        """Returns PENDING, DEAD or RECOVERED, or None if the key never failed."""
+        with self.lock:
+            row = self.connection.execute("SELECT status FROM letters WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute("DELETE FROM letters")
+
+    def report(self, limit=1000):
+        """
+        Returns a summary: the number of letters by status, the most common errors of the pending and dead letters,
+        and up to `limit` of them with their attempts and last error.
+        """
+        with self.lock:
+            counts = dict(self.connection.execute("SELECT status, COUNT(*) FROM letters GROUP BY status").fetchall())
+            errors = Counter(dict(self.connection.execute(
+                "SELECT last_error, COUNT(*) FROM letters WHERE status != ? GROUP BY last_error", (RECOVERED,)).fetchall()))
+            rows = self.connection.execute(
+                "SELECT key, status, attempts, last_error, first_failed, last_failed, next_attempt FROM letters WHERE status != ? "
+                "ORDER BY status, last_failed LIMIT ?", (RECOVERED, limit)).fetchall()
+
+        def iso(timestamp):
+            return datetime.fromtimestamp(timestamp).isoformat() if timestamp else None
+
+        return {
+            "time": datetime.now().isoformat(),
+            "counts": {status: counts.get(status, 0) for status in (PENDING, DEAD, RECOVERED)},
+            "errors": dict(errors.most_common(20)),
+            "letters": [{
+                "key": key, "status": status, "attempts": attempts, "last_error": last_error,
+                "first_failed": iso(first_failed), "last_failed": iso(last_failed), "next_attempt": iso(next_attempt),
+            } for key, status, attempts, last_error, first_failed, last_failed, next_attempt in rows],
+        }
+
+    def write_report(self, path):
+        """Writes report() as a JSON file and returns it."""
+        report = self.report()
+        write_atomically(path, lambda f: f.write(json.dumps(report, ensure_ascii=False, indent=1)))
+        return report
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class DeadLetterRetrier:
+    """
+    Retries the due letters of a DeadLetterQueue on a background thread, one at a time, while the crawl goes on.
+
+    retry(key, payload) is called for each due letter. It returns None if the retry succeeded, or an error message;
+    exceptions count as failures as well.
+
+    :param queue: DeadLetterQueue to retry.
+    :param retry: Function retrying one letter.
+    :param interval: Maximum seconds between two checks for due letters.
+    """
+
+    def __init__(self, queue, retry, interval=1.0, metrics=None, logger=None):
+        self.queue = queue
+        self.retry = retry
+        self.interval = interval
+        self.metrics = metrics
+        self.logger = logger
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="dead-letter-retrier", daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.retry_due()
+            next_due_in = self.queue.next_due_in()
+            self.stopped.wait(self.interval if next_due_in is None else min(self.interval, next_due_in))
+
+    def retry_due(self):
+        """Retries the letters that are due now. Returns the number of letters recovered."""
+        recovered = 0
+        for key, payload in self.queue.due():
+            if self.stopped.is_set():
+                break
+
+            try:
+                error = self.retry(key, payload)
+            except Exception as e:
+                error = repr(e)
+
+            if error is None:
+                self.queue.recover(key)
+                recovered += 1
+                result = RECOVERED
+            else:
+                result = self.queue.fail(key, error)
+
+            if self.metrics is not None:
+                self.metrics.inc("dead_letter_retries_total", result=result)
+            if self.logger is not None:
+                self.logger.debug("Retried " + key + ": " + result, url=key, error=error)
+        return recovered
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
@@ -0,0 +1,158 @@
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+
+# Results of InFlightRegistry.claim.
+OWNER = "owner"
+SEEN = "seen"
+IN_FLIGHT = "in_flight"
+
+
+class SeenSet:
+    """
+    A persistent Bloom filter of the hrefs fetched so far, in a memory-mapped file.
+
+    It takes about 1.8 bytes per href at the default false positive rate (18 MB for 10 million hrefs), and since the
+    file is memory-mapped, only the pages that are touched are held in memory. A Bloom filter never misses an href
+    that was added, but it reports about error_rate of the other hrefs as seen as well, so callers should confirm
+    a hit before acting on it (e.g. in the manifest).
+
+    :param path: Path of the file.
+    :param capacity: Number of hrefs the filter is sized for, if the file does not exist yet. Beyond that, the false positive
+        rate grows.
+    :param error_rate: False positive rate at capacity.
+    """
+    MAGIC = b"SEEN1"
+    HEADER = struct.Struct("<5sQQQ")
+    # Smallest filter created, so that a crawl that lists more docs than expected still dedups well.
+    MIN_CAPACITY = 10_000
+
+    def __init__(self, path, capacity=1_000_000, error_rate=0.001):
+        self.path = path
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+
+        if os.path.exists(path) and os.path.getsize(path) >= self.HEADER.size:
+            with open(path, "rb") as f:
+                magic, self.size, self.hash_count, self.count = self.HEADER.unpack(f.read(self.HEADER.size))
+            if magic != self.MAGIC:
+                raise ValueError(path + " is not a seen-set file.")
+        else:
+            self._create(capacity)
+
+        self.file = open(path, "r+b")
+        self.bits = mmap.mmap(self.file.fileno(), 0)
+
+    def _create(self, capacity):
+        """Writes an empty filter sized for capacity hrefs. The bits are left as a hole in the file, so nothing else is written."""
+        capacity = max(capacity, self.MIN_CAPACITY)
+        self.size = math.ceil(-capacity * math.log(self.error_rate) / math.log(2) ** 2)
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        with open(self.path, "wb") as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.size, self.hash_count, 0))
+            f.truncate(self.HEADER.size + (self.size + 7) // 8)
+
+    def _positions(self, href):
+        digest = hashlib.blake2b(href.encode("utf-8"), digest_size=16).digest()
+        h1, h2 = struct.unpack("<QQ", digest)
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def __contains__(self, href):
+        offset = self.HEADER.size
+        with self.lock:
+            return all(self.bits[offset + position // 8] & (1 << position % 8) for position in self._positions(href))
+
+    def add(self, href):
+        """Adds the href. Returns False if it was (probably) there already."""
+        offset = self.HEADER.size
+        added = False
+
+        with self.lock:
+            for position in self._positions(href):
+                index = offset + position // 8
+                byte = self.bits[index]
+                if not byte & (1 << position % 8):
+                    self.bits[index] = byte | (1 << position % 8)
+                    added = True
+            if added:
+                self.count += 1
+        return added
+
+    def __len__(self):
+        """Approximate number of hrefs added."""
+        return self.count
+
+    def clear(self, capacity=None):
+        """Empties the filter, and resizes it for capacity hrefs if given (e.g. for a new crawl of a different size)."""
+        with self.lock:
+            self.bits.close()
+            self.file.close()
+            self._create(capacity if capacity is not None else self._capacity())
+            self.file = open(self.path, "r+b")
+            self.bits = mmap.mmap(self.file.fileno(), 0)
+
+    def _capacity(self):
+        return round(self.size * math.log(2) ** 2 / -math.log(self.error_rate))
+
+    def flush(self):
+        with self.lock:
+            self.bits[:self.HEADER.size] = self.HEADER.pack(self.MAGIC, self.size, self.hash_count, self.count)
+            self.bits.flush()
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.bits.close()
+            self.file.close()
+
+
+class InFlightRegistry:
+    """
+    The document URLs being downloaded right now, shared by all scrapers of the process.
+
+    The first scraper to claim a URL becomes its owner and downloads it. Everyone else that claims it meanwhile gets
+    IN_FLIGHT and an Event to wait for, instead of downloading the same document a second time. Once the download
+    succeeded, the URL is reported SEEN until the owner has saved the document and released it; after that, the
+    seen check passed to claim (e.g. a SeenSet and the manifest) has to recognize it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.fetched = set()
+
+    def claim(self, url, seen=None):
+        """
+        Returns (OWNER, None) if the caller should download the URL, (IN_FLIGHT, event) if another caller is downloading it,
+        or (SEEN, None) if it was fetched before. The seen check runs under the lock, so a URL that is released
+        concurrently is never missed by both.
+        """
+        with self.lock:
+            event = self.in_flight.get(url)
+            if event is not None:
+                return IN_FLIGHT, event
+            if url in self.fetched or (seen is not None and seen(url)):
+                return SEEN, None
+            self.in_flight[url] = threading.Event()
+            return OWNER, None
+
+    def finish(self, url, fetched):
+        """Called by the owner when the download is over, to wake up the callers waiting for it. If it failed, the next claim becomes the owner."""
+        with self.lock:
+            event = self.in_flight.pop(url, None)
+            if fetched:
+                self.fetched.add(url)
+        if event is not None:
+            event.set()
+
+    def release(self, url):
+        """Called by the owner once the fetched document is saved (or found unchanged)."""
+        with self.lock:
+            self.fetched.discard(url)
+
+
+IN_FLIGHT_DOWNLOADS = InFlightRegistry()
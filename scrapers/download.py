@@ -0,0 +1,103 @@
+import hashlib
+import os
+import tempfile
+from base64 import b64encode
+
+# Multiple of 3, so that base64 encoded chunks can be concatenated without padding in between.
+CHUNK_SIZE = 3 * 64 * 1024
+# mkstemp creates files readable by the owner only; saved files get the usual permissions instead.
+FILE_MODE = 0o644
+
+
+class Download:
+    """
+    Document content that was streamed into a temporary file. Its hash and size are computed while it is written,
+    so the content never has to be held in memory. The file is moved into place by the storage backend, or
+    deleted with discard.
+    """
+
+    def __init__(self, path, content_hash, size, headers=None):
+        self.path = path
+        self.content_hash = content_hash
+        self.size = size
+        self.headers = headers or {}
+
+    @classmethod
+    def from_chunks(cls, chunks, directory, headers=None):
+        """Writes the chunks into a new temporary file in the directory."""
+        os.makedirs(directory, exist_ok=True)
+        sha256 = hashlib.sha256()
+        size = 0
+
+        fd, path = tempfile.mkstemp(dir=directory, suffix=".part")
+        try:
+            os.chmod(path, FILE_MODE)
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    if not chunk:
+                        continue
+                    sha256.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+        except BaseException:
+            os.remove(path)
+            raise
+
+        return cls(path, sha256.hexdigest(), size, headers)
+
+    @classmethod
+    def from_response(cls, response, directory):
+        """Streams the body of a response sent with stream=True into a temporary file, and closes the response."""
+        try:
+            return cls.from_chunks(response.iter_content(CHUNK_SIZE), directory, response.headers)
+        finally:
+            response.close()
+
+    @classmethod
+    def from_bytes(cls, content, directory):
+        return cls.from_chunks([content], directory)
+
+    def iter_chunks(self, chunk_size=CHUNK_SIZE):
+        with open(self.path, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def iter_base64(self):
+        """Yields the content base64 encoded, chunk by chunk."""
+        for chunk in self.iter_chunks():
+            yield b64encode(chunk).decode('ascii')
+
+    def read(self):
+        """Returns the whole content. Only meant for small documents."""
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def move_to(self, path):
+        """Atomically moves the content to the given path."""
+        os.replace(self.path, path)
+        self.path = path
+
+    def discard(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def write_atomically(path, write, mode="w", encoding="utf-8"):
+    """
+    Calls write(f) with a temporary file next to path, then renames the file to path.
+    Readers therefore see either the old file or the complete new one, never a partial write.
+    """
+    directory = os.path.dirname(path) or "."
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        os.chmod(temp_path, FILE_MODE)
+        with os.fdopen(fd, mode, encoding=encoding if "b" not in mode else None) as f:
+            write(f)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
@@ -0,0 +1,116 @@
+import re
+from collections import namedtuple
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    import lxml
+except ImportError:
+    lxml = None
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as SelectolaxTree
+except ImportError:
+    try:
+        # selectolax < 0.3 only has the modest backend.
+        from selectolax.parser import HTMLParser as SelectolaxTree
+    except ImportError:
+        SelectolaxTree = None
+
+
+class ElementFilter(namedtuple("ElementFilter", ["tag", "attribute", "class_name"])):
+    """
+    Restricts parsing to the elements with the given tag (and attribute and class, if given) and their descendants.
+    It is the common subset of a SoupStrainer and a CSS selector, so that every backend can apply it.
+
+    e.g. ElementFilter("div", "data-content") keeps only <div data-content="...">...</div> elements.
+    class_name matches one of the classes of an element, like the CSS selector: ElementFilter("input", class_name="pageInput")
+    keeps <input class="pageInput form-control">.
+    """
+    def __new__(cls, tag, attribute=None, class_name=None):
+        return super().__new__(cls, tag, attribute, class_name)
+
+    def attrs(self):
+        attrs = {}
+        if self.attribute:
+            attrs[self.attribute] = True
+        if self.class_name:
+            # BeautifulSoup compares a string with the whole class attribute, and a regular expression with each class.
+            attrs["class"] = re.compile(r"(^|\s)" + re.escape(self.class_name) + r"(\s|$)")
+        return attrs
+
+    def strainer(self):
+        return SoupStrainer(self.tag, attrs=self.attrs())
+
+    def css(self):
+        return (self.tag + ("[" + self.attribute + "]" if self.attribute else "")
+                + ("." + self.class_name if self.class_name else ""))
+
+
+class Bs4Parser:
+    """
+    Parses with BeautifulSoup. lxml is used as the tree builder when it is installed, html.parser otherwise.
+    With a filter, only the matching elements are built into the tree (SoupStrainer).
+    """
+    name = "bs4"
+
+    def __init__(self, features=None):
+        self.features = features or ("lxml" if lxml is not None else "html.parser")
+
+    def soup(self, content, only=None):
+        """Returns a BeautifulSoup object of the content. If only (an ElementFilter) is given, it holds just the matching elements."""
+        return BeautifulSoup(content, self.features, parse_only=only.strainer() if only is not None else None)
+
+    def select_attributes(self, content, only, attribute):
+        """Returns the given attribute of every element matching the filter, in document order. Missing attributes are None."""
+        return [element.get(attribute) for element in self.soup(content, only).find_all(only.tag, attrs=only.attrs())]
+
+
+class SelectolaxParser(Bs4Parser):
+    """
+    Finds the elements of a filter with selectolax (a fast C parser) and builds a BeautifulSoup tree of just those
+    elements, so that parse_page methods written for BeautifulSoup keep working unchanged.
+    Without a filter, the whole content is parsed with BeautifulSoup.
+    """
+    name = "selectolax"
+
+    def soup(self, content, only=None):
+        if only is None:
+            return super().soup(content)
+
+        tree = SelectolaxTree(content)
+        matches = tree.css(only.css())
+        matched = {node.mem_id for node in matches}
+        # Nested matches are already part of the html of their matching ancestor.
+        html = "".join(node.html for node in matches if not self._has_matched_ancestor(node, matched))
+        return BeautifulSoup(html, self.features, parse_only=only.strainer())
+
+    def select_attributes(self, content, only, attribute):
+        return [node.attributes.get(attribute) for node in SelectolaxTree(content).css(only.css())]
+
+    @staticmethod
+    def _has_matched_ancestor(node, matched):
+        parent = node.parent
+        while parent is not None:
+            if parent.mem_id in matched:
+                return True
+            parent = parent.parent
+        return False
+
+
+PARSERS = {"bs4": Bs4Parser, "selectolax": SelectolaxParser}
+
+
+def default_parser():
+    """Returns the fastest parser that is installed: selectolax, then BeautifulSoup with lxml, then BeautifulSoup with html.parser."""
+    return SelectolaxParser() if SelectolaxTree is not None else Bs4Parser()
+
+
+def get_parser(name=None):
+    """Returns the parser with the given name ("bs4", "selectolax", or "html.parser"/"lxml" for bs4 with that tree builder), or the default one."""
+    if name is None:
+        return default_parser()
+    if name in ("html.parser", "lxml"):
+        return Bs4Parser(name)
+    if name == "selectolax" and SelectolaxTree is None:
+        raise ImportError("selectolax package is required for the selectolax parser.")
+    return PARSERS[name]()
@@ -0,0 +1,126 @@
+import json
+import logging
+import logging.handlers
+import sys
+import threading
+import time
+from datetime import datetime
+
+LOGGER_NAME = "scraper"
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one JSON object per line: time, level, scraper, message and the structured fields of the record."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "scraper": getattr(record, "scraper", None),
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class BufferedHandler(logging.handlers.MemoryHandler):
+    """
+    Buffers records and writes them to the target handler in batches: when `capacity` records are buffered,
+    when `flush_interval` seconds passed since the last write, or right away for errors.
+    """
+
+    def __init__(self, target, capacity=256, flush_interval=5.0):
+        super().__init__(capacity, flushLevel=logging.ERROR, target=target)
+        self.flush_interval = flush_interval
+        self.last_flush = time.monotonic()
+
+    def shouldFlush(self, record):
+        return super().shouldFlush(record) or time.monotonic() - self.last_flush >= self.flush_interval
+
+    def flush(self):
+        super().flush()
+        self.last_flush = time.monotonic()
+
+
+class LogFileFilter(logging.Filter):
+    """Passes the records of the scrapers that log to the given file."""
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+
+    def filter(self, record):
+        return getattr(record, "log_file", None) == self.path
+
+
+class ScraperLogger(logging.LoggerAdapter):
+    """
+    Logger of one scraper. Every record carries the scraper name and the structured fields passed as keyword arguments,
+    e.g. logger.info("Saved doc", doc_name=name, size=size).
+    """
+
+    def __init__(self, scraper, log_file=None):
+        super().__init__(logging.getLogger(LOGGER_NAME + "." + scraper), {"scraper": scraper, "log_file": log_file})
+
+    def log(self, level, msg, *args, exc_info=None, **fields):
+        if self.isEnabledFor(level):
+            self.logger.log(level, msg, *args, exc_info=exc_info, extra=dict(self.extra, fields=fields))
+
+    def debug(self, msg, *args, **fields):
+        self.log(logging.DEBUG, msg, *args, **fields)
+
+    def info(self, msg, *args, **fields):
+        self.log(logging.INFO, msg, *args, **fields)
+
+    def warning(self, msg, *args, **fields):
+        self.log(logging.WARNING, msg, *args, **fields)
+
+    def error(self, msg, *args, **fields):
+        self.log(logging.ERROR, msg, *args, **fields)
+
+
+_lock = threading.Lock()
+_file_handlers = {}
+
+
+def _configure():
+    # Scrapers used to print every message, so messages still go to stdout unless the application configured the logger.
+    logger = logging.getLogger(LOGGER_NAME)
+    if not logger.handlers:
+        console = logging.StreamHandler(sys.stdout)
+        console.setFormatter(logging.Formatter("[%(scraper)s] %(message)s"))
+        logger.addHandler(console)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+
+def get_logger(scraper, log_file=None):
+    """
+    Returns the logger of a scraper. Records go to stdout and, if log_file is given, as JSON lines to the log file.
+    The log file is written through a buffer, and shared by all scrapers that log to it.
+    Per-document messages are logged at DEBUG level; call logging.getLogger("scraper").setLevel(logging.DEBUG) to see them.
+    """
+    with _lock:
+        _configure()
+
+        if log_file is not None and log_file not in _file_handlers:
+            file_handler = logging.FileHandler(log_file, encoding="utf-8", delay=True)
+            file_handler.setFormatter(JsonFormatter())
+
+            handler = BufferedHandler(file_handler)
+            handler.addFilter(LogFileFilter(log_file))
+            logging.getLogger(LOGGER_NAME).addHandler(handler)
+            _file_handlers[log_file] = handler
+
+    return ScraperLogger(scraper, log_file)
+
+
+def flush_logs():
+    """Writes the buffered records to the log files."""
+    with _lock:
+        handlers = list(_file_handlers.values())
+
+    for handler in handlers:
+        handler.flush()
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+from base64 import b64decode
+from datetime import datetime
+
+
+def content_hash(content):
+    """Returns the hash used to compare document contents."""
+    return hashlib.sha256(content).hexdigest()
+
+
+class Manifest:
+    """
+    SQLite index of the documents saved in an output directory.
+    For each doc_name it keeps the content hash, size, href, createdAt and updatedAt, so checking whether a
+    document exists or changed is a single indexed lookup that never opens the saved document.
+    It also keeps the HTTP validators (ETag, Last-Modified, Content-Length) of the last download, for conditional requests.
+
+    :param path: Path of the SQLite file.
+    """
+    FILE_NAME = ".manifest.sqlite"
+    FIELDS = ("doc_name", "content_hash", "size", "href", "createdAt", "updatedAt", "etag", "last_modified", "content_length")
+    VALIDATORS = ("etag", "last_modified", "content_length")
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            "doc_name TEXT PRIMARY KEY, content_hash TEXT, size INTEGER, href TEXT, createdAt TEXT, updatedAt TEXT)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS docs_href ON docs (href)")
+
+        # Manifests written before validators were stored lack their columns.
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(docs)")]
+        for column in self.VALIDATORS:
+            if column not in columns:
+                self.connection.execute("ALTER TABLE docs ADD COLUMN " + column + " TEXT")
+
+    @classmethod
+    def open(cls, output_dir, extension=".json"):
+        """Opens the manifest of the output directory. If there is none yet, builds it from the files already in the directory."""
+        path = os.path.join(output_dir, cls.FILE_NAME)
+        is_new = not os.path.exists(path)
+
+        manifest = cls(path)
+        if is_new:
+            manifest.rebuild(output_dir, extension)
+        return manifest
+
+    def get(self, doc_name):
+        """Returns the entry of the document as a dict, or None if it is not in the manifest."""
+        return self._get_one("doc_name", doc_name)
+
+    def get_by_href(self, href):
+        """Returns the entry of the document downloaded from the given href, or None."""
+        return self._get_one("href", href)
+
+    def _get_one(self, column, value):
+        with self.lock:
+            row = self.connection.execute("SELECT " + ", ".join(self.FIELDS) + " FROM docs WHERE " + column + " = ?", (value,)).fetchone()
+
+        return dict(zip(self.FIELDS, row)) if row is not None else None
+
+    def __contains__(self, doc_name):
+        return self.get(doc_name) is not None
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def put(self, doc_name, content_hash, size, href=None, created_at=None, updated_at=None):
+        """Inserts or replaces the entry of the document. createdAt of an existing entry is kept unless given."""
+        now = datetime.now().isoformat()
+
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO docs (doc_name, content_hash, size, href, createdAt, updatedAt) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (doc_name) DO UPDATE SET "
+                "content_hash = excluded.content_hash, size = excluded.size, href = excluded.href, "
+                "createdAt = COALESCE(?, docs.createdAt), updatedAt = excluded.updatedAt",
+                (doc_name, content_hash, size, href, created_at or now, updated_at or now, created_at),
+            )
+
+    def put_validators(self, doc_name, etag=None, last_modified=None, content_length=None):
+        """Stores the validators of the last download of the document."""
+        with self.lock:
+            self.connection.execute(
+                "UPDATE docs SET etag = ?, last_modified = ?, content_length = ? WHERE doc_name = ?",
+                (etag, last_modified, content_length, doc_name),
+            )
+
+    def rebuild(self, output_dir, extension=".json"):
+        """
+        Adds an entry for every file with the given extension in the output directory.
+        Files in the document format of README.md are hashed by their decoded content, other files by their bytes.
+        Dotfiles (.checkpoint.json, .dead_letters.json) belong to the scraper and are skipped.
+        """
+        file_names = [name for name in os.listdir(output_dir) if name.endswith(extension) and not name.startswith(".")]
+
+        for file_name in file_names:
+            path = os.path.join(output_dir, file_name)
+            entry = self._read_entry(path)
+            if entry is None:
+                continue
+
+            self.put(file_name[:-len(extension)], *entry)
+
+        return len(file_names)
+
+    @staticmethod
+    def _read_entry(path):
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        modified = datetime.fromtimestamp(os.path.getmtime(path)).isoformat()
+
+        try:
+            wrapped_doc = json.loads(data)
+            content = b64decode(wrapped_doc["doc"]["content"])
+        except (ValueError, KeyError, TypeError):
+            return content_hash(data), len(data), None, modified, modified
+
+        return (content_hash(content), len(content), wrapped_doc.get("href"),
+                wrapped_doc.get("createdAt", modified), wrapped_doc.get("updatedAt", modified))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+if __name__ == "__main__":
+    # Usage: python -m scrapers.manifest <output_dir> [extension]
+    output_dir = sys.argv[1]
+    extension = sys.argv[2] if len(sys.argv) > 2 else ".json"
+
+    manifest = Manifest(os.path.join(output_dir, Manifest.FILE_NAME))
+    count = manifest.rebuild(output_dir, extension)
+    print("Indexed " + str(count) + " files, manifest has " + str(len(manifest)) + " entries.")
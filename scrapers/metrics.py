@@ -0,0 +1,267 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from scrapers.download import write_atomically
+
+PREFIX = "scraper_"
+
+
+def _key(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class Metrics:
+    """
+    A registry of counters, timers and gauges, each broken down by labels (e.g. scraper, host, stage).
+
+    * Counters only go up: requests, bytes, retries, errors.
+    * Timers keep the count, total and maximum of observed durations in seconds, e.g. the time spent per crawl stage.
+    * Gauges hold the current value of something, or a callable that returns it, e.g. the depth of a queue.
+
+    Updating a metric takes a lock and a dict update, so it is cheap enough for every request and document.
+    Use snapshot() or prometheus() to read them, or MetricsExporter to export them periodically.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.timers = {}
+        self.gauges = {}
+        self.started = time.time()
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            timer = self.timers.get(key)
+            if timer is None:
+                self.timers[key] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                timer[2] = max(timer[2], seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observes how long the with block takes."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timed_iter(self, iterable, name, total=False, **labels):
+        """
+        Yields the items of the iterable and observes how long producing each of them took, e.g. fetching each page of a generator.
+        With total=True, a single observation of the total time is made when the iterable is exhausted or closed.
+        """
+        iterator = iter(iterable)
+        elapsed = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    elapsed += time.perf_counter() - start
+                    return
+
+                if total:
+                    elapsed += time.perf_counter() - start
+                else:
+                    self.observe(name, time.perf_counter() - start, **labels)
+                yield item
+        finally:
+            if total:
+                self.observe(name, elapsed, **labels)
+
+    def set_gauge(self, name, value, **labels):
+        """Sets the gauge to a number, or to a callable that is called whenever the metrics are read."""
+        with self.lock:
+            self.gauges[_key(name, labels)] = value
+
+    def remove_gauge(self, name, **labels):
+        with self.lock:
+            self.gauges.pop(_key(name, labels), None)
+
+    def scope(self, **labels):
+        """Returns a view of the registry that adds the given labels to every metric, e.g. scope(scraper="MevzuatScraper")."""
+        return MetricsScope(self, labels)
+
+    def _read(self):
+        with self.lock:
+            counters = dict(self.counters)
+            timers = {key: list(timer) for key, timer in self.timers.items()}
+            gauges = dict(self.gauges)
+
+        gauges = {key: value() if callable(value) else value for key, value in gauges.items()}
+        return counters, timers, gauges
+
+    def snapshot(self):
+        """Returns every metric as a JSON serializable dict."""
+        counters, timers, gauges = self._read()
+
+        return {
+            "time": datetime.now().isoformat(),
+            "uptime_seconds": round(time.time() - self.started, 3),
+            "counters": [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in sorted(counters.items())],
+            "timers": [{"name": name, "labels": dict(labels), "count": count, "total_seconds": round(total, 6), "max_seconds": round(maximum, 6)}
+                       for (name, labels), (count, total, maximum) in sorted(timers.items())],
+            "gauges": [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in sorted(gauges.items())],
+        }
+
+    def prometheus(self):
+        """Returns every metric in the Prometheus text exposition format. Timers are exported as summaries without quantiles."""
+        counters, timers, gauges = self._read()
+        lines = []
+
+        def add(metrics, metric_type, samples):
+            last_name = None
+            for (name, labels), value in sorted(metrics.items()):
+                if name != last_name:
+                    lines.append("# TYPE " + PREFIX + name + " " + metric_type)
+                    last_name = name
+                for suffix, sample in samples(value):
+                    lines.append(PREFIX + name + suffix + _format_labels(labels) + " " + repr(float(sample)))
+
+        add(counters, "counter", lambda value: [("", value)])
+        add(timers, "summary", lambda timer: [("_count", timer[0]), ("_sum", timer[1])])
+        add(gauges, "gauge", lambda value: [("", value)])
+        add({_key(name + "_max", dict(labels)): timer[2] for (name, labels), timer in timers.items()}, "gauge", lambda value: [("", value)])
+
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+
+    def escape(value):
+        return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+    return "{" + ",".join(key + '="' + escape(value) + '"' for key, value in labels) + "}"
+
+
+class MetricsScope:
+    """A view of a Metrics registry that adds fixed labels to every metric. Returned by Metrics.scope."""
+
+    def __init__(self, metrics, labels):
+        self.metrics = metrics
+        self.labels = labels
+
+    def inc(self, name, value=1, **labels):
+        self.metrics.inc(name, value, **self.labels, **labels)
+
+    def observe(self, name, seconds, **labels):
+        self.metrics.observe(name, seconds, **self.labels, **labels)
+
+    def timer(self, name, **labels):
+        return self.metrics.timer(name, **self.labels, **labels)
+
+    def timed_iter(self, iterable, name, total=False, **labels):
+        return self.metrics.timed_iter(iterable, name, total, **self.labels, **labels)
+
+    def set_gauge(self, name, value, **labels):
+        self.metrics.set_gauge(name, value, **self.labels, **labels)
+
+    def remove_gauge(self, name, **labels):
+        self.metrics.remove_gauge(name, **self.labels, **labels)
+
+    def scope(self, **labels):
+        return MetricsScope(self.metrics, dict(self.labels, **labels))
+
+
+# The registry every scraper, session and storage reports to, unless it is given another one.
+METRICS = Metrics()
+
+
+class MetricsExporter:
+    """
+    Exports a Metrics registry every `interval` seconds, on a background thread:
+    * as a JSON snapshot to directory/metrics.json and in the Prometheus text format to directory/metrics.prom
+      (e.g. for the node_exporter textfile collector), if directory is given,
+    * over HTTP at http://host:port/metrics (Prometheus) and /metrics.json, if port is given.
+
+    :param metrics: Metrics registry to export.
+    :param directory: Directory of the exported files.
+    :param port: Port of the HTTP endpoint. 0 picks a free port, see self.port.
+    :param interval: Seconds between two exports to the files.
+    """
+    JSON_FILE_NAME = "metrics.json"
+    PROMETHEUS_FILE_NAME = "metrics.prom"
+
+    def __init__(self, metrics=METRICS, directory=None, port=None, interval=10, host="127.0.0.1"):
+        self.metrics = metrics
+        self.directory = directory
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+        self.server = None
+        self.port = None
+
+        if port is not None:
+            self.server = ThreadingHTTPServer((host, port), self._handler())
+            self.server.daemon_threads = True
+            self.port = self.server.server_address[1]
+
+    def _handler(self):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body, content_type = metrics.prometheus().encode(), "text/plain; version=0.0.4; charset=utf-8"
+                elif self.path == "/metrics.json":
+                    body, content_type = json.dumps(metrics.snapshot()).encode(), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def start(self):
+        if self.server is not None:
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+        return self
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.export()
+
+    def export(self):
+        """Writes the files right away."""
+        snapshot = json.dumps(self.metrics.snapshot(), ensure_ascii=False, indent=1)
+        write_atomically(os.path.join(self.directory, self.JSON_FILE_NAME), lambda f: f.write(snapshot))
+        text = self.metrics.prometheus()
+        write_atomically(os.path.join(self.directory, self.PROMETHEUS_FILE_NAME), lambda f: f.write(text))
+
+    def stop(self):
+        """Stops exporting, after a last export of the files."""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.export()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
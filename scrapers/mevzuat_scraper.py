@@ -1,12 +1,13 @@
-from scrapers.abstract_scaper import AbstractScraper
-import requests
+from scrapers.abstract_scaper import AbstractScraper, NOT_MODIFIED
 import json
-from bs4 import BeautifulSoup
+import math
 from pathlib import Path
 from urllib.parse import urlparse, parse_qs
 
 class MevzuatScraper(AbstractScraper):
-    def __init__(self, output_path, log_file=None):
+    BASE_URL = "https://www.mevzuat.gov.tr/"
+
+    def __init__(self, output_path, log_file=None, base_url=BASE_URL, **kwargs):
         self.body = {"draw":1,"columns":[{"data":None,"name":"","searchable":True,"orderable":False,"search":{"value":"","regex":False}},{"data":None,"name":"","searchable":True,"orderable":False,"search":{"value":"","regex":False}},{"data":None,"name":"","searchable":True,"orderable":False,"search":{"value":"","regex":False}}],"order":[],"start":0,"length":100,"search":{"value":"","regex":False},"parameters":{"AranacakIfade":"Kg==","AranacakYer":"Baslik","TamCumle":False,"MevzuatTur":0,"GenelArama":True}}
         self.headers = {
             "Content-Type": "application/json; charset=UTF-8",
@@ -14,32 +15,39 @@ class MevzuatScraper(AbstractScraper):
             "Accept-Language": "en-US,en;q=0.9,pt;q=0.8,tr;q=0.7,it;q=0.6",
         }
 
-        super().__init__("https://www.mevzuat.gov.tr/", 1, output_path, headers=self.headers, log_file=log_file)
+        super().__init__(base_url, 1, output_path, headers=self.headers, log_file=log_file, **kwargs)
         Path(output_path).mkdir(parents=True, exist_ok=True)
 
     def get_next_page(self):
-        """A generator of pages, returning the soup object of the next page."""
+        """A generator of pages, returning the raw JSON of the next page. It is parsed by parse_page, or in a ParsePool."""
 
         search_url = 'anasayfa/MevzuatDatatable'
 
         while self.current_page_count <= self.max_page_count:
-            response = requests.post(self.base_url + search_url,
+            response = self.sessions.post(self.base_url + search_url,
                                 data=json.dumps(self.body),
                                 headers=self.headers)
-            
-            json_data = json.loads(response.text)
-            yield json_data
+
+            yield response.content
 
             self.current_page_count += 1
             self.body["draw"] += 1
             self.body["start"] += 100
 
+    def get_cursor(self, page):
+        return {"page": page, "start": (page - 1) * 100, "draw": page}
+
+    def seek_page(self, cursor):
+        super().seek_page(cursor)
+        self.body["start"] = cursor["start"]
+        self.body["draw"] = cursor["draw"]
+
     def get_max_page_count(self):
-        response = requests.post(self.base_url + 'anasayfa/MevzuatDatatable', data=json.dumps(self.body), headers=(self.headers))
+        response = self.sessions.post(self.base_url + 'anasayfa/MevzuatDatatable', data=json.dumps(self.body), headers=(self.headers))
 
         json_data = json.loads(response.text)
 
-        return json_data['recordsTotal'] // 100
+        return math.ceil(json_data['recordsTotal'] / 100)
 
     def parse_doc_name(self, single_doc):
         # return single_doc["mevzuatNo"] + "_" + single_doc["kabulTarih"]
@@ -47,17 +55,22 @@ class MevzuatScraper(AbstractScraper):
     
     def request_doc(self, url):
         """Sends a request to get the document. Note that this approach might not work for all websites. In this case, the child class should override this method."""
-        result = requests.get(self.base_url + url)
+        result = self.send_doc_request(url, stream=True)
 
-        if result.status_code == 200:
+        if result is NOT_MODIFIED:
+            return NOT_MODIFIED
+        elif result.status_code == 200:
             if result.headers['Content-Type'] == 'application/msword':
-                return result.content
+                return self.download(result)
             else:
-                self.log(f'Couldn\'t download: {url}')
-                print(f'Couldn\'t download: {url}')
-                return None
+                result.close()
+                return self.on_error(url, "Content-Type " + result.headers['Content-Type'])
         else:
-            return self.on_error(url)
+            result.close()
+            return self.on_error(url, "HTTP " + str(result.status_code))
+
+    def page_parser(self):
+        return parse_datatable
 
     def parse_page(self, page):
         """
@@ -73,18 +86,27 @@ class MevzuatScraper(AbstractScraper):
         To retrieve mevzuat's content ONLY, there is an endpoint 'anasayfa/MevzuatFihristDetayIframe?',
         which we use in this script. This endpoint saves us the trouble of parsing html.
         """
+        return parse_datatable(page)
 
-        for item in page["data"]:
-            if item["url"].startswith('http'):
-                # Binary file
-                item["href"] = item["url"]
-            else:
-                # Plaintext html
-                # item["href"] =  "anasayfa/MevzuatFihristDetayIframe?" + item["url"].replace('mevzuat?', '')
-                # As doc (MS Word file) :
-                parsed_url = urlparse(item["url"])
-                parsed_query = parse_qs(parsed_url.query)
 
-                item["href"] = "MevzuatMetin/"+ parsed_query["MevzuatTur"][0] + "." + parsed_query["MevzuatTertip"][0] + "." + parsed_query["MevzuatNo"][0] + ".doc"
+def parse_datatable(page):
+    """Parses a MevzuatDatatable page, raw or decoded, into docs. It is module level, so that it can run in a ParsePool."""
+    if isinstance(page, bytes):
+        page = json.loads(page)
+
+    docs = []
+    for item in page["data"]:
+        if item["url"].startswith('http'):
+            # Binary file
+            item["href"] = item["url"]
+        else:
+            # Plaintext html
+            # item["href"] =  "anasayfa/MevzuatFihristDetayIframe?" + item["url"].replace('mevzuat?', '')
+            # As doc (MS Word file) :
+            parsed_url = urlparse(item["url"])
+            parsed_query = parse_qs(parsed_url.query)
+
+            item["href"] = "MevzuatMetin/"+ parsed_query["MevzuatTur"][0] + "." + parsed_query["MevzuatTertip"][0] + "." + parsed_query["MevzuatNo"][0] + ".doc"
 
-            yield item
\ No newline at end of file
+        docs.append(item)
+    return docs
@@ -0,0 +1,65 @@
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+
+def parse_timed(parser, page):
+    """Runs in the worker processes: parses the page and returns the docs as a list, and the time taken."""
+    start = time.perf_counter()
+    docs = list(parser(page))
+    return docs, time.perf_counter() - start
+
+
+class ParsePool:
+    """
+    Parses listing pages in a pool of worker processes, so that parsing runs on every core and never holds the GIL
+    of the threads (or the gevent hub) that do the network I/O.
+
+    A page parser takes a page as the scraper fetched it, i.e. the raw response body or data decoded from it, and returns
+    the docs of the page. Pages and docs are pickled between the processes, so both should be plain data (bytes, dicts,
+    strings), and the parser must be a module level function, or a functools.partial of one.
+    Scrapers return their page parser from page_parser(). A pool can be shared by several scrapers.
+
+    :param workers: Number of worker processes. Defaults to the number of CPUs.
+    :param queue_size: Maximum number of pages of a map call that are queued or being parsed. Defaults to 2 per worker.
+    """
+
+    def __init__(self, workers=None, queue_size=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size or self.workers * 2
+        # The scrapers run threads (and gevent), which do not survive fork, so workers are started fresh.
+        self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def map(self, parser, pages, metrics=None, wait=None):
+        """
+        Parses (key, page) pairs and yields (key, docs) pairs in the same order. pages is pulled lazily and not advanced
+        while queue_size pages are queued or being parsed, so a slow consumer slows the producer down.
+
+        :param parser: Page parser.
+        :param pages: Iterable of (key, page) pairs, e.g. (page number, raw page).
+        :param metrics: Metrics (or MetricsScope) to report the parse time of each page to, as stage_seconds{stage="parse"}.
+        :param wait: Called with each future to get its result. Defaults to future.result(); pass a cooperative wait under gevent.
+        """
+        parse = partial(parse_timed, parser)
+        pending = deque()
+
+        def result():
+            key, future = pending.popleft()
+            docs, seconds = wait(future) if wait is not None else future.result()
+            if metrics is not None:
+                metrics.observe("stage_seconds", seconds, stage="parse")
+            return key, docs
+
+        for key, page in pages:
+            pending.append((key, self.executor.submit(parse, page)))
+            if len(pending) >= self.queue_size:
+                yield result()
+
+        while pending:
+            yield result()
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
@@ -0,0 +1,114 @@
+import queue
+import threading
+from collections import deque
+from concurrent.futures import wait, FIRST_COMPLETED
+
+_DONE = object()
+
+
+def prefetch(iterable, size, metrics=None, name=None):
+    """
+    Iterates `iterable` on a background thread and yields its items, keeping at most `size` of them buffered.
+    When the buffer is full the background thread waits, so a slow consumer slows the producer down (backpressure).
+    Exceptions raised by the iterable are re-raised in the consumer.
+
+    :param iterable: Any iterable, e.g. a generator of pages.
+    :param size: Maximum number of items fetched ahead of the consumer.
+    :param metrics: Metrics (or MetricsScope) to report the number of buffered items to, as the queue_depth gauge.
+    :param name: Value of the queue label of the gauge.
+    """
+    buffer = queue.Queue(maxsize=size)
+    stopped = threading.Event()
+
+    if metrics is not None:
+        metrics.set_gauge("queue_depth", buffer.qsize, queue=name)
+
+    def produce():
+        try:
+            for item in iterable:
+                if not _put(buffer, (item, None), stopped):
+                    return
+        except BaseException as e:
+            _put(buffer, (_DONE, e), stopped)
+            return
+        _put(buffer, (_DONE, None), stopped)
+
+    threading.Thread(target=produce, daemon=True).start()
+
+    try:
+        while True:
+            item, error = buffer.get()
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        # Lets the producer exit if the consumer stops early.
+        stopped.set()
+        if metrics is not None:
+            metrics.remove_gauge("queue_depth", queue=name)
+
+
+def _put(buffer, entry, stopped):
+    while not stopped.is_set():
+        try:
+            buffer.put(entry, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def ordered_map(executor, fn, items, window):
+    """
+    Like executor.map, but pulls items lazily and keeps at most `window` calls in flight.
+    Yields (item, result) pairs in the same order the items were given.
+
+    :param executor: A concurrent.futures executor that runs the calls.
+    :param fn: Callable applied to each item.
+    :param items: Any iterable, e.g. a generator of docs.
+    :param window: Maximum number of submitted but not yet yielded calls.
+    """
+    pending = deque()
+
+    for item in items:
+        pending.append((item, executor.submit(fn, item)))
+
+        if len(pending) >= window:
+            item, future = pending.popleft()
+            yield item, future.result()
+
+    while pending:
+        item, future = pending.popleft()
+        yield item, future.result()
+
+
+def unordered_map(executor, fn, items, window):
+    """
+    Like ordered_map, but yields the (item, result) pairs as soon as each call completes, in any order.
+    Pulls items lazily and keeps at most `window` calls in flight.
+
+    :param executor: A concurrent.futures executor that runs the calls.
+    :param fn: Callable applied to each item.
+    :param items: Any iterable, e.g. a generator of page numbers. It is not advanced while `window` calls are in flight.
+    :param window: Maximum number of submitted but not yet yielded calls.
+    """
+    pending = {}
+    items = iter(items)
+    exhausted = False
+
+    while pending or not exhausted:
+        while not exhausted and len(pending) < window:
+            item = next(items, _DONE)
+            if item is _DONE:
+                exhausted = True
+            else:
+                pending[executor.submit(fn, item)] = item
+
+        if not pending:
+            return
+
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield pending.pop(future), future.result()
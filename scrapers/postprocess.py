@@ -0,0 +1,286 @@
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from base64 import b64decode
+from concurrent.futures import ProcessPoolExecutor
+from bs4 import BeautifulSoup
+from scrapers.catalog import source_name
+from scrapers.download import write_atomically
+from scrapers.metrics import METRICS
+
+try:
+    import lxml
+except ImportError:
+    lxml = None
+
+try:
+    from pdfminer.high_level import extract_text as pdfminer_extract_text
+except ImportError:
+    pdfminer_extract_text = None
+
+# Command line tools that print the text of a Word 97-2003 (.doc) file, in order of preference.
+DOC_TO_TEXT_COMMANDS = (
+    ("antiword", "-m", "UTF-8.txt"),
+    ("catdoc", "-d", "utf-8", "-w"),
+)
+doc_to_text_command = next((command for command in DOC_TO_TEXT_COMMANDS if shutil.which(command[0])), None)
+
+TEXT_SUFFIX = ".txt"
+SPOOL_DIR_NAME = ".extract"
+# Word 97-2003 documents are OLE compound files.
+OLE_MAGIC = b"\xd0\xcf\x11\xe0"
+
+# Leading bytes of the formats that are recognized when the Content-Type header is missing or generic.
+MAGIC_NUMBERS = (
+    (b"%PDF", "application/pdf"),
+    (OLE_MAGIC, "application/msword"),
+    (b"PK\x03\x04", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"),
+)
+
+
+def extract_html(content):
+    """Returns the visible text of an HTML document, one block per line."""
+    soup = BeautifulSoup(content, "lxml" if lxml is not None else "html.parser")
+    for element in soup(["script", "style", "noscript", "template"]):
+        element.decompose()
+
+    lines = (re.sub(r"[ \t\xa0]+", " ", line).strip() for line in soup.get_text("\n").splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def extract_plain_text(content):
+    for encoding in ("utf-8", "windows-1254"):
+        try:
+            return content.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return content.decode("utf-8", "replace")
+
+
+def extract_pdf(content):
+    """Returns the text of a PDF document. Requires the pdfminer.six package."""
+    import io
+    return pdfminer_extract_text(io.BytesIO(content))
+
+
+def extract_doc(content):
+    """
+    Returns the text of a Word 97-2003 document. Requires antiword or catdoc on the PATH.
+    Documents served as .doc that are in fact HTML or plain text (as Word can save them) are extracted as such, without them.
+    """
+    if not content.startswith(OLE_MAGIC):
+        extractor = EXTRACTORS.get(detect_content_type(None, content[:1024]))
+        if extractor is None or extractor is extract_doc:
+            raise ValueError("Not a Word document")
+        return extractor(content)
+
+    if doc_to_text_command is None:
+        raise RuntimeError("Extracting .doc files requires antiword or catdoc")
+    with tempfile.NamedTemporaryFile(suffix=".doc") as f:
+        f.write(content)
+        f.flush()
+        result = subprocess.run(doc_to_text_command + (f.name,), stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    return result.stdout.decode("utf-8", "replace")
+
+
+# Content type: extractor. Extractors take the raw content as bytes and return the text.
+# They run in worker processes, so they must be module level functions (or otherwise picklable).
+EXTRACTORS = {
+    "text/html": extract_html,
+    "application/xhtml+xml": extract_html,
+    "text/plain": extract_plain_text,
+    "application/msword": extract_doc,
+}
+if pdfminer_extract_text is not None:
+    EXTRACTORS["application/pdf"] = extract_pdf
+
+
+def register_extractor(content_type, extractor):
+    """Registers the extractor of a content type for every PostProcessor created afterwards, e.g. a .docx extractor."""
+    EXTRACTORS[content_type] = extractor
+
+
+def detect_content_type(content_type, head):
+    """Returns the media type of a document from its Content-Type header, or from its first bytes if the header is missing or generic."""
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type and media_type not in ("application/octet-stream", "binary/octet-stream", "application/download"):
+        return media_type
+
+    for magic, magic_type in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return magic_type
+    if b"<html" in head.lower():
+        return "text/html"
+    try:
+        # A multi-byte character may be cut at the end of the head.
+        head[:-4].decode("utf-8")
+        return "text/plain"
+    except UnicodeDecodeError:
+        return media_type or None
+
+
+def extract_file(extractor, path, text_path):
+    """Runs in the worker processes: extracts the text of the file at path into text_path and deletes the file. Returns the text length and the time taken."""
+    start = time.perf_counter()
+    try:
+        with open(path, "rb") as f:
+            content = f.read()
+        text = extractor(content)
+        write_atomically(text_path, lambda f: f.write(text))
+        return len(text), time.perf_counter() - start
+    finally:
+        os.remove(path)
+
+
+class PostProcessor:
+    """
+    Extracts the text of saved documents in a pool of worker processes, alongside the crawl, and writes it next to them as
+    output_dir/doc_name.txt. Scrapers submit new and changed documents when they save them; unchanged ones are never submitted.
+
+    The content is hard linked into output_dir/.extract before it is saved, so the workers read the raw bytes without
+    decoding the saved JSON. At most `queue_size` documents wait for a worker; beyond that, submit blocks, so a crawl
+    that is faster than extraction slows down instead of filling the disk.
+    Documents whose type has no registered extractor (see EXTRACTORS and register_extractor) are skipped and counted.
+
+    :param output_dir: Output directory of the scraper.
+    :param workers: Number of worker processes. Defaults to the number of CPUs.
+    :param extractors: Content type: extractor dict. Defaults to EXTRACTORS.
+    :param queue_size: Maximum number of documents waiting for a worker. Defaults to 4 per worker.
+    :param catalog: Catalog (scrapers/catalog.py) to index the extracted text in, for full-text search.
+    """
+
+    def __init__(self, output_dir, workers=None, extractors=None, queue_size=None, metrics=METRICS, catalog=None):
+        self.output_dir = output_dir
+        self.catalog = catalog
+        self.spool_dir = os.path.join(output_dir, SPOOL_DIR_NAME)
+        self.extractors = dict(extractors or EXTRACTORS)
+        self.metrics = metrics
+        self.workers = workers or os.cpu_count() or 1
+        # The scrapers run threads (and gevent), which do not survive fork, so workers are started fresh.
+        self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        self.slots = threading.BoundedSemaphore(queue_size or self.workers * 4)
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.metrics.set_gauge("queue_depth", self.queue_depth, queue="extract")
+
+        # Spooled files of a crash were never extracted, and their documents will be saved and submitted again.
+        if os.path.isdir(self.spool_dir):
+            for file_name in os.listdir(self.spool_dir):
+                os.remove(os.path.join(self.spool_dir, file_name))
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+    def text_path(self, doc_name):
+        return os.path.join(self.output_dir, doc_name) + TEXT_SUFFIX
+
+    def submit(self, doc_name, download):
+        """Queues the text extraction of a Download that is about to be saved. Must be called before the storage consumes the download."""
+        with open(download.path, "rb") as f:
+            head = f.read(1024)
+        content_type = detect_content_type(download.headers.get("Content-Type"), head)
+        extractor = self.extractors.get(content_type)
+        if extractor is None:
+            self.metrics.inc("extracted_docs_total", result="unsupported", content_type=str(content_type))
+            return
+
+        fd, path = tempfile.mkstemp(dir=self.spool_dir)
+        os.close(fd)
+        try:
+            os.remove(path)
+            os.link(download.path, path)
+        except OSError:
+            # Hard links are not supported by every file system.
+            with open(download.path, "rb") as source, open(path, "wb") as target:
+                target.write(source.read())
+
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(extract_file, extractor, path, self.text_path(doc_name))
+        except BaseException:
+            self.slots.release()
+            os.remove(path)
+            raise
+        with self.lock:
+            self.pending.add(future)
+        future.add_done_callback(lambda future: self._done(future, doc_name, content_type))
+
+    def _done(self, future, doc_name, content_type):
+        with self.lock:
+            self.pending.discard(future)
+        self.slots.release()
+
+        if future.exception() is not None:
+            self.metrics.inc("extracted_docs_total", result="failed", content_type=content_type)
+            return
+
+        length, seconds = future.result()
+        self.metrics.inc("extracted_docs_total", result="extracted", content_type=content_type)
+        self.metrics.inc("extracted_chars_total", length)
+        self.metrics.observe("stage_seconds", seconds, stage="extract")
+
+        if self.catalog is not None:
+            with open(self.text_path(doc_name), encoding="utf-8") as f:
+                self.catalog.put_text(source_name(self.output_dir), doc_name, f.read())
+
+    def queue_depth(self):
+        with self.lock:
+            return len(self.pending)
+
+    def join(self):
+        """Waits until every submitted document is extracted."""
+        while True:
+            with self.lock:
+                pending = list(self.pending)
+            if not pending:
+                return
+            for future in pending:
+                try:
+                    future.result()
+                except Exception:
+                    pass
+
+    def close(self):
+        self.join()
+        self.executor.shutdown()
+        self.metrics.remove_gauge("queue_depth", queue="extract")
+
+
+def extract_saved_docs(output_dir, workers=None):
+    """
+    Extracts the text of the documents in a JSON output directory that have no text file yet, e.g. ones crawled before
+    post-processing existed. Returns the number of documents submitted.
+    """
+    from scrapers.download import Download
+
+    postprocessor = PostProcessor(output_dir, workers)
+    count = 0
+    try:
+        for file_name in sorted(os.listdir(output_dir)):
+            doc_name = file_name[:-len(".json")]
+            # Hidden files are the checkpoint and other state of the scraper.
+            if not file_name.endswith(".json") or file_name.startswith(".") or os.path.exists(postprocessor.text_path(doc_name)):
+                continue
+
+            with open(os.path.join(output_dir, file_name), encoding="utf-8") as f:
+                wrapped_doc = json.load(f)
+            if "content" not in wrapped_doc.get("doc", {}):
+                continue
+            content = b64decode(wrapped_doc["doc"]["content"])
+            download = Download.from_bytes(content, postprocessor.spool_dir)
+            postprocessor.submit(doc_name, download)
+            download.discard()
+            count += 1
+    finally:
+        postprocessor.close()
+    return count
+
+
+if __name__ == "__main__":
+    # Usage: python -m scrapers.postprocess output/mevzuat [workers]
+    print(str(extract_saved_docs(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else None)) + " documents extracted")
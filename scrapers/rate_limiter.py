@@ -0,0 +1,215 @@
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+
+def parse_retry_after(value):
+    """Returns the number of seconds a Retry-After header asks us to wait, or None if it is missing or malformed."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class HostLimiter:
+    """
+    Rate limiter for a single host: a token bucket bounds the request rate and an AIMD limit bounds the number of
+    requests in flight. Both grow while the host answers quickly and are cut in half when it answers with
+    429/5xx, fails to answer, or its latency climbs well above the best latency seen so far.
+    Like a TCP window, the rate grows by RATE_INCREASE * max_rate / rate per success, so it ramps up quickly while it is
+    low and a sporadic error does not hold it down. The host is only paused (with exponential backoff) after a 429,
+    a Retry-After, or several failures in a row, not after an isolated 5xx or connection error.
+    Failures reported with report_failure (a 200 without data) always pause the host. Each retry of such a request is
+    answered with a 200 again, so those failures are counted in a streak of their own, which only ends once no failure
+    was reported for SOFT_FAILURE_WINDOW seconds after the last pause.
+
+    Waiting is done with time.sleep, so the limiter also works under gevent (grequests) monkey patching.
+    """
+    #Constants
+    THROTTLE_STATUSES = (429, 500, 502, 503, 504)
+    RATE_INCREASE = 0.1
+    DECREASE_FACTOR = 0.5
+    LATENCY_DECREASE_FACTOR = 0.8
+    LATENCY_FACTOR = 3.0
+    LATENCY_MARGIN = 0.5
+    LATENCY_SMOOTHING = 0.2
+    BASELINE_DRIFT = 0.01
+    DECREASE_INTERVAL = 1.0
+    INITIAL_BACKOFF = 1.0
+    MAX_BACKOFF = 120.0
+    SOFT_FAILURE_WINDOW = 10.0
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, rate=5.0, min_rate=0.2, max_rate=50.0, concurrency=4, max_concurrency=32):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.tokens = 1.0
+        self.concurrency = concurrency
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.successes = 0
+        self.consecutive_failures = 0
+        self.soft_failures = 0
+        self.latency = None
+        self.base_latency = None
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.last_refill = time.monotonic()
+        self.counts = {"requests": 0, "throttled": 0, "slow": 0, "failures": 0}
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a request may be sent to the host."""
+        while True:
+            with self.lock:
+                wait = self._try_acquire(time.monotonic())
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def _try_acquire(self, now):
+        if now < self.blocked_until:
+            return self.blocked_until - now
+
+        self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+        if self.in_flight >= self.concurrency:
+            return self.POLL_INTERVAL
+        if self.tokens < 1.0:
+            return (1.0 - self.tokens) / self.rate
+
+        self.tokens -= 1.0
+        self.in_flight += 1
+        self.counts["requests"] += 1
+        return 0
+
+    def release(self, status=None, latency=None, retry_after=None):
+        """
+        Reports the outcome of a request sent after acquire.
+        :param status: HTTP status code, or None if no response was received.
+        :param latency: Seconds until the response arrived.
+        :param retry_after: Seconds the server asked us to wait (Retry-After header).
+        """
+        with self.lock:
+            self.in_flight -= 1
+
+            if status is None or status in self.THROTTLE_STATUSES:
+                self.counts["throttled" if status is not None else "failures"] += 1
+                self._on_failure(retry_after, status)
+                return
+
+            self.consecutive_failures = 0
+            if latency is not None and self._is_slow(latency):
+                self.counts["slow"] += 1
+                self._decrease(self.LATENCY_DECREASE_FACTOR)
+            else:
+                self._increase()
+
+    def report_failure(self, retry_after=None):
+        """Reports a failure that was not visible in the HTTP status, e.g. an empty result from a JSON endpoint."""
+        with self.lock:
+            self.counts["failures"] += 1
+            if time.monotonic() - self.blocked_until > self.SOFT_FAILURE_WINDOW:
+                self.soft_failures = 0
+            self.soft_failures += 1
+            self._on_failure(retry_after, streak=self.soft_failures)
+
+    def _on_failure(self, retry_after, status=None, streak=None):
+        """Decreases the limits, and pauses the host with a backoff that doubles with the length of the streak of failures.
+        Without a streak, the first of consecutive failures is free, unless it is a 429 or comes with a Retry-After."""
+        self.consecutive_failures += 1
+        self._decrease(self.DECREASE_FACTOR)
+
+        if streak is None:
+            if status != 429 and retry_after is None and self.consecutive_failures < 2:
+                return
+            streak = max(1, self.consecutive_failures - 1)
+
+        backoff = min(self.MAX_BACKOFF, self.INITIAL_BACKOFF * 2 ** (streak - 1))
+        wait = max(backoff * (1 + random.random() / 2), retry_after or 0)
+        self.blocked_until = max(self.blocked_until, time.monotonic() + wait)
+
+    def blocked_for(self):
+        """Returns the seconds until the host may be requested again after a failure, or 0."""
+        with self.lock:
+            return max(0.0, self.blocked_until - time.monotonic())
+
+    def _is_slow(self, latency):
+        if self.latency is None:
+            self.latency = self.base_latency = latency
+            return False
+
+        self.latency += self.LATENCY_SMOOTHING * (latency - self.latency)
+        # Let the baseline drift up slowly, so a host that is permanently slower is not throttled forever.
+        self.base_latency = min(self.latency, self.base_latency * (1 + self.BASELINE_DRIFT))
+        # Small absolute changes are noise, no matter how large they are relative to a fast baseline.
+        return self.latency > self.base_latency * self.LATENCY_FACTOR and self.latency - self.base_latency > self.LATENCY_MARGIN
+
+    def _increase(self):
+        # At most doubles the rate, so that one success after a collapse does not jump straight to max_rate.
+        self.rate = min(self.max_rate, self.rate + min(self.rate, self.RATE_INCREASE * self.max_rate / self.rate))
+        self.successes += 1
+        if self.successes >= self.concurrency:
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+            self.successes = 0
+
+    def _decrease(self, factor):
+        # Responses to requests sent before the last decrease say nothing new, so decrease at most once per interval.
+        now = time.monotonic()
+        if now - self.last_decrease < self.DECREASE_INTERVAL:
+            return
+        self.last_decrease = now
+        self.rate = max(self.min_rate, self.rate * factor)
+        self.concurrency = max(1, int(self.concurrency * factor))
+        self.successes = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                **self.counts,
+                "rate": round(self.rate, 2),
+                "concurrency": self.concurrency,
+                "in_flight": self.in_flight,
+                "latency": self.latency,
+            }
+
+
+class RateLimiter:
+    """
+    Keeps one HostLimiter per host. Keyword arguments are passed to every HostLimiter.
+    A single RateLimiter can be shared by several scrapers so that together they respect each host's limits.
+    Requests sent through a proxy are limited per host and proxy, since sites throttle each IP address on its own.
+    """
+
+    def __init__(self, **host_options):
+        self.host_options = host_options
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def host(self, url, via=None):
+        """Returns the HostLimiter of the host of the URL, or of the host as reached through the proxy `via` (a label)."""
+        host = urlparse(url).netloc
+        if via is not None:
+            host += " via " + via
+
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = HostLimiter(**self.host_options)
+            return self.hosts[host]
+
+    def stats(self):
+        with self.lock:
+            hosts = dict(self.hosts)
+
+        return {host: limiter.stats() for host, limiter in hosts.items()}
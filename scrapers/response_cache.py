@@ -0,0 +1,266 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import timedelta
+from urllib.parse import urlparse
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from scrapers.download import Download
+from scrapers.metrics import METRICS
+
+RECORD = "record"
+REPLAY = "replay"
+
+# Headers that described the body on the wire. Recorded bodies are already decoded and de-chunked.
+WIRE_HEADERS = ("content-encoding", "transfer-encoding", "content-length")
+
+
+class CacheMiss(requests.ConnectionError):
+    """Raised in offline replay mode for a request that was never recorded. Scrapers handle it like any other connection error."""
+
+
+class SegmentSlice:
+    """A file-like view of the body of a recorded response, read from its segment as the response is consumed.
+    The segment file is closed once the body is read, or the response is closed."""
+
+    def __init__(self, path, offset, length):
+        self.file = open(path, "rb")
+        self.file.seek(offset)
+        self.remaining = length
+
+    def read(self, size=-1, **kwargs):
+        if self.file is None:
+            return b""
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        chunk = self.file.read(size)
+        self.remaining -= len(chunk)
+        if self.remaining <= 0 or not chunk:
+            self.close()
+        return chunk
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class ResponseCache:
+    """
+    An on-disk cache of HTTP responses, so that a site can be re-parsed without crawling it again.
+
+    Responses are appended to segment files in a WARC-like format (a WARC/1.0 record with the HTTP status line,
+    headers and body of each response) and indexed in SQLite by method, URL and a hash of the request body.
+    A segment is closed once it reaches segment_size bytes; eviction removes whole segments.
+    Bodies are streamed: a response is downloaded into a temporary file in directory/.downloads and copied into the segment,
+    and the responses the cache returns read their body from the segment as it is consumed, so a large document is never
+    held in memory.
+
+    * In RECORD mode, requests go to the network and their 2xx responses to GET and POST requests are stored.
+      A later recording of the same request replaces the earlier one.
+    * In REPLAY mode, recorded responses are served from disk without touching the network or the rate limiter.
+      Requests that were not recorded go to the network and are recorded, or raise CacheMiss if offline=True.
+
+    Pass the cache to a SessionPool, e.g. SessionPool(cache=ResponseCache("cache", REPLAY)), so that listing pages
+    (get_max_page_count, get_next_page) and documents (request_doc) all go through it.
+
+    :param directory: Directory of the segments and the index.
+    :param mode: RECORD or REPLAY.
+    :param ttl: Seconds a response is served for. Older responses are treated as misses and evicted. None keeps them forever.
+    :param max_size: Maximum total size of the segments in bytes. The oldest segments are evicted beyond it. None means no limit.
+    :param segment_size: Size in bytes at which a new segment is started.
+    :param offline: In REPLAY mode, raise CacheMiss instead of requesting responses that were not recorded.
+    """
+    INDEX_FILE_NAME = "index.sqlite"
+    SEGMENT_PATTERN = re.compile(r"^segment-(\d+)\.warc$")
+    DOWNLOAD_DIR_NAME = ".downloads"
+
+    def __init__(self, directory, mode=RECORD, ttl=None, max_size=None, segment_size=256 * 1024 * 1024, offline=False):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError("Unknown cache mode: " + str(mode))
+
+        self.directory = directory
+        self.mode = mode
+        self.ttl = ttl
+        self.max_size = max_size
+        self.segment_size = segment_size
+        self.offline = offline
+        self.download_dir = os.path.join(directory, self.DOWNLOAD_DIR_NAME)
+        self.lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        # Downloads of a crash were never recorded.
+        shutil.rmtree(self.download_dir, ignore_errors=True)
+        self.connection = sqlite3.connect(os.path.join(directory, self.INDEX_FILE_NAME), check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, method TEXT, url TEXT, segment INTEGER, offset INTEGER, length INTEGER,"
+            " status INTEGER, reason TEXT, headers TEXT, recorded REAL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_segment ON responses (segment)")
+
+        segments = self.segments()
+        self.segment = segments[-1] if segments else 1
+        self.writer = None
+        self.evict()
+
+    @property
+    def replaying(self):
+        return self.mode == REPLAY
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, "segment-%06d.warc" % segment)
+
+    def segments(self):
+        """Returns the numbers of the segment files, oldest first."""
+        numbers = []
+        for file_name in os.listdir(self.directory):
+            match = self.SEGMENT_PATTERN.match(file_name)
+            if match:
+                numbers.append(int(match.group(1)))
+        return sorted(numbers)
+
+    @staticmethod
+    def key(method, url, body):
+        """Returns the index key of a request: its method, its URL with the query string, and the hash of its body."""
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        body_hash = hashlib.sha256(body or b"").hexdigest()
+        return hashlib.sha256((method.upper() + " " + url + " " + body_hash).encode("utf-8")).hexdigest()
+
+    def get(self, method, url, body=None):
+        """Returns the recorded response of the request as a requests.Response, or None."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT segment, offset, length, status, reason, headers, recorded FROM responses WHERE key = ?", (self.key(method, url, body),)
+            ).fetchone()
+
+            if row is None or self.expired(row[6]):
+                METRICS.inc("cache_misses_total", host=urlparse(url).netloc)
+                return None
+
+            segment, offset, length, status, reason, headers, recorded = row
+            body = SegmentSlice(self.segment_path(segment), offset, length)
+
+        METRICS.inc("cache_hits_total", host=urlparse(url).netloc)
+        METRICS.inc("cache_bytes_read_total", length)
+        return self.build_response(method, url, status, reason, json.loads(headers), body)
+
+    def put(self, method, url, body, response):
+        """
+        Records the response and returns an equivalent response that can still be read, since the body of the given one is consumed.
+        Only 2xx responses to GET and POST requests are recorded; others are returned as they are.
+        """
+        if method.upper() not in ("GET", "POST") or not 200 <= response.status_code < 300:
+            return response
+
+        # Streamed to a temporary file first, without holding the lock, since the WARC header needs the length of the body.
+        download = Download.from_response(response, self.download_dir)
+        try:
+            return self._record(method, url, body, response, download)
+        finally:
+            download.discard()
+
+    def _record(self, method, url, body, response, download):
+        headers = {name: value for name, value in response.headers.items() if name.lower() not in WIRE_HEADERS}
+        headers["Content-Length"] = str(download.size)
+        http_header = ("HTTP/1.1 %d %s\r\n" % (response.status_code, response.reason or "")
+                       + "".join(name + ": " + value + "\r\n" for name, value in headers.items()) + "\r\n").encode("utf-8", "replace")
+        now = time.time()
+        warc_header = ("WARC/1.0\r\n"
+                       "WARC-Type: response\r\n"
+                       "WARC-Target-URI: " + url + "\r\n"
+                       "WARC-Date: " + time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now)) + "\r\n"
+                       "WARC-Request-Method: " + method.upper() + "\r\n"
+                       "Content-Type: application/http; msgtype=response\r\n"
+                       "Content-Length: " + str(len(http_header) + download.size) + "\r\n\r\n").encode("utf-8")
+
+        with self.lock:
+            if self.writer is None:
+                self.writer = open(self.segment_path(self.segment), "ab")
+            if self.writer.tell() >= self.segment_size:
+                self.writer.close()
+                self.segment += 1
+                self.writer = open(self.segment_path(self.segment), "ab")
+
+            offset = self.writer.tell() + len(warc_header) + len(http_header)
+            self.writer.write(warc_header + http_header)
+            for chunk in download.iter_chunks():
+                self.writer.write(chunk)
+            self.writer.write(b"\r\n\r\n")
+            self.writer.flush()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.key(method, url, body), method.upper(), url, self.segment, offset, download.size,
+                 response.status_code, response.reason, json.dumps(headers), now)
+            )
+            stored = SegmentSlice(self.segment_path(self.segment), offset, download.size)
+
+        METRICS.inc("cache_bytes_written_total", download.size)
+        if self.max_size is not None and self.size() > self.max_size:
+            self.evict()
+        return self.build_response(method, url, response.status_code, response.reason, headers, stored, response.elapsed)
+
+    @staticmethod
+    def build_response(method, url, status, reason, headers, body, elapsed=timedelta(0)):
+        """Returns a requests.Response with the body read from body, a SegmentSlice, as it is consumed."""
+        response = requests.Response()
+        response.status_code = status
+        response.reason = reason
+        response.headers = CaseInsensitiveDict(headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = url
+        response.elapsed = elapsed
+        response.request = requests.Request(method, url).prepare()
+        response.raw = body
+        return response
+
+    def expired(self, recorded):
+        return self.ttl is not None and recorded < time.time() - self.ttl
+
+    def size(self):
+        """Returns the total size of the segments in bytes."""
+        return sum(os.path.getsize(self.segment_path(segment)) for segment in self.segments())
+
+    def evict(self):
+        """
+        Removes the responses older than ttl, and the oldest segments while the segments are larger than max_size.
+        The segment that is being written is never removed.
+        """
+        with self.lock:
+            if self.ttl is not None:
+                self.connection.execute("DELETE FROM responses WHERE recorded < ?", (time.time() - self.ttl,))
+
+            segments = [segment for segment in self.segments() if segment != self.segment]
+            sizes = {segment: os.path.getsize(self.segment_path(segment)) for segment in segments}
+            total = sum(sizes.values()) + (os.path.getsize(self.segment_path(self.segment)) if os.path.exists(self.segment_path(self.segment)) else 0)
+
+            for segment in segments:
+                live = self.connection.execute("SELECT 1 FROM responses WHERE segment = ? LIMIT 1", (segment,)).fetchone()
+                if live is not None and (self.max_size is None or total <= self.max_size):
+                    continue
+
+                self.connection.execute("DELETE FROM responses WHERE segment = ?", (segment,))
+                # Responses that are still being read keep their segment file open, so removing it is safe.
+                os.remove(self.segment_path(segment))
+                total -= sizes[segment]
+                METRICS.inc("cache_segments_evicted_total")
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+            self.connection.close()
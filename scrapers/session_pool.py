@@ -0,0 +1,194 @@
+import threading
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from scrapers.rate_limiter import RateLimiter, parse_retry_after
+from scrapers.metrics import METRICS
+from scrapers.response_cache import CacheMiss
+
+
+class PooledSession(requests.Session):
+    """
+    A requests session whose connections are kept alive and shared between threads.
+    At most `pool_size` connections are opened; further requests wait for a free one instead of opening a new one.
+    If a HostLimiter is given, every request waits for it and reports its outcome back to it.
+    If a ConcurrencyBudget is given, every request also takes one of its slots, with the given priority, until the response arrives.
+    Responses are counted per host and status, and their latency is timed, in METRICS.
+    If a ResponseCache is given, responses are recorded to it, or replayed from it without a request.
+    If a ProxyPool is given, every request goes through one of its proxies and reports its outcome back to it. The host
+    limiter of that proxy is then used instead of `limiter`: it is returned by proxy_limiter(proxy label).
+    """
+
+    def __init__(self, pool_size, limiter=None, budget=None, priority=0, cache=None, proxy_pool=None, proxy_limiter=None):
+        super().__init__()
+        self.limiter = limiter
+        self.budget = budget
+        self.priority = priority
+        self.cache = cache
+        self.proxy_pool = proxy_pool
+        self.proxy_limiter = proxy_limiter
+        # The proxy of the last request of each thread, so that failures found in a response body can be reported to it.
+        self.last_proxy = threading.local()
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.mount("http://", self.adapter)
+        self.mount("https://", self.adapter)
+        self.headers["Connection"] = "keep-alive"
+
+    def request(self, method, url, *args, **kwargs):
+        if self.cache is None:
+            return self._request_limited(method, url, *args, **kwargs)
+
+        # Responses are keyed by the final URL and body, the same way whether the request passes params, data or json.
+        request = requests.Request(method, url, params=kwargs.get("params"), data=kwargs.get("data"), json=kwargs.get("json")).prepare()
+        if self.cache.replaying:
+            response = self.cache.get(method, request.url, request.body)
+            if response is not None:
+                return response
+            if self.cache.offline:
+                raise CacheMiss("Not in the response cache: " + method + " " + request.url)
+
+        return self.cache.put(method, request.url, request.body, self._request_limited(method, url, *args, **kwargs))
+
+    def _request_limited(self, method, url, *args, **kwargs):
+        if self.proxy_pool is None:
+            return self._request_via(self.limiter, method, url, *args, **kwargs)
+
+        proxy = self.proxy_pool.choose(lambda proxy: self._limiter_of(proxy) is None or not self._limiter_of(proxy).blocked_for())
+        self.last_proxy.proxy = proxy
+        limiter = self._limiter_of(proxy)
+        if proxy.url is not None:
+            kwargs["proxies"] = proxy.proxies()
+
+        try:
+            response = self._request_via(limiter, method, url, *args, **kwargs)
+        except BaseException:
+            self.proxy_pool.report(proxy)
+            raise
+
+        self.proxy_pool.report(proxy, response.status_code, response.elapsed.total_seconds(), parse_retry_after(response.headers.get("Retry-After")))
+        return response
+
+    def _limiter_of(self, proxy):
+        if proxy.url is None or self.proxy_limiter is None:
+            return self.limiter
+        return self.proxy_limiter(proxy.label)
+
+    def _request_via(self, limiter, method, url, *args, **kwargs):
+        if limiter is None:
+            return self._request_within_budget(method, url, *args, **kwargs)
+
+        limiter.acquire()
+        try:
+            response = self._request_within_budget(method, url, *args, **kwargs)
+        except BaseException:
+            limiter.release()
+            raise
+
+        limiter.release(response.status_code, response.elapsed.total_seconds(), parse_retry_after(response.headers.get("Retry-After")))
+        return response
+
+    def _request_within_budget(self, method, url, *args, **kwargs):
+        # The slot is taken after the host limiter lets the request through, so waiting for a slow host does not hold a slot.
+        host = urlparse(url).netloc
+        if self.budget is None:
+            return self._send(host, method, url, *args, **kwargs)
+
+        self.budget.acquire(host, self.priority)
+        try:
+            return self._send(host, method, url, *args, **kwargs)
+        finally:
+            self.budget.release(host)
+
+    def _send(self, host, method, url, *args, **kwargs):
+        try:
+            response = super().request(method, url, *args, **kwargs)
+        except Exception as e:
+            METRICS.inc("http_errors_total", host=host, error=e.__class__.__name__)
+            raise
+
+        METRICS.inc("http_responses_total", host=host, status=response.status_code)
+        METRICS.observe("http_response_seconds", response.elapsed.total_seconds(), host=host)
+        return response
+
+    def connection_stats(self):
+        """Returns the number of requests sent and the number of connections (i.e. handshakes) opened for them."""
+        stats = {"requests": 0, "connections": 0}
+
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            stats["requests"] += pool.num_requests
+            stats["connections"] += pool.num_connections
+
+        stats["reused"] = stats["requests"] - stats["connections"]
+        return stats
+
+
+class SessionPool:
+    """
+    Keeps one PooledSession per host, so every request to the same host goes through the same keep-alive connections.
+    A scraper should create one SessionPool and send all of its requests through it.
+    Requests are rate limited per host by `rate_limiter`; pass the same RateLimiter to several pools to share the limits.
+
+    :param pool_size: Maximum number of open connections per host.
+    :param rate_limiter: RateLimiter to use. By default, each pool gets its own one.
+    :param budget: ConcurrencyBudget shared with other pools, e.g. by master_fetcher.Master. None means no global limit.
+    :param priority: Priority of this pool's requests for the budget. Higher goes first.
+    :param cache: ResponseCache (scrapers/response_cache.py) to record responses to or replay them from. None sends every request.
+    :param proxy_pool: ProxyPool (scrapers/proxy_pool.py) to spread the requests over. None sends them directly.
+    """
+
+    def __init__(self, pool_size=10, rate_limiter=None, budget=None, priority=0, cache=None, proxy_pool=None):
+        self.pool_size = pool_size
+        self.rate_limiter = rate_limiter or RateLimiter(max_concurrency=pool_size)
+        self.budget = budget
+        self.priority = priority
+        self.cache = cache
+        self.proxy_pool = proxy_pool
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def session(self, url):
+        """Returns the session for the host of the given URL, creating it on first use."""
+        host = urlparse(url).netloc
+
+        with self.lock:
+            if host not in self.sessions:
+                self.sessions[host] = PooledSession(self.pool_size, self.rate_limiter.host(url), self.budget, self.priority, self.cache,
+                                                    self.proxy_pool, lambda via, url=url: self.rate_limiter.host(url, via))
+            return self.sessions[host]
+
+    def request(self, method, url, **kwargs):
+        return self.session(url).request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def report_failure(self, url, retry_after=None):
+        """Makes the host of the URL back off after a failure that the HTTP status did not show.
+        With a proxy pool, the proxy of the last request of the calling thread to that host backs off instead."""
+        proxy = getattr(self.session(url).last_proxy, "proxy", None)
+        if proxy is not None:
+            self.proxy_pool.report_failure(proxy, retry_after)
+        self.rate_limiter.host(url, proxy.label if proxy is not None and proxy.url is not None else None).report_failure(retry_after)
+
+    def connection_stats(self):
+        """Returns connection reuse counters for each host."""
+        with self.lock:
+            sessions = dict(self.sessions)
+
+        return {host: session.connection_stats() for host, session in sessions.items()}
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions = {}
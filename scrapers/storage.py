@@ -0,0 +1,219 @@
+import json
+import os
+import threading
+import uuid
+from base64 import b64encode
+from scrapers.manifest import Manifest
+from scrapers.download import write_atomically
+from scrapers.metrics import METRICS
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class JsonFileStorage:
+    """
+    Stores each document as a JSON file in the format of README.md: output_dir/doc_name.json,
+    with the content base64 encoded inside the doc.
+    The content is base64 encoded and written chunk by chunk, and the file is renamed into place when complete.
+    The time spent encoding is reported to self.metrics as the encode stage; scrapers set it to their own scope.
+    With writer=WriteBehind(...) (scrapers/writer.py), the files are encoded and written on the writer thread instead.
+    """
+
+    def __init__(self, output_dir, writer=None):
+        self.output_dir = output_dir
+        self.writer = writer
+        self.metrics = METRICS
+        os.makedirs(output_dir, exist_ok=True)
+
+    def open_manifest(self):
+        return Manifest.open(self.output_dir)
+
+    def save(self, wrapped_doc, download, on_saved=None):
+        """Writes the wrapped doc (createdAt, updatedAt, href, doc_name, doc) with the content of the Download, and deletes the download.
+        on_saved is called once the file is in place, on the writer thread if there is a writer."""
+        # Serialize the metadata with a placeholder, then stream the encoded content in its place.
+        placeholder = "content-" + uuid.uuid4().hex
+        wrapped_doc["doc"]["content"] = placeholder
+        prefix, suffix = json.dumps(wrapped_doc, ensure_ascii=False).split('"' + placeholder + '"', 1)
+        del wrapped_doc["doc"]["content"]
+
+        def write(f):
+            f.write(prefix + '"')
+            for chunk in self.metrics.timed_iter(download.iter_base64(), "stage_seconds", total=True, stage="encode"):
+                f.write(chunk)
+            f.write('"' + suffix)
+            download.discard()
+
+        path = os.path.join(self.output_dir, wrapped_doc["doc_name"]) + ".json"
+        if self.writer is not None:
+            self.writer.write(path, write, on_commit=on_saved)
+            return
+
+        write_atomically(path, write)
+        if on_saved is not None:
+            on_saved()
+
+    def read_doc(self, doc_name):
+        """Returns the saved document in the format of README.md, or None if there is no such document."""
+        path = os.path.join(self.output_dir, doc_name) + ".json"
+        if not os.path.exists(path):
+            return None
+
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def iter_docs(self):
+        for file_name in os.listdir(self.output_dir):
+            if file_name.endswith(".json"):
+                yield self.read_doc(file_name[:-len(".json")])
+
+
+class BlobStorage:
+    """
+    Stores the raw content of each document once, in a content-addressed blob store, and its metadata in an append-only index.
+
+    * Blobs are named by the sha256 of the content and sharded into output_dir/blobs/ab/cd/<hash>, so identical
+      documents share one blob. With compress=True, blobs are zstd compressed (requires the zstandard package).
+    * Each save appends one line to output_dir/index.jsonl with the doc metadata (without content) and the blob hash.
+      The last line of a doc_name wins.
+
+    read_doc and iter_docs still return documents in the format of README.md.
+    The time spent compressing is reported to self.metrics as the encode stage.
+    """
+    INDEX_FILE_NAME = "index.jsonl"
+    BLOB_DIR_NAME = "blobs"
+    COMPRESSION_LEVEL = 3
+
+    def __init__(self, output_dir, compress=False):
+        if compress and zstandard is None:
+            raise ImportError("zstandard package is required for compressed blob storage.")
+
+        self.output_dir = output_dir
+        self.compress = compress
+        self.blob_dir = os.path.join(output_dir, self.BLOB_DIR_NAME)
+        self.index_path = os.path.join(output_dir, self.INDEX_FILE_NAME)
+        self.lock = threading.Lock()
+        self.stats = {"blobs_written": 0, "blobs_deduplicated": 0}
+        self.metrics = METRICS
+
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self.records = self._load_index()
+        self.index_file = open(self.index_path, "a", encoding="utf-8")
+
+    def _load_index(self):
+        records = {}
+        if not os.path.exists(self.index_path):
+            return records
+
+        with open(self.index_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn last line after a crash.
+                    continue
+                records[record["doc_name"]] = record
+        return records
+
+    def open_manifest(self):
+        """Opens the manifest of the output directory. If there is none yet, builds it from the index."""
+        path = os.path.join(self.output_dir, Manifest.FILE_NAME)
+        is_new = not os.path.exists(path)
+
+        manifest = Manifest(path)
+        if is_new:
+            for record in self.records.values():
+                manifest.put(record["doc_name"], record["blob"], record["size"], record["href"], record["createdAt"], record["updatedAt"])
+        return manifest
+
+    def blob_path(self, blob_hash):
+        path = os.path.join(self.blob_dir, blob_hash[:2], blob_hash[2:4], blob_hash)
+        return path + ".zst" if self.compress else path
+
+    def _find_blob(self, blob_hash):
+        # Blobs written with the other compression setting are reused as well.
+        path = os.path.join(self.blob_dir, blob_hash[:2], blob_hash[2:4], blob_hash)
+        for candidate in (path, path + ".zst"):
+            if os.path.exists(candidate):
+                return candidate
+        return None
+
+    def put_blob(self, download):
+        """Moves the content of the Download into the blob store unless an identical blob exists, and returns its hash."""
+        blob_hash = download.content_hash
+
+        if self._find_blob(blob_hash) is not None:
+            download.discard()
+            self.stats["blobs_deduplicated"] += 1
+            return blob_hash
+
+        path = self.blob_path(blob_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        if self.compress:
+            def write(f):
+                with zstandard.ZstdCompressor(level=self.COMPRESSION_LEVEL).stream_writer(f, size=download.size, closefd=False) as writer:
+                    for chunk in download.iter_chunks():
+                        writer.write(chunk)
+
+            with self.metrics.timer("stage_seconds", stage="encode"):
+                write_atomically(path, write, mode="wb")
+            download.discard()
+        else:
+            # The download is already a complete file on the same file system, so it can simply be renamed.
+            download.move_to(path)
+
+        self.stats["blobs_written"] += 1
+        return blob_hash
+
+    def get_blob(self, blob_hash):
+        path = self._find_blob(blob_hash)
+        if path is None:
+            return None
+
+        with open(path, "rb") as f:
+            if path.endswith(".zst"):
+                return zstandard.ZstdDecompressor().stream_reader(f).read()
+            return f.read()
+
+    def save(self, wrapped_doc, download, on_saved=None):
+        """Stores the content of the Download as a blob and appends the wrapped doc (without content) to the index, then calls on_saved."""
+        blob_hash = self.put_blob(download)
+
+        record = dict(wrapped_doc, blob=blob_hash, size=download.size)
+        record["doc"] = {key: value for key, value in wrapped_doc["doc"].items() if key != "content"}
+
+        with self.lock:
+            self.index_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.index_file.flush()
+            self.records[record["doc_name"]] = record
+
+        if on_saved is not None:
+            on_saved()
+
+    def read_doc(self, doc_name):
+        """Returns the saved document in the format of README.md, or None if there is no such document."""
+        record = self.records.get(doc_name)
+        if record is None:
+            return None
+
+        content = self.get_blob(record["blob"])
+        if content is None:
+            return None
+
+        wrapped_doc = {key: value for key, value in record.items() if key not in ("blob", "size")}
+        wrapped_doc["doc"] = dict(record["doc"], content=b64encode(content).decode('ascii'))
+        return wrapped_doc
+
+    def iter_docs(self):
+        for doc_name in list(self.records):
+            wrapped_doc = self.read_doc(doc_name)
+            if wrapped_doc is not None:
+                yield wrapped_doc
+
+    def close(self):
+        with self.lock:
+            self.index_file.close()
@@ -1,68 +1,90 @@
 from scrapers.abstract_scaper import AbstractScraper
-import requests
-from bs4 import BeautifulSoup
+from scrapers.html_parser import ElementFilter
+from functools import partial
 from pathlib import Path
 
 
 class UyusmazlikScaper(AbstractScraper):
-    def __init__(self, output_path):
-        super().__init__("https://kararlar.uyusmazlik.gov.tr/", 1, output_path)
+    # parse_page only looks at the cells of the grid, and get_max_page_count at the page input.
+    GRID_CELLS = ElementFilter("div", "data-content")
+    PAGE_INPUT = ElementFilter("input", class_name="pageInput")
+    BASE_URL = "https://kararlar.uyusmazlik.gov.tr/"
+    # The grid is ordered by KararSayisi, descending.
+    LISTS_NEWEST_FIRST = True
+    DOCS_PER_PAGE = 10
+
+    def __init__(self, output_path, base_url=BASE_URL, **kwargs):
+        super().__init__(base_url, 1, output_path, **kwargs)
 
         Path(output_path).mkdir(parents=True, exist_ok=True)
 
         
     def get_next_page(self):
-        """A generator of pages, returning the soup object of the next page."""        
+        """A generator of pages, returning the raw html of the next page. It is parsed by parse_page, or in a ParsePool."""
 
         search_url = "Arama/_Grid?ExcludeGerekce=False&OrderCol=KararSayisi&OrderAsc=False&WordsOnly=False&page="
 
         while self.current_page_count <= self.max_page_count:
-            page = requests.get(self.base_url + search_url + str(self.current_page_count), verify=False)
-            soup = BeautifulSoup(page.content, 'html.parser')
-            yield soup
+            page = self.sessions.get(self.base_url + search_url + str(self.current_page_count), verify=False)
+            yield page.content
             self.current_page_count += 1
 
     def get_max_page_count(self):
-        page = requests.get(self.base_url, verify=False)
-        soup = BeautifulSoup(page.content, 'html.parser')
-        input_tag = soup.find('input', {'class': 'pageInput'})
-        return input_tag.get('data-max')
+        page = self.sessions.get(self.base_url, verify=False)
+        return self.html_parser.select_attributes(page.content, self.PAGE_INPUT, 'data-max')[0]
     
     def parse_doc_name(self, single_doc):
         """Accepts a single document (a dictionary) and returns the name of the document."""
         return (single_doc["karar_sayisi"] + "_" + single_doc["esas_sayisi"]).replace("/", "-")
     
+    def page_parser(self):
+        return partial(parse_grid_page, self.html_parser)
+
     def parse_page(self, page):
-        """Accepts the return value of get_next_page function (BeautifulSoup object). Parses it into the metadata and 
+        """Accepts the return value of get_next_page function (raw html), or its BeautifulSoup object. Parses it into the metadata and 
         document urls.
         
         Note: href is a must have field. If it is not present, the document will be skipped."""
-        results = []
+        if isinstance(page, bytes):
+            page = self.html_parser.soup(page, self.GRID_CELLS)
+        return parse_grid(page)
+
+
+def parse_grid_page(html_parser, content):
+    """Parses the raw html of a grid page with the given parser. It is module level, so that it can run in a ParsePool."""
+    docs = parse_grid(html_parser.soup(content, UyusmazlikScaper.GRID_CELLS))
+    # The strings of the soup hold on to the whole tree, which would be pickled along with them.
+    return [{key: str(value) if value is not None else None for key, value in doc.items()} for doc in docs]
+
+
+def parse_grid(page):
+    """Parses the BeautifulSoup object of a grid page into docs."""
+    results = []
 
-        docs = page.findAll("div", {"data-content": True})
-        i = 0
+    docs = page.findAll("div", {"data-content": True})
+    i = 0
 
-        while i < len(docs):
-            single_doc = {}
-            single_doc["data_content"] = docs[i]['data-content'].strip()
-            single_doc["href"] = docs[i].find('a')['href']
-            single_doc["karar_sayisi"] = docs[i].find('a').string
+    while i < len(docs):
+        single_doc = {}
+        single_doc["data_content"] = docs[i]['data-content'].strip()
+        single_doc["href"] = docs[i].find('a')['href']
+        single_doc["karar_sayisi"] = docs[i].find('a').string
 
-            i += 1
-            single_doc["esas_sayisi"] = docs[i].find('a').string
+        i += 1
+        single_doc["esas_sayisi"] = docs[i].find('a').string
 
-            i += 1
-            single_doc["bolum"] = docs[i].find('a').string
+        i += 1
+        single_doc["bolum"] = docs[i].find('a').string
 
-            i += 1
-            single_doc["uyusmazlik"] = docs[i].find('a').string
+        i += 1
+        single_doc["uyusmazlik"] = docs[i].find('a').string
 
-            i+= 1
-            single_doc["karar_sonucu"] = docs[i].find('a').string
+        i+= 1
+        single_doc["karar_sonucu"] = docs[i].find('a').string
 
-            i+= 1
-            results.append(single_doc)
-        return results
+        i+= 1
+        results.append(single_doc)
+    return results
     
 
 #what is a page?
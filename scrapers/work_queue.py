@@ -0,0 +1,108 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+Lease = namedtuple("Lease", ["id", "name", "start", "end"])
+
+
+def default_worker_id():
+    """Identifies the calling thread across machines: host name, process id and thread id."""
+    return socket.gethostname() + "-" + str(os.getpid()) + "-" + str(threading.get_ident())
+
+
+class PageRangeQueue:
+    """
+    Lease-based work queue of page ranges, stored in a SQLite file.
+
+    A crawl of pages [start, end) is split into small ranges. Each worker claims a range, which leases it for
+    lease_seconds, renews the lease while it works on it and completes it when it is done. A range whose lease
+    expired (e.g. its worker crashed or got stuck) is claimed by the next idle worker. Slow ranges therefore
+    never leave other workers idle, and adding workers adds throughput. A range that is released with a delay (e.g. because
+    some of its pages failed) is claimed again once the delay has passed.
+
+    Workers can be threads, processes or machines, as long as they open the same file. Across machines the file
+    must be on a shared volume with working file locks, and the clocks must be roughly in sync.
+
+    :param path: Path of the SQLite file.
+    :param lease_seconds: How long a claim is valid without being renewed.
+    """
+    DEFAULT_RANGE_SIZE = 50
+
+    def __init__(self, path, lease_seconds=300):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS ranges ("
+            "id INTEGER PRIMARY KEY, name TEXT, start INTEGER, end INTEGER, owner TEXT, lease_expires REAL, "
+            "done INTEGER DEFAULT 0, attempts INTEGER DEFAULT 0, UNIQUE (name, start))"
+        )
+
+    def add_ranges(self, name, start, end, range_size=DEFAULT_RANGE_SIZE):
+        """
+        Splits pages [start, end) of the crawl with the given name into ranges of range_size pages and adds them.
+        Ranges that were added before are left as they are, so every worker can call this safely.
+        """
+        ranges = [(name, s, min(s + range_size, end)) for s in range(start, end, range_size)]
+
+        with self.lock:
+            self.connection.executemany("INSERT OR IGNORE INTO ranges (name, start, end) VALUES (?, ?, ?)", ranges)
+
+    def claim(self, name, worker):
+        """Leases the first range that is neither done nor leased, and returns it as a Lease. Returns None if there is none."""
+        now = time.time()
+
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute(
+                    "SELECT id, name, start, end FROM ranges WHERE name = ? AND done = 0 "
+                    "AND (lease_expires IS NULL OR lease_expires < ?) ORDER BY start LIMIT 1",
+                    (name, now),
+                ).fetchone()
+
+                if row is not None:
+                    self.connection.execute(
+                        "UPDATE ranges SET owner = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+                        (worker, now + self.lease_seconds, row[0]),
+                    )
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+
+        return Lease(*row) if row is not None else None
+
+    def renew(self, lease, worker):
+        """Extends the lease. Returns False if the lease expired and another worker took the range over."""
+        with self.lock:
+            cursor = self.connection.execute(
+                "UPDATE ranges SET lease_expires = ? WHERE id = ? AND owner = ? AND done = 0",
+                (time.time() + self.lease_seconds, lease.id, worker),
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, lease, worker):
+        with self.lock:
+            self.connection.execute("UPDATE ranges SET done = 1 WHERE id = ? AND owner = ?", (lease.id, worker))
+
+    def release(self, lease, worker, delay=None):
+        """Gives the range back unfinished, so that another worker can claim it right away, or after delay seconds."""
+        with self.lock:
+            self.connection.execute("UPDATE ranges SET owner = NULL, lease_expires = ? WHERE id = ? AND owner = ? AND done = 0",
+                                    (time.time() + delay if delay else None, lease.id, worker))
+
+    def progress(self, name):
+        """Returns the number of done, leased and pending ranges of the crawl."""
+        with self.lock:
+            done, total, leased = self.connection.execute(
+                "SELECT COALESCE(SUM(done), 0), COUNT(*), COALESCE(SUM(done = 0 AND owner IS NOT NULL AND lease_expires >= ?), 0) FROM ranges WHERE name = ?",
+                (time.time(), name),
+            ).fetchone()
+
+        return {"done": done, "leased": leased, "pending": total - done - leased}
@@ -0,0 +1,211 @@
+import atexit
+import os
+import queue
+import signal
+import tempfile
+import threading
+import time
+from scrapers.download import FILE_MODE
+from scrapers.metrics import METRICS
+
+# Queued by close, after the last write.
+_STOP = object()
+
+
+def fsync_directory(directory):
+    """Makes the renames into the directory durable."""
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class _Write:
+    __slots__ = ("path", "write", "mode", "encoding", "on_commit", "file", "temp_path")
+
+    def __init__(self, path, write, mode, encoding, on_commit):
+        self.path = path
+        self.write = write
+        self.mode = mode
+        self.encoding = encoding
+        self.on_commit = on_commit
+        self.file = None
+        self.temp_path = None
+
+
+class WriteBehind:
+    """
+    Writes files on a background thread, so that the crawl threads (or the gevent hub) never wait for the disk.
+
+    * write queues a file and returns. At most `queue_size` files wait for the writer; beyond that, write blocks,
+      so a crawl that is faster than the disk slows down instead of filling the memory.
+    * Each file is written to a temporary file next to its path, fsync'ed and renamed into place, so readers see either
+      the old file or the complete new one. Directories are created once and remembered.
+    * fsyncs are group committed: the writer keeps writing the files that come in, and every `fsync_interval` seconds
+      (or after `max_batch` files) fsyncs them all, renames them into place and fsyncs their directories once.
+      With fsync_interval=0, it commits whenever the queue runs empty. With fsync_interval=None, files are not fsync'ed
+      and are renamed into place as soon as they are written.
+    * The on_commit callback of a write runs on the writer thread once the file is in place (and durable), so scrapers
+      record files in their manifests only once they are saved.
+
+    flush waits until everything queued so far is committed. Scrapers flush before they write a checkpoint, so a checkpoint
+    never covers a document that is not on disk yet. The writer is closed (and flushed) at exit, also after SIGTERM:
+    if the process has no SIGTERM handler, one is installed that exits normally. A write that fails is not committed;
+    the next flush raises its error. A writer can be shared by several scrapers.
+
+    :param queue_size: Maximum number of files waiting for the writer.
+    :param fsync_interval: Maximum number of seconds a written file waits to be committed, or None to not fsync.
+    :param max_batch: Maximum number of files committed together. Each one holds an open file until it is committed.
+    """
+
+    def __init__(self, queue_size=256, fsync_interval=1.0, max_batch=128, metrics=METRICS):
+        self.queue = queue.Queue(queue_size)
+        self.fsync_interval = fsync_interval
+        self.max_batch = max_batch
+        self.metrics = metrics
+        self.directories = set()
+        self.errors = []
+        self.lock = threading.Lock()
+        self.closed = False
+        self.metrics.set_gauge("queue_depth", self.queue.qsize, queue="write")
+
+        self.thread = threading.Thread(target=self._run, name="WriteBehind", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+        exit_on_sigterm()
+
+    def write(self, path, write, mode="w", encoding="utf-8", on_commit=None):
+        """Queues a file like write_atomically: write(f) is called with the temporary file, on the writer thread."""
+        if self.closed:
+            raise RuntimeError("WriteBehind is closed")
+        self.queue.put(_Write(path, write, mode, encoding if "b" not in mode else None, on_commit))
+
+    def flush(self):
+        """Waits until every file queued so far is committed. Raises the error of a write that failed since the last flush."""
+        if self.thread.is_alive():
+            done = threading.Event()
+            self.queue.put(done)
+            done.wait()
+
+        with self.lock:
+            errors, self.errors = self.errors, []
+        if errors:
+            raise errors[0]
+
+    def close(self):
+        """Commits the queued files and stops the writer."""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+
+        self.queue.put(_STOP)
+        self.thread.join()
+
+    def _run(self):
+        written = []
+        deadline = None
+
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, _Write):
+                if self._write(item) and self.fsync_interval is not None:
+                    written.append(item)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.fsync_interval
+                # Commit when the interval is up, the batch is full, or with fsync_interval=0, once nothing else is queued.
+                if len(written) < self.max_batch and (deadline is None or time.monotonic() < deadline or not self.queue.empty()):
+                    continue
+
+            self._commit(written)
+            written = []
+            deadline = None
+
+            if item is _STOP:
+                return
+            if isinstance(item, threading.Event):
+                item.set()
+
+    def _write(self, item):
+        """Writes the item to a temporary file. Without fsync, also renames it into place. Returns whether it was written."""
+        directory = os.path.dirname(item.path) or "."
+        try:
+            if directory not in self.directories:
+                os.makedirs(directory, exist_ok=True)
+                self.directories.add(directory)
+
+            fd, item.temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            os.chmod(item.temp_path, FILE_MODE)
+            item.file = os.fdopen(fd, item.mode, encoding=item.encoding)
+            item.write(item.file)
+            item.file.flush()
+
+            if self.fsync_interval is None:
+                item.file.close()
+                os.replace(item.temp_path, item.path)
+                self._committed(item)
+        except Exception as e:
+            self._failed(item, e)
+            return False
+        return True
+
+    def _commit(self, written):
+        if not written:
+            return
+
+        directories = set()
+        with self.metrics.timer("stage_seconds", stage="fsync"):
+            committed = []
+            for item in written:
+                try:
+                    os.fsync(item.file.fileno())
+                    item.file.close()
+                    os.replace(item.temp_path, item.path)
+                except Exception as e:
+                    self._failed(item, e)
+                    continue
+                directories.add(os.path.dirname(item.path) or ".")
+                committed.append(item)
+
+            for directory in directories:
+                fsync_directory(directory)
+
+        self.metrics.inc("write_batches_total")
+        for item in committed:
+            self._committed(item)
+
+    def _committed(self, item):
+        self.metrics.inc("files_written_total")
+        if item.on_commit is None:
+            return
+        try:
+            item.on_commit()
+        except Exception as e:
+            self._failed(item, e)
+
+    def _failed(self, item, error):
+        if item.file is not None and not item.file.closed:
+            item.file.close()
+        if item.temp_path is not None and os.path.exists(item.temp_path):
+            os.remove(item.temp_path)
+
+        self.metrics.inc("errors_total", stage="write")
+        with self.lock:
+            self.errors.append(error)
+
+
+def _exit(signum, frame):
+    raise SystemExit(128 + signum)
+
+
+def exit_on_sigterm():
+    """Makes SIGTERM exit the process normally, so that finally blocks and atexit handlers (such as WriteBehind.close) run.
+    Only if the process has no SIGTERM handler yet; Master.run installs its own, which stops the scrapers gracefully."""
+    if threading.current_thread() is threading.main_thread() and signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+        signal.signal(signal.SIGTERM, _exit)
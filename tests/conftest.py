@@ -0,0 +1,53 @@
+import logging
+import os
+import sys
+from contextlib import contextmanager
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_sites import MockSite, SiteConfig
+from scrapers.abstract_scaper import AbstractScraper
+from scrapers.logs import LOGGER_NAME
+from scrapers.rate_limiter import HostLimiter, RateLimiter
+from scrapers.session_pool import SessionPool
+
+
+@pytest.fixture(autouse=True)
+def quiet_logs():
+    logger = logging.getLogger(LOGGER_NAME)
+    level = logger.level
+    logger.setLevel(logging.WARNING)
+    yield
+    logger.setLevel(level)
+
+
+@pytest.fixture
+def fast_retries(monkeypatch):
+    """Shortens the host backoff and the dead-letter delays, so that failures are retried within the test."""
+    monkeypatch.setattr(HostLimiter, "INITIAL_BACKOFF", 0.01)
+    monkeypatch.setattr(HostLimiter, "MAX_BACKOFF", 0.05)
+    monkeypatch.setattr(AbstractScraper, "RETRY_BASE_DELAY", 0.05)
+    monkeypatch.setattr(AbstractScraper, "RETRY_MAX_DELAY", 0.2)
+
+
+@pytest.fixture
+def mock_site():
+    """Returns a context manager that serves a stand-in site of benchmarks/mock_sites.py, e.g. mock_site("uyusmazlik", doc_count=100)."""
+    @contextmanager
+    def serve(site, **config):
+        with MockSite(site, SiteConfig(**dict({"doc_size": 2000, "doc_count": 100}, **config))) as mock:
+            yield mock
+    return serve
+
+
+def session_pool(**kwargs):
+    """A session pool whose rate limiter starts fast enough to measure the scrapers rather than the limiter."""
+    rate_limiter = RateLimiter(rate=1000.0, max_rate=1000.0, concurrency=8, max_concurrency=8)
+    return SessionPool(pool_size=8, rate_limiter=rate_limiter, **kwargs)
+
+
+@pytest.fixture
+def sessions():
+    return session_pool
@@ -0,0 +1,52 @@
+import os
+
+import pytest
+
+from scrapers.checkpoint import Checkpoint
+from scrapers.uyusmazlik_scraper import UyusmazlikScaper
+
+
+class StoppingScraper(UyusmazlikScaper):
+    """Stops the crawl after stop_after docs were processed, like Master does on SIGTERM."""
+    stop_after = None
+
+    def process_doc(self, doc, content):
+        super().process_doc(doc, content)
+        self.processed = getattr(self, "processed", 0) + 1
+        if self.processed == self.stop_after:
+            self.stop()
+
+
+@pytest.mark.parametrize("stop_after", [107, 152, 203])
+def test_stop_in_the_middle_of_a_page_then_resume(tmp_path, mock_site, sessions, stop_after):
+    output_dir = str(tmp_path / "uyusmazlik")
+
+    with mock_site("uyusmazlik", doc_count=400) as site:
+        scraper = StoppingScraper(output_dir, base_url=site.url, session_pool=sessions())
+        # Pages hold 10 docs, so the crawl is stopped in the middle of a page.
+        scraper.stop_after = stop_after
+        scraper.scrape()
+
+        checkpoint = Checkpoint.load(os.path.join(output_dir, Checkpoint.FILE_NAME))
+        assert checkpoint.can_resume()
+        # Every doc of a committed page is saved.
+        assert len(scraper.manifest) >= checkpoint.committed_page * 10
+
+        resumed = UyusmazlikScaper(output_dir, base_url=site.url, session_pool=sessions(), resume=True)
+        assert resumed.current_page_count == checkpoint.committed_page + 1
+        resumed.scrape()
+
+    assert len(resumed.manifest) == 400
+    assert Checkpoint.load(os.path.join(output_dir, Checkpoint.FILE_NAME)).complete
+
+
+def test_completed_crawl_is_not_resumed(tmp_path, mock_site, sessions):
+    output_dir = str(tmp_path / "uyusmazlik")
+
+    with mock_site("uyusmazlik", doc_count=30) as site:
+        UyusmazlikScaper(output_dir, base_url=site.url, session_pool=sessions()).scrape()
+        resumed = UyusmazlikScaper(output_dir, base_url=site.url, session_pool=sessions(), resume=True)
+
+    assert not resumed.resuming
+    assert resumed.current_page_count == 1
+    assert len(resumed.manifest) == 30
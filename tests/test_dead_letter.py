@@ -0,0 +1,118 @@
+import json
+import os
+import threading
+from collections import Counter
+
+from scrapers.abstract_scaper import AbstractScraper
+from scrapers.dead_letter import DeadLetterQueue, PENDING, DEAD, RECOVERED
+from scrapers.uyusmazlik_scraper import UyusmazlikScaper
+
+
+class FailingDocScraper(UyusmazlikScaper):
+    """Fails the first `failures` requests of the docs in failing_ids, and counts the requests of every doc."""
+    failing_ids = ()
+    failures = 1
+    stop_after = None
+
+    def __init__(self, *args, **kwargs):
+        self.lock = threading.Lock()
+        self.requested = Counter()
+        super().__init__(*args, **kwargs)
+
+    def request_doc(self, url):
+        with self.lock:
+            self.requested[url] += 1
+            failed = int(url.split("=")[1]) in self.failing_ids and self.requested[url] <= self.failures
+        if failed:
+            return self.on_error(url, "HTTP 503")
+        return super().request_doc(url)
+
+    def process_doc(self, doc, content):
+        super().process_doc(doc, content)
+        self.processed = getattr(self, "processed", 0) + 1
+        if self.processed == self.stop_after:
+            self.stop()
+
+
+def read_report(output_dir):
+    with open(os.path.join(output_dir, AbstractScraper.DEAD_LETTER_REPORT_FILE_NAME)) as f:
+        return json.load(f)
+
+
+def test_letter_is_retried_until_it_is_dead(tmp_path):
+    queue = DeadLetterQueue(str(tmp_path / DeadLetterQueue.FILE_NAME), max_attempts=3, base_delay=0, max_delay=0)
+    assert queue.add("a", {"href": "a"}, "HTTP 503") == PENDING
+    assert queue.due() == [("a", {"href": "a"})]
+    assert queue.fail("a", "HTTP 503") == PENDING
+    assert queue.fail("a", "HTTP 500") == DEAD
+    assert queue.due() == []
+
+    report = queue.report()
+    assert report["counts"] == {PENDING: 0, DEAD: 1, RECOVERED: 0}
+    assert report["letters"][0]["attempts"] == 3 and report["letters"][0]["last_error"] == "HTTP 500"
+
+
+def test_letters_persist(tmp_path):
+    path = str(tmp_path / DeadLetterQueue.FILE_NAME)
+    queue = DeadLetterQueue(path, base_delay=60)
+    queue.add("a", {"href": "a"}, "HTTP 503")
+    queue.close()
+
+    reopened = DeadLetterQueue(path, base_delay=60)
+    assert reopened.status("a") == PENDING
+    assert reopened.due() == []
+    assert 60 <= reopened.next_due_in() <= 90
+    reopened.recover("a")
+    assert reopened.status("a") == RECOVERED and reopened.next_due_in() is None
+
+
+def test_failed_docs_are_recovered_during_the_crawl(tmp_path, mock_site, sessions, fast_retries):
+    output_dir = str(tmp_path / "uyusmazlik")
+    with mock_site("uyusmazlik", doc_count=50) as site:
+        scraper = FailingDocScraper(output_dir, base_url=site.url, session_pool=sessions())
+        scraper.failing_ids = (3, 17, 42)
+        scraper.scrape()
+
+    assert len(scraper.manifest) == 50
+    assert read_report(output_dir)["counts"] == {PENDING: 0, DEAD: 0, RECOVERED: 3}
+
+
+def test_docs_that_keep_failing_are_dead(tmp_path, mock_site, sessions, fast_retries, monkeypatch):
+    monkeypatch.setattr(FailingDocScraper, "MAX_RETRIES", 2)
+    output_dir = str(tmp_path / "uyusmazlik")
+    with mock_site("uyusmazlik", doc_count=20) as site:
+        scraper = FailingDocScraper(output_dir, base_url=site.url, session_pool=sessions())
+        scraper.failing_ids = (5,)
+        scraper.failures = 100
+        scraper.scrape()
+
+    report = read_report(output_dir)
+    assert len(scraper.manifest) == 19
+    assert report["counts"] == {PENDING: 0, DEAD: 1, RECOVERED: 0}
+    assert report["letters"][0]["key"] == "Karar/Getir?id=5"
+    assert report["letters"][0]["attempts"] == 3
+    assert scraper.requested["Karar/Getir?id=5"] == 3
+
+
+def test_resumed_crawl_replays_pending_letters(tmp_path, mock_site, sessions, fast_retries, monkeypatch):
+    output_dir = str(tmp_path / "uyusmazlik")
+    with mock_site("uyusmazlik", doc_count=100) as site:
+        # Slow retries, so that the letters are still pending when the crawl is stopped.
+        monkeypatch.setattr(FailingDocScraper, "RETRY_BASE_DELAY", 1.0)
+        scraper = FailingDocScraper(output_dir, base_url=site.url, session_pool=sessions())
+        scraper.failing_ids = (3, 15)
+        scraper.failures = 100
+        scraper.stop_after = 30
+        scraper.scrape()
+        assert read_report(output_dir)["counts"][PENDING] == 2
+
+        monkeypatch.setattr(FailingDocScraper, "RETRY_BASE_DELAY", 0.05)
+        resumed = FailingDocScraper(output_dir, base_url=site.url, session_pool=sessions(), resume=True)
+        assert resumed.resuming
+        resumed.scrape()
+
+    assert len(resumed.manifest) == 100
+    assert read_report(output_dir)["counts"] == {PENDING: 0, DEAD: 0, RECOVERED: 2}
+    # The pending docs are retried by the dead-letter retrier, not fetched again by the crawl as well.
+    assert resumed.requested["Karar/Getir?id=3"] == 1
+    assert resumed.requested["Karar/Getir?id=15"] == 1
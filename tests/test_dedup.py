@@ -0,0 +1,104 @@
+import os
+import threading
+
+from scrapers.dedup import SeenSet, InFlightRegistry, OWNER, SEEN, IN_FLIGHT
+from scrapers.uyusmazlik_scraper import UyusmazlikScaper
+
+
+class ShiftingScraper(UyusmazlikScaper):
+    """Lists every page twice, like a listing whose pagination shifts by a whole page while it is crawled, and counts the doc requests."""
+
+    def get_next_page(self):
+        for page in super().get_next_page():
+            yield page
+            yield page
+
+    def request_doc(self, url):
+        with self.requests_lock:
+            self.requested.append(url)
+        return super().request_doc(url)
+
+
+def shifting_scraper(output_dir, **kwargs):
+    scraper = ShiftingScraper(output_dir, **kwargs)
+    scraper.requests_lock = threading.Lock()
+    scraper.requested = []
+    return scraper
+
+
+def test_seen_set_persists_and_clears(tmp_path):
+    path = str(tmp_path / "seen.bloom")
+    seen = SeenSet(path, capacity=1000)
+    assert seen.add("a")
+    assert not seen.add("a")
+    assert "a" in seen and "b" not in seen
+    seen.close()
+
+    reopened = SeenSet(path, capacity=1000)
+    assert "a" in reopened and len(reopened) == 1
+    reopened.clear()
+    assert "a" not in reopened and len(reopened) == 0
+    reopened.close()
+
+
+def test_seen_set_is_sized_for_its_capacity(tmp_path):
+    small = SeenSet(str(tmp_path / "small.bloom"), capacity=50_000)
+    large = SeenSet(str(tmp_path / "large.bloom"), capacity=5_000_000)
+    assert os.path.getsize(small.path) < 100_000
+    assert os.path.getsize(large.path) > 8_000_000
+
+    # A new crawl resizes the filter it clears, and the file of an existing filter is kept at its size.
+    large.clear(50_000)
+    assert os.path.getsize(large.path) == os.path.getsize(small.path)
+    large.close()
+    small.close()
+    assert SeenSet(str(tmp_path / "large.bloom"), capacity=5_000_000).size == small.size
+
+
+def test_in_flight_registry_shares_a_download():
+    registry = InFlightRegistry()
+    assert registry.claim("url") == (OWNER, None)
+
+    state, event = registry.claim("url")
+    assert state == IN_FLIGHT and not event.is_set()
+
+    registry.finish("url", fetched=True)
+    assert event.is_set()
+    assert registry.claim("url") == (SEEN, None)
+
+    # Once released, the caller's seen check decides.
+    registry.release("url")
+    assert registry.claim("url", seen=lambda url: True) == (SEEN, None)
+    assert registry.claim("url", seen=lambda url: False) == (OWNER, None)
+
+
+def test_failed_download_is_claimed_again():
+    registry = InFlightRegistry()
+    registry.claim("url")
+    state, event = registry.claim("url")
+    registry.finish("url", fetched=False)
+
+    assert event.is_set()
+    assert registry.claim("url") == (OWNER, None)
+
+
+def test_hrefs_listed_twice_are_fetched_once(tmp_path, mock_site, sessions):
+    with mock_site("uyusmazlik", doc_count=100) as site:
+        scraper = shifting_scraper(str(tmp_path / "uyusmazlik"), base_url=site.url, session_pool=sessions())
+        scraper.scrape()
+
+    assert len(scraper.requested) == 100
+    assert len(set(scraper.requested)) == 100
+    assert len(scraper.manifest) == 100
+    # The filter is sized for the 10 listed pages, not for the default capacity.
+    assert os.path.getsize(os.path.join(scraper.output_dir, UyusmazlikScaper.SEEN_SET_FILE_NAME)) < 100_000
+
+
+def test_new_crawl_fetches_everything_again(tmp_path, mock_site, sessions):
+    output_dir = str(tmp_path / "uyusmazlik")
+    with mock_site("uyusmazlik", doc_count=30) as site:
+        shifting_scraper(output_dir, base_url=site.url, session_pool=sessions()).scrape()
+        again = shifting_scraper(output_dir, base_url=site.url, session_pool=sessions())
+        again.scrape()
+
+    assert len(again.requested) == 30
@@ -0,0 +1,65 @@
+import pytest
+import requests
+
+from scrapers.html_parser import ElementFilter, get_parser
+from scrapers.uyusmazlik_scraper import UyusmazlikScaper, parse_grid, parse_grid_page
+
+BACKENDS = ["html.parser", "lxml", "selectolax"]
+
+MULTI_CLASS = b"""<html><body>
+<form><input class="pageInput form-control" type="text" data-max="7"/><input class="form-control" data-max="1"/></form>
+<div class="grid">
+  <div class="col" data-content="Karar 1"><a href="Karar/Getir?id=1">2020/1</a></div>
+  <div class="col extra" data-content="Karar 1"><a href="Karar/Getir?id=1">2019/1</a>
+    <div data-content="nested"><a href="#">inner</a></div></div>
+  <span class="pageInputs" data-max="9"></span><input class="xpageInput" data-max="3"/>
+  <input class="a pageInput" data-max="8"/><input class="pageInput" />
+</div></body></html>"""
+
+FILTERS = [
+    UyusmazlikScaper.PAGE_INPUT,
+    UyusmazlikScaper.GRID_CELLS,
+    ElementFilter("input", class_name="form-control"),
+    ElementFilter("div", "data-content", class_name="extra"),
+]
+
+
+@pytest.fixture(scope="module")
+def pages():
+    """The home page and a grid page of the stand-in Uyusmazlik site, and a page with multi-class elements."""
+    from benchmarks.mock_sites import MockSite, SiteConfig
+
+    with MockSite("uyusmazlik", SiteConfig(doc_count=25)) as site:
+        home = requests.get(site.url).content
+        grid = requests.get(site.url + "Arama/_Grid?page=2").content
+    return {"home": home, "grid": grid, "multi_class": MULTI_CLASS}
+
+
+def parse_all(parser, content):
+    result = {}
+    for only in FILTERS:
+        result[only] = {
+            "attributes": parser.select_attributes(content, only, "data-max"),
+            "elements": [str(element) for element in parser.soup(content, only).find_all(only.tag)],
+        }
+    return result
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("page", ["home", "grid", "multi_class"])
+def test_backends_agree(pages, backend, page):
+    assert parse_all(get_parser(backend), pages[page]) == parse_all(get_parser("html.parser"), pages[page])
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_page_input_matches_one_of_several_classes(backend):
+    assert get_parser(backend).select_attributes(MULTI_CLASS, UyusmazlikScaper.PAGE_INPUT, "data-max") == ["7", "8", None]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_grid_docs_are_the_same_with_every_backend(pages, backend):
+    parser = get_parser(backend)
+    docs = parse_grid(parser.soup(pages["grid"], UyusmazlikScaper.GRID_CELLS))
+
+    assert [doc["href"] for doc in docs] == ["Karar/Getir?id=%d" % number for number in range(10, 20)]
+    assert docs == parse_grid_page(get_parser("html.parser"), pages["grid"])
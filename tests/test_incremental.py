@@ -0,0 +1,65 @@
+import os
+import threading
+from collections import Counter
+
+from scrapers.uyusmazlik_scraper import UyusmazlikScaper
+
+
+def counting(sessions):
+    """Counts the requests sent to the documents by method, e.g. requests["HEAD"]."""
+    lock = threading.Lock()
+    request = sessions.request
+    sessions.requests = Counter()
+
+    def count(method, url, **kwargs):
+        if "/Karar/Getir" in url:
+            with lock:
+                sessions.requests[method] += 1
+        return request(method, url, **kwargs)
+
+    sessions.request = count
+    return sessions
+
+
+def saved_files(output_dir):
+    return {name: os.stat(os.path.join(output_dir, name)).st_mtime_ns
+            for name in os.listdir(output_dir) if not name.startswith(".")}
+
+
+def test_unchanged_docs_are_checked_with_head_requests(tmp_path, mock_site, sessions):
+    output_dir = str(tmp_path / "uyusmazlik")
+
+    with mock_site("uyusmazlik", doc_count=100) as site:
+        UyusmazlikScaper(output_dir, base_url=site.url, session_pool=sessions()).scrape()
+        saved = saved_files(output_dir)
+
+        pool = counting(sessions())
+        scraper = UyusmazlikScaper(output_dir, base_url=site.url, session_pool=pool, incremental=True)
+        scraper.scrape()
+
+    # The mock site ignores If-None-Match, so the scraper switches to HEAD requests after the first full responses
+    # with a matching ETag: at most one per download thread.
+    assert scraper.head_first
+    assert pool.requests["GET"] <= scraper.concurrency
+    assert pool.requests["HEAD"] + pool.requests["GET"] == 100
+    # Nothing was written again.
+    assert saved_files(output_dir) == saved
+
+
+def test_changed_docs_are_downloaded_and_updated(tmp_path, mock_site, sessions):
+    output_dir = str(tmp_path / "uyusmazlik")
+
+    with mock_site("uyusmazlik", doc_count=30) as site:
+        UyusmazlikScaper(output_dir, base_url=site.url, session_pool=sessions()).scrape()
+
+    # The documents have a new length, so a new ETag.
+    with mock_site("uyusmazlik", doc_count=30, doc_size=3000) as site:
+        pool = counting(sessions())
+        scraper = UyusmazlikScaper(output_dir, base_url=site.url, session_pool=pool, incremental=True)
+        scraper.scrape()
+
+    assert not scraper.head_first
+    assert pool.requests["GET"] == 30
+    for number in range(30):
+        entry = scraper.manifest.get_by_href("Karar/Getir?id=%d" % number)
+        assert entry["etag"] == '"%d-3000"' % number and entry["size"] == 3000
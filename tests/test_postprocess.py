@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pytest
+
+from scrapers import postprocess
+from scrapers.mevzuat_scraper import MevzuatScraper
+from scrapers.postprocess import PostProcessor, EXTRACTORS, OLE_MAGIC, detect_content_type, extract_doc
+
+WORD_DOC = OLE_MAGIC + b"\xa1\xb1\x1a\xe1" + b"\x00" * 504
+
+
+def test_doc_downloads_have_an_extractor():
+    assert detect_content_type("application/msword", b"") == "application/msword"
+    assert detect_content_type(None, WORD_DOC) == "application/msword"
+    assert EXTRACTORS["application/msword"] is extract_doc
+
+
+def test_doc_that_is_html_or_text_is_extracted_without_a_tool(monkeypatch):
+    monkeypatch.setattr(postprocess, "doc_to_text_command", None)
+    html = "<html><body><p>Madde 1 – Amaç</p><script>x()</script></body></html>".encode("utf-8")
+    assert extract_doc(html) == "Madde 1 – Amaç"
+    assert extract_doc("Kanun metni".encode("windows-1254")) == "Kanun metni"
+
+
+def test_word_doc_needs_a_tool(monkeypatch):
+    monkeypatch.setattr(postprocess, "doc_to_text_command", None)
+    with pytest.raises(RuntimeError, match="antiword or catdoc"):
+        extract_doc(WORD_DOC)
+
+
+def test_word_doc_is_converted_by_the_tool(monkeypatch):
+    # Stands in for antiword: prints the size of the file it is given.
+    command = (sys.executable, "-c", "import os, sys; print(os.path.getsize(sys.argv[1]))")
+    monkeypatch.setattr(postprocess, "doc_to_text_command", command)
+    assert extract_doc(WORD_DOC).strip() == str(len(WORD_DOC))
+
+
+def test_mevzuat_docs_are_extracted(tmp_path, mock_site, sessions):
+    output_dir = str(tmp_path / "mevzuat")
+    with mock_site("mevzuat", doc_count=20) as site:
+        postprocessor = PostProcessor(output_dir, workers=1)
+        scraper = MevzuatScraper(output_dir, base_url=site.url, session_pool=sessions(), postprocessor=postprocessor)
+        scraper.scrape()
+        postprocessor.close()
+
+    texts = [name for name in os.listdir(output_dir) if name.endswith(".txt")]
+    assert len(texts) == 20
+    with open(os.path.join(output_dir, texts[0]), encoding="utf-8") as f:
+        assert f.read().startswith("Belge ")
@@ -0,0 +1,63 @@
+import time
+
+import pytest
+
+from scrapers.rate_limiter import HostLimiter
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    monkeypatch.setattr(HostLimiter, "INITIAL_BACKOFF", 0.05)
+    monkeypatch.setattr(HostLimiter, "DECREASE_INTERVAL", 0.0)
+    return HostLimiter(rate=1000.0, max_rate=1000.0)
+
+
+def test_reported_failure_after_a_200_pauses_the_host(limiter):
+    limiter.acquire()
+    limiter.release(200, 0.01)
+    limiter.report_failure()
+
+    assert limiter.blocked_for() > 0
+
+
+def test_retries_of_empty_200_responses_back_off_longer_each_time(limiter):
+    # scraper.py on_error: every retry is answered with a 200 without data, and reported as a failure.
+    pauses = []
+    for attempt in range(4):
+        limiter.report_failure()
+        pauses.append(limiter.blocked_for())
+        limiter.acquire()
+        limiter.release(200, 0.01)
+
+    assert all(pause > 0 for pause in pauses)
+    assert pauses[3] > pauses[0] * 4
+
+
+def test_isolated_server_error_does_not_pause_the_host(limiter):
+    limiter.acquire()
+    limiter.release(503, 0.01)
+    assert limiter.blocked_for() == 0
+
+    limiter.acquire()
+    limiter.release(503, 0.01)
+    assert limiter.blocked_for() > 0
+
+
+def test_throttling_pauses_the_host_at_once(limiter):
+    limiter.acquire()
+    limiter.release(429, 0.01)
+    assert limiter.blocked_for() > 0
+
+
+def test_rate_recovers_quickly_after_a_sporadic_error(monkeypatch):
+    monkeypatch.setattr(HostLimiter, "DECREASE_INTERVAL", 0.0)
+    limiter = HostLimiter(rate=20.0, max_rate=50.0, concurrency=8)
+    limiter.acquire()
+    limiter.release(503, 0.01)
+    assert limiter.rate == 10.0
+
+    # With a flat increase of RATE_INCREASE per success, 10 successes would only bring it back to 11.
+    for _ in range(10):
+        limiter.in_flight += 1
+        limiter.release(200, 0.01)
+    assert limiter.rate > 14.0
@@ -0,0 +1,98 @@
+import os
+
+import pytest
+import requests
+
+from benchmarks.mock_sites import doc_body
+from scrapers.manifest import Manifest
+from scrapers.response_cache import ResponseCache, SegmentSlice, CacheMiss, RECORD, REPLAY
+from scrapers.uyusmazlik_scraper import UyusmazlikScaper
+
+
+@pytest.fixture
+def slice_reads(monkeypatch):
+    """Records the sizes that the bodies of cached responses are read with."""
+    sizes = []
+    read = SegmentSlice.read
+
+    def record_read(self, size=-1, **kwargs):
+        sizes.append(size)
+        return read(self, size, **kwargs)
+
+    monkeypatch.setattr(SegmentSlice, "read", record_read)
+    return sizes
+
+
+def saved_docs(output_dir):
+    docs = {}
+    for name in os.listdir(output_dir):
+        if not name.startswith("."):
+            with open(os.path.join(output_dir, name), "rb") as f:
+                docs[name] = f.read()
+    return docs
+
+
+def test_recorded_body_is_streamed_back(tmp_path, mock_site, slice_reads):
+    cache = ResponseCache(str(tmp_path / "cache"), RECORD)
+    with mock_site("uyusmazlik", doc_size=1_000_000) as site:
+        url = site.url + "Karar/Getir?id=7"
+        response = cache.put("GET", url, None, requests.get(url, stream=True))
+
+    body = doc_body(7, 1_000_000)
+    # The response returned by put reads the recorded body, in the chunks it is consumed with.
+    assert b"".join(response.iter_content(64 * 1024)) == body
+    assert slice_reads and max(slice_reads) <= 64 * 1024
+    assert response.headers["Content-Length"] == "1000000"
+    assert not os.listdir(cache.download_dir)
+
+    replayed = cache.get("GET", url)
+    assert replayed.status_code == 200 and replayed.content == body
+    assert replayed.headers["ETag"] == '"7-1000000"'
+    assert replayed.raw.file is None
+    assert cache.get("POST", url) is None
+
+    with open(cache.segment_path(1), "rb") as f:
+        assert f.read(10) == b"WARC/1.0\r\n"
+    cache.close()
+
+
+def test_closing_a_response_closes_its_segment(tmp_path, mock_site):
+    cache = ResponseCache(str(tmp_path / "cache"), RECORD)
+    with mock_site("uyusmazlik") as site:
+        url = site.url + "Karar/Getir?id=1"
+        cache.put("GET", url, None, requests.get(url, stream=True)).close()
+
+    response = cache.get("GET", url)
+    assert response.raw.read(10) == doc_body(1, 2000)[:10]
+    response.close()
+    assert response.raw.file is None
+    cache.close()
+
+
+def test_crawl_is_replayed_offline(tmp_path, mock_site, sessions):
+    cache_dir = str(tmp_path / "cache")
+    recorded_dir = str(tmp_path / "recorded")
+    replayed_dir = str(tmp_path / "replayed")
+
+    with mock_site("uyusmazlik", doc_count=30, doc_size=50_000) as site:
+        cache = ResponseCache(cache_dir, RECORD)
+        UyusmazlikScaper(recorded_dir, base_url=site.url, session_pool=sessions(cache=cache)).scrape()
+        cache.close()
+        url = site.url
+
+    # The site is gone: every request is served from the cache.
+    cache = ResponseCache(cache_dir, REPLAY, offline=True)
+    replayed = UyusmazlikScaper(replayed_dir, base_url=url, session_pool=sessions(cache=cache))
+    replayed.scrape()
+
+    assert len(replayed.manifest) == 30
+    assert saved_docs(replayed_dir).keys() == saved_docs(recorded_dir).keys()
+    recorded = Manifest.open(recorded_dir)
+    for number in range(30):
+        href = "Karar/Getir?id=%d" % number
+        assert replayed.manifest.get_by_href(href)["content_hash"] == recorded.get_by_href(href)["content_hash"]
+    recorded.close()
+
+    with pytest.raises(CacheMiss):
+        sessions(cache=cache).get(url + "Karar/Getir?id=99")
+    cache.close()
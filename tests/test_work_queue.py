@@ -0,0 +1,78 @@
+import os
+import time
+
+import scraper
+from scraper import CommonXScraper
+from scrapers.work_queue import PageRangeQueue
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    queue = PageRangeQueue(str(tmp_path / "ranges.sqlite"), lease_seconds=0.2)
+    queue.add_ranges("crawl", 1, 101, range_size=50)
+
+    stuck = queue.claim("crawl", "stuck")
+    other = queue.claim("crawl", "other")
+    assert (stuck.start, other.start) == (1, 51)
+    assert queue.claim("crawl", "idle") is None
+
+    time.sleep(0.3)
+    assert queue.renew(other, "other")
+    taken_over = queue.claim("crawl", "idle")
+    assert taken_over.start == stuck.start
+
+    # The stuck worker lost the range: it can neither renew nor complete it.
+    assert not queue.renew(stuck, "stuck")
+    queue.complete(stuck, "stuck")
+    assert queue.progress("crawl") == {"done": 0, "leased": 2, "pending": 0}
+
+    queue.complete(taken_over, "idle")
+    queue.complete(other, "other")
+    assert queue.progress("crawl") == {"done": 2, "leased": 0, "pending": 0}
+    assert queue.claim("crawl", "idle") is None
+
+
+def test_released_range_is_claimed_again_after_the_delay(tmp_path):
+    queue = PageRangeQueue(str(tmp_path / "ranges.sqlite"))
+    queue.add_ranges("crawl", 1, 51)
+
+    lease = queue.claim("crawl", "worker")
+    queue.release(lease, "worker", delay=0.2)
+    assert queue.claim("crawl", "worker") is None
+    assert queue.progress("crawl") == {"done": 0, "leased": 0, "pending": 1}
+
+    time.sleep(0.3)
+    assert queue.claim("crawl", "worker") == lease
+    # Adding the ranges again does not reset them.
+    queue.add_ranges("crawl", 1, 51)
+    assert queue.progress("crawl")["leased"] == 1
+
+
+class FailingPageScraper(CommonXScraper):
+    failing_pages = ()
+
+    def send_request(self, page):
+        if page in self.failing_pages:
+            return None
+        return super().send_request(page)
+
+
+def test_range_with_failed_pages_is_not_completed(tmp_path, mock_site, sessions, fast_retries, monkeypatch):
+    monkeypatch.setattr(scraper, "SKIPPED_RANGE_DELAY", 0.2)
+    queue = PageRangeQueue(str(tmp_path / "ranges.sqlite"))
+    page_path = str(tmp_path / "pages")
+
+    with mock_site("commonx", doc_count=500) as site:
+        first = FailingPageScraper(site.url + "aramalist", page_path, session_pool=sessions(), work_queue=queue)
+        first.failing_pages = (3,)
+        first.scrape()
+
+        assert len(first.manifest) == 4
+        assert queue.progress(first.url)["done"] == 0
+
+        time.sleep(0.3)
+        second = FailingPageScraper(site.url + "aramalist", page_path, session_pool=sessions(), work_queue=queue)
+        second.scrape()
+
+    assert len(second.manifest) == 5
+    assert len([name for name in os.listdir(page_path) if name.endswith(".txt")]) == 5
+    assert queue.progress(first.url) == {"done": 1, "leased": 0, "pending": 0}
@@ -0,0 +1,155 @@
+import os
+import stat
+import threading
+import time
+
+import pytest
+
+from scrapers.storage import JsonFileStorage
+from scrapers.uyusmazlik_scraper import UyusmazlikScaper
+from scrapers.writer import WriteBehind
+
+
+class DiskEvents:
+    """Records the fsyncs, renames and commit callbacks of the writer, in order. Files are identified by their inode."""
+
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+
+    def record(self, kind, inode):
+        with self.lock:
+            self.events.append((kind, inode))
+
+    def kinds(self):
+        return [kind for kind, _ in self.events]
+
+    def on_commit(self, path):
+        return lambda: self.record("commit", os.stat(path).st_ino)
+
+
+@pytest.fixture
+def disk_events(monkeypatch):
+    events = DiskEvents()
+    fsync, replace = os.fsync, os.replace
+
+    def record_fsync(fd):
+        info = os.fstat(fd)
+        events.record("fsync_dir" if stat.S_ISDIR(info.st_mode) else "fsync", info.st_ino)
+        fsync(fd)
+
+    def record_replace(source, destination):
+        events.record("replace", os.stat(source).st_ino)
+        replace(source, destination)
+
+    monkeypatch.setattr(os, "fsync", record_fsync)
+    monkeypatch.setattr(os, "replace", record_replace)
+    return events
+
+
+def write_text(text):
+    return lambda f: f.write(text)
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def temporary_files(directory):
+    return [name for name in os.listdir(directory) if name.endswith(".tmp")]
+
+
+def test_files_are_fsynced_before_they_are_renamed_and_committed(tmp_path, disk_events):
+    paths = [str(tmp_path / ("doc-%d.json" % i)) for i in range(5)]
+
+    # A long interval, so that the five files are committed together by flush.
+    writer = WriteBehind(fsync_interval=60)
+    for i, path in enumerate(paths):
+        writer.write(path, write_text("doc %d" % i), on_commit=disk_events.on_commit(path))
+    writer.flush()
+    writer.close()
+
+    assert [read(path) for path in paths] == ["doc %d" % i for i in range(5)]
+    assert not temporary_files(tmp_path)
+
+    # One directory fsync for the batch, after every rename and before the first callback.
+    assert disk_events.kinds() == ["fsync", "replace"] * 5 + ["fsync_dir"] + ["commit"] * 5
+    inodes = [inode for kind, inode in disk_events.events if kind != "fsync_dir"]
+    for i in range(5):
+        # Each file is fsync'ed, renamed and committed as the same inode.
+        assert inodes[2 * i] == inodes[2 * i + 1] == inodes[10 + i]
+
+
+def test_files_are_not_in_place_before_they_are_committed(tmp_path):
+    path = str(tmp_path / "doc.json")
+    committed = threading.Event()
+
+    writer = WriteBehind(fsync_interval=60)
+    writer.write(path, write_text("new"), on_commit=committed.set)
+    time.sleep(0.2)
+    assert not os.path.exists(path) and not committed.is_set()
+
+    writer.flush()
+    assert read(path) == "new" and committed.is_set()
+    writer.close()
+
+
+def test_full_batches_are_committed_without_flush(tmp_path, disk_events):
+    writer = WriteBehind(fsync_interval=60, max_batch=3)
+    committed = threading.Semaphore(0)
+    for i in range(3):
+        path = str(tmp_path / ("doc-%d.json" % i))
+        writer.write(path, write_text("doc"), on_commit=committed.release)
+    for i in range(3):
+        assert committed.acquire(timeout=5)
+    writer.close()
+
+    assert disk_events.kinds().count("fsync_dir") == 1
+
+
+def test_without_fsync_files_are_renamed_right_away(tmp_path, disk_events):
+    writer = WriteBehind(fsync_interval=None)
+    writer.write(str(tmp_path / "doc.json"), write_text("doc"))
+    writer.flush()
+    writer.close()
+
+    assert disk_events.kinds() == ["replace"]
+
+
+def test_flush_raises_the_error_of_a_failed_write(tmp_path):
+    def fail(f):
+        f.write("half")
+        raise OSError("disk full")
+
+    writer = WriteBehind(fsync_interval=60)
+    writer.write(str(tmp_path / "failed.json"), fail)
+    writer.write(str(tmp_path / "doc.json"), write_text("doc"))
+
+    with pytest.raises(OSError, match="disk full"):
+        writer.flush()
+    # The error is raised once, and the other file is committed.
+    writer.flush()
+    writer.close()
+
+    assert not os.path.exists(tmp_path / "failed.json")
+    assert read(tmp_path / "doc.json") == "doc"
+    assert not temporary_files(tmp_path)
+
+    with pytest.raises(RuntimeError):
+        writer.write(str(tmp_path / "late.json"), write_text("late"))
+
+
+def test_crawl_with_a_writer_records_docs_once_they_are_on_disk(tmp_path, mock_site, sessions):
+    output_dir = str(tmp_path / "uyusmazlik")
+    writer = WriteBehind(fsync_interval=0.05)
+    with mock_site("uyusmazlik", doc_count=50) as site:
+        scraper = UyusmazlikScaper(output_dir, base_url=site.url, session_pool=sessions(), storage=JsonFileStorage(output_dir, writer))
+        scraper.scrape()
+    writer.close()
+
+    assert len(scraper.manifest) == 50
+    for number in range(50):
+        entry = scraper.manifest.get_by_href("Karar/Getir?id=%d" % number)
+        assert os.path.getsize(os.path.join(output_dir, entry["doc_name"] + ".json")) > 0
+    assert not temporary_files(output_dir)